@@ -5,7 +5,12 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+from unittest import mock
+
+import requests
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from . import views
 
 
 class SimpleTest(TestCase):
@@ -14,3 +19,78 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+URLS_XML = '''
+<urls>
+  <url type="read">http://attachments.test/fileget</url>
+  <url type="write">http://attachments.test/fileupload</url>
+  <url type="delete">http://attachments.test/filedelete</url>
+  <url type="testkey">http://attachments.test/testkey</url>
+</urls>
+'''
+
+def response(status_code=200, text='', timestamp=None):
+    r = mock.Mock(status_code=status_code, text=text)
+    r.headers = {} if timestamp is None else {'X-Timestamp': str(timestamp)}
+    return r
+
+@override_settings(WEB_ATTACHMENT_URL='http://attachments.test/web_asset_store.xml',
+                   WEB_ATTACHMENT_KEY='test key')
+class AttachmentGatewayInitTests(SimpleTestCase):
+    def setUp(self):
+        for name, value in (('_initialized', False), ('server_urls', None), ('server_time_delta', None)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(views, 'schedule_refresh')
+        self.schedule_refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_initialized_once_on_first_use(self):
+        with mock.patch.object(views, 'init') as init:
+            views.ensure_initialized()
+            views.ensure_initialized()
+        init.assert_called_once_with()
+        self.schedule_refresh.assert_called_once_with()
+
+    @override_settings(WEB_ATTACHMENT_URL=None)
+    def test_no_server_configured(self):
+        with mock.patch('requests.get') as get:
+            views.ensure_initialized()
+        get.assert_not_called()
+        self.schedule_refresh.assert_not_called()
+        self.assertIsNone(views.server_urls)
+
+    def test_settings_fetched(self):
+        with mock.patch('requests.get', side_effect=[
+                response(text=URLS_XML, timestamp=1000000000),
+                response()]) as get:
+            views.ensure_initialized()
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(views.server_urls['read'], 'http://attachments.test/fileget')
+        self.assertIsNotNone(views.server_time_delta)
+
+    def test_settings_fetch_fails(self):
+        with mock.patch('requests.get', side_effect=requests.ConnectionError):
+            views.ensure_initialized()
+        self.assertIsNone(views.server_urls)
+        # The refresh is still scheduled so the server is retried later.
+        self.schedule_refresh.assert_called_once_with()
+
+    def test_settings_fetch_error_status(self):
+        with mock.patch('requests.get', return_value=response(status_code=500)):
+            views.ensure_initialized()
+        self.assertIsNone(views.server_urls)
+
+    def test_bad_key(self):
+        with mock.patch('requests.get', side_effect=[
+                response(text=URLS_XML, timestamp=1000000000),
+                response(status_code=403)]):
+            views.init()
+        self.assertIsNone(views.server_urls)
+
+    def test_refresh_failure_rescheduled(self):
+        with mock.patch.object(views, 'init', side_effect=RuntimeError):
+            views.refresh()
+        self.schedule_refresh.assert_called_once_with()
@@ -1,7 +1,9 @@
 from uuid import uuid4
 from xml.etree import ElementTree
 from os.path import splitext
+from threading import Lock, Timer
 import requests, time, hmac, json
+import logging
 
 from django.http import HttpResponse
 from django.views.decorators.http import require_GET
@@ -10,9 +12,22 @@ from django.conf import settings
 
 from specifyweb.specify.views import login_maybe_required
 
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the attachment server to respond.
+REQUEST_TIMEOUT = 10
+
+# The server urls and the server's clock offset are fetched the first
+# time they are needed, then refreshed in the background every
+# REFRESH_INTERVAL seconds so requests don't wait on the server.
+REFRESH_INTERVAL = 15 * 60
+
 server_urls = None
 server_time_delta = None
 
+_initialized = False
+_init_lock = Lock()
+
 class AttachmentError(Exception):
     pass
 
@@ -28,6 +43,7 @@ def get_collection():
 @require_GET
 @cache_control(max_age=86400, private=True)
 def get_settings(request):
+    ensure_initialized()
     if server_urls is None:
         return HttpResponse("{}", content_type='application/json')
 
@@ -42,6 +58,7 @@ def get_settings(request):
 @require_GET
 def get_token(request):
     filename = request.GET['filename']
+    ensure_initialized()
     token = generate_token(get_timestamp(), filename)
     return HttpResponse(token, content_type='text/plain')
 
@@ -50,6 +67,7 @@ def get_token(request):
 def get_upload_params(request):
     filename = request.GET['filename']
     attch_loc = make_attachment_filename(filename)
+    ensure_initialized()
     data = {
         'attachmentlocation': attch_loc,
         'token': generate_token(get_timestamp(), attch_loc)
@@ -62,12 +80,13 @@ def make_attachment_filename(filename):
     return uuid + extension
 
 def delete_attachment_file(attch_loc):
+    ensure_initialized()
     data = {
         'filename': attch_loc,
         'coll': get_collection(),
         'token': generate_token(get_timestamp(), attch_loc)
         }
-    r = requests.post(server_urls["delete"], data=data)
+    r = requests.post(server_urls["delete"], data=data, timeout=REQUEST_TIMEOUT)
     update_time_delta(r)
     if r.status_code not in (200, 404):
         raise AttachmentError("Deletion failed: " + r.text)
@@ -92,13 +111,44 @@ def update_time_delta(response):
     global server_time_delta
     server_time_delta = int(timestamp) - int(time.time())
 
+def ensure_initialized():
+    """Fetch the server settings if that hasn't been done yet in this
+    process and start refreshing them periodically.
+    """
+    global _initialized
+    if _initialized: return
+    with _init_lock:
+        if _initialized: return
+        init()
+        _initialized = True
+        if settings.WEB_ATTACHMENT_URL not in (None, ''):
+            schedule_refresh()
+
+def schedule_refresh():
+    timer = Timer(REFRESH_INTERVAL, refresh)
+    timer.daemon = True
+    timer.start()
+
+def refresh():
+    try:
+        init()
+    except Exception:
+        logger.exception("refreshing attachment server settings failed")
+    finally:
+        schedule_refresh()
+
 def init():
     global server_urls
 
     if settings.WEB_ATTACHMENT_URL in (None, ''):
         return
 
-    r = requests.get(settings.WEB_ATTACHMENT_URL)
+    try:
+        r = requests.get(settings.WEB_ATTACHMENT_URL, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        logger.warning("couldn't reach attachment server at %s", settings.WEB_ATTACHMENT_URL, exc_info=True)
+        return
+
     if r.status_code != 200:
         return
 
@@ -109,19 +159,25 @@ def init():
     except:
         return
 
-    server_urls = {url.attrib['type']: url.text
-                   for url in urls_xml.findall('url')}
+    urls = {url.attrib['type']: url.text
+            for url in urls_xml.findall('url')}
 
     try:
-        test_key()
+        test_key(urls)
+    except requests.RequestException:
+        logger.warning("couldn't test attachment server key", exc_info=True)
+        return
     except AttachmentError:
         server_urls = None
+    else:
+        server_urls = urls
 
-def test_key():
+def test_key(urls):
     random = str(uuid4())
     token = generate_token(get_timestamp(), random)
-    r = requests.get(server_urls["testkey"],
-                     params={'random': random, 'token': token})
+    r = requests.get(urls["testkey"],
+                     params={'random': random, 'token': token},
+                     timeout=REQUEST_TIMEOUT)
 
     if r.status_code == 200:
         return
@@ -129,6 +185,3 @@ def test_key():
         raise AttachmentError("Bad attachment key.")
     else:
         raise AttachmentError("Attachment key test failed.")
-
-init()
-
@@ -2,7 +2,7 @@ from .orm_signal_handler import orm_signal_handler
 
 from django.db import connection
 
-from specifyweb.specify import models
+from specifyweb.specify import models, recordset_index
 from specifyweb.specify.models import Recordsetitem
 
 @orm_signal_handler('post_delete')
@@ -24,3 +24,16 @@ def recordset_pre_save(recordset):
 def recordset_pre_delete(recordset):
     cursor = connection.cursor()
     cursor.execute("delete from recordsetitem where recordsetid = %s", [recordset.id])
+    recordset_index.invalidate_on_commit(recordset.id)
+
+@orm_signal_handler('post_save', 'Recordset')
+def recordset_post_save(recordset):
+    recordset_index.invalidate_on_commit(recordset.id)
+
+@orm_signal_handler('post_save', 'Recordsetitem')
+def recordsetitem_post_save(rsi):
+    recordset_index.invalidate_on_commit(rsi.recordset_id)
+
+@orm_signal_handler('post_delete', 'Recordsetitem')
+def recordsetitem_post_delete(rsi):
+    recordset_index.invalidate_on_commit(rsi.recordset_id)
@@ -4,12 +4,17 @@ database or the filesystem with database resources taking precedence over the fi
 """
 import os, errno
 import logging
+from collections import namedtuple
 from xml.etree import ElementTree
 from xml.sax.saxutils import quoteattr
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from specifyweb.specify.models import Spappresourcedir, Spappresourcedata
+from specifyweb.specify.models import Spappresourcedir, Spappresourcedata, Spappresource
+from specifyweb.specify.cache import ProcessCache, file_mtime, files_unchanged
 
 logger = logging.getLogger(__name__)
 
@@ -27,41 +32,84 @@ disciplines = ElementTree.parse(disc_file)
 discipline_dirs = dict( (disc.attrib['name'], disc.attrib.get('folder', disc.attrib['name']))
     for disc in disciplines.findall('discipline') )
 
+# Resolved resources are cached by collection, user and resource name.
+# Changes to resources in the database made by this process invalidate
+# the cache through the signal handlers below, and changes to the files
+# a resource was resolved from are detected by their mtimes. Changes
+# made by other processes are seen once the entry expires.
+RESOURCE_TTL = 60
+
+ResolvedResource = namedtuple('ResolvedResource', 'resource level files')
+
+_resources = ProcessCache('app resources', maxsize=1000, ttl=RESOURCE_TTL)
+
 # get_app_resource is the main interface provided by this module
 def get_app_resource(collection, user, resource_name):
     """Fetch the named app resource in the context of the given user and collection.
     Returns the resource data and mimetype as a pair.
     """
+    key = (collection and collection.id, user and user.id, get_usertype(user), resource_name)
+    resolved = _resources.get(key,
+                              lambda: resolve_app_resource(collection, user, resource_name),
+                              lambda resolved: files_unchanged(resolved.files))
+    return resolved.resource
+
+def resolve_app_resource(collection, user, resource_name):
+    """Find the named app resource by traversing the hierarchy.
+    Returns a ResolvedResource giving the resource data and mimetype,
+    the level it was found at and the files that were consulted.
+    """
     logger.info('looking for app resource %r for user %s in %s',
                 resource_name, user and user.name, collection and collection.collectionname)
+    files = []
     # Traverse the hierarchy.
     for level in DIR_LEVELS:
         # First look in the database.
         from_db = get_app_resource_from_db(collection, user, level, resource_name)
-        if from_db is not None: return from_db
+        if from_db is not None: return ResolvedResource(from_db, level, files)
 
         # If resource was not found, look on the filesystem.
-        from_fs = load_resource_at_level(collection, user, level, resource_name)
-        if from_fs is not None: return from_fs
+        from_fs = load_resource_at_level(collection, user, level, resource_name, files)
+        if from_fs is not None: return ResolvedResource(from_fs, level, files)
         # Continue to next higher level of hierarchy.
 
     # resource was not found
-    return None
+    return ResolvedResource(None, None, files)
+
+def app_resource_cache_stats():
+    return _resources.stats()
+
+def invalidate_app_resources():
+    _resources.invalidate()
+
+@receiver(post_save, sender=Spappresourcedata)
+@receiver(post_delete, sender=Spappresourcedata)
+@receiver(post_save, sender=Spappresource)
+@receiver(post_delete, sender=Spappresource)
+@receiver(post_save, sender=Spappresourcedir)
+@receiver(post_delete, sender=Spappresourcedir)
+def app_resource_changed(sender, **kwargs):
+    # Invalidate again on commit so a resource reloaded in the
+    # meantime from uncommitted data isn't kept.
+    invalidate_app_resources()
+    transaction.on_commit(invalidate_app_resources)
 
 def get_usertype(user):
     return user and user.usertype and user.usertype.replace(' ', '').lower()
 
-def load_resource_at_level(collection, user, level, resource_name):
+def load_resource_at_level(collection, user, level, resource_name, files=None):
     """Try to load a resource from the filesystem at a given
     level of the resource hierarchy.
     Returns the resource data and mimetype as a pair.
+    If a list 'files' is given, the (pathname, mtime) pairs of
+    the files consulted are added to it.
     """
     logger.info('looking in FS at level: %s', level)
     path = get_path_for_level(collection, user, level)
     if path is None: return None
-    registry = load_registry(path)
+    registry = load_registry(path, files=files)
     if registry is None: return None
-    return load_resource(path, registry, resource_name)
+    return load_resource(path, registry, resource_name, files)
 
 def get_path_for_level(collection, user, level):
     """Build the filesystem path for a given resource level."""
@@ -79,18 +127,19 @@ def get_path_for_level(collection, user, level):
     if path:
         return os.path.join(settings.SPECIFY_CONFIG_DIR, *path)
 
-def load_registry(path, registry_filename='app_resources.xml'):
+def load_registry(path, registry_filename='app_resources.xml', files=None):
     """Loads the registry file from a directory on the filesystem.
     The registry maps resource names to filename in the directory.
     """
     pathname = os.path.join(path, registry_filename)
+    if files is not None: files.append((pathname, file_mtime(pathname)))
     try:
         return ElementTree.parse(pathname)
     except IOError as e:
         if e.errno == errno.ENOENT: return None
         else: raise
 
-def load_resource(path, registry, resource_name):
+def load_resource(path, registry, resource_name, files=None):
     """Try to load the named resource using the given directory
     and registry.
     Returns the resource data and mimetype as a pair.
@@ -98,6 +147,7 @@ def load_resource(path, registry, resource_name):
     resource = registry.find('file[@name=%s]' % quoteattr(resource_name))
     if resource is None: return None
     pathname = os.path.join(path, resource.attrib['file'])
+    if files is not None: files.append((pathname, file_mtime(pathname)))
     try:
         return (open(pathname).read(), resource.attrib['mimetype'])
     except IOError as e:
@@ -0,0 +1,60 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from specifyweb.specify.models import Collection, Specifyuser
+from specifyweb.context import viewsets, app_resource
+from specifyweb.context.views import view
+
+class Command(BaseCommand):
+    help = 'Measures the latency of /context/view.json with cold and warm view caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='name of the specify user to fetch the views as')
+        parser.add_argument('collectionid', type=int, help='id of the collection to fetch the views in')
+        parser.add_argument(
+            'views',
+            nargs='*',
+            default=['CollectionObject', 'Accession', 'Loan', 'Taxon', 'Agent'],
+            help='names of the views to fetch',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='number of times to fetch each view',
+        )
+
+    def handle(self, **options):
+        try:
+            user = Specifyuser.objects.get(name=options['username'])
+            collection = Collection.objects.get(id=options['collectionid'])
+        except (Specifyuser.DoesNotExist, Collection.DoesNotExist) as e:
+            raise CommandError(e)
+
+        factory = RequestFactory()
+
+        def fetch(name):
+            request = factory.get('/context/view.json', {'name': name})
+            request.user = user
+            request.specify_user = user
+            request.specify_collection = collection
+            start = default_timer()
+            view(request)
+            return default_timer() - start
+
+        def cold(name):
+            viewsets.invalidate_views(parsed=True)
+            app_resource.invalidate_app_resources()
+            return fetch(name)
+
+        for name in options['views']:
+            cold_times = [cold(name) for _ in range(options['repeat'])]
+            fetch(name)
+            warm_times = [fetch(name) for _ in range(options['repeat'])]
+            self.stdout.write('%s: cold %.1fms, warm %.2fms' % (
+                name, 1000 * min(cold_times), 1000 * min(warm_times)))
+
+        for stats in viewsets.view_cache_stats():
+            self.stdout.write('%(name)s cache: %(size)d entries, %(hits)d hits, %(misses)d misses' % stats)
@@ -1,10 +1,136 @@
+from collections import namedtuple
+
 from django.http import HttpResponseBadRequest
 from django.utils.functional import SimpleLazyObject
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from specifyweb.specify.models import Collection, Specifyuser, Agent
+from specifyweb.specify.models import (
+    Collection, Discipline, Division, Institution, Specifyuser, Spprincipal, Agent)
 from specifyweb.specify.filter_by_col import filter_by_collection
+from specifyweb.specify.model_extras import invalidate_admins
+from specifyweb.specify.cache import ProcessCache
+
+# The collection, agent and available collections looked up for each
+# request are cached by user and collection so most requests need no
+# queries for them. Model instances are cached as Snapshots of their
+# field values, from which each request gets its own instances. Changes
+# made in this process invalidate the entries holding or depending on
+# the changed object through the signal handlers below; other
+# processes' changes are seen once the entry expires.
+CONTEXT_TTL = 30
+
+_contexts = ProcessCache('request context', maxsize=1000, ttl=CONTEXT_TTL)
+
+# The field values of a model instance and the Snapshots of the related
+# objects loaded with it, by field name.
+Snapshot = namedtuple('Snapshot', 'model db values related')
+
+def snapshot(obj, related=None):
+    """Return a Snapshot of the model instance 'obj', or None if it is
+    None, including the objects along the 'related' lookup path, such as
+    'discipline__division', which must have been loaded with it.
+    """
+    if obj is None:
+        return None
+    names = related.split('__', 1) if related else []
+    return Snapshot(obj.__class__, obj._state.db,
+                    tuple(getattr(obj, field.attname) for field in obj._meta.concrete_fields),
+                    {names[0]: snapshot(getattr(obj, names[0]), names[1] if len(names) > 1 else None)}
+                    if names else {})
+
+def restore(snap):
+    """Return a new model instance from the Snapshot 'snap', with new
+    instances of the related objects in it, or None if it is None.
+    """
+    if snap is None:
+        return None
+    obj = snap.model.from_db(snap.db, [field.attname for field in snap.model._meta.concrete_fields], snap.values)
+    for name, related in snap.related.items():
+        setattr(obj, name, restore(related))
+    return obj
+
+def holds(snap, model, id):
+    "Return True if the Snapshot 'snap' or a related one is of the 'model' object with 'id'."
+    if not isinstance(snap, Snapshot):
+        return False
+    return (snap.model is model and snap.values[snap.model._meta.concrete_fields.index(model._meta.pk)] == id
+            or any(holds(related, model, id) for related in snap.related.values()))
+
+def cached_context(key, compute):
+    return _contexts.get(key, compute)
+
+def context_cache_stats():
+    return _contexts.stats()
+
+def invalidate_context(model=None, id=None, user_ids=()):
+    """Remove the cached entries holding the object of 'model' with 'id'
+    or depending on it, and those and the administrator status of the
+    users with 'user_ids'. Everything is removed if neither is given.
+    """
+    if model is None and not user_ids:
+        _contexts.invalidate()
+        invalidate_admins()
+        return
+
+    def stale(key):
+        kind = key[0]
+        if kind in ('agent', 'collections') and key[1] in user_ids:
+            return True
+        if model is Collection:
+            # A new collection may become the default one, and the lists of
+            # available collections include the names.
+            if key == ('collection', None) or kind == 'agent' and key[2] == id:
+                return True
+            if kind == 'collections':
+                return any(row[0] == id for row in _contexts.peek(key, ()))
+        return holds(_contexts.peek(key), model, id)
 
+    _contexts.invalidate_where(stale)
+    for user_id in user_ids:
+        invalidate_admins(user_id)
+
+def invalidate_context_on_commit(model=None, id=None, user_ids=()):
+    """Invalidate the cache now and again when the current transaction
+    commits, so entries reloaded in the meantime from uncommitted data
+    aren't kept.
+    """
+    invalidate_context(model, id, user_ids)
+    transaction.on_commit(lambda: invalidate_context(model, id, user_ids))
+
+def affected_user_ids(instance):
+    """Return the ids of the users whose context depends on 'instance'
+    other than through the objects cached for them.
+    """
+    if isinstance(instance, Specifyuser):
+        return {instance.id}
+    if isinstance(instance, Agent):
+        return {instance.specifyuser_id} - {None}
+    if isinstance(instance, Spprincipal):
+        with connection.cursor() as cursor:
+            cursor.execute("select specifyuserid from specifyuser_spprincipal where spprincipalid = %s",
+                           [instance.id])
+            return {user_id for user_id, in cursor.fetchall()}
+    return set()
+
+@receiver(post_save, sender=Specifyuser)
+@receiver(post_delete, sender=Specifyuser)
+@receiver(post_save, sender=Spprincipal)
+@receiver(post_delete, sender=Spprincipal)
+@receiver(post_save, sender=Agent)
+@receiver(post_delete, sender=Agent)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+@receiver(post_save, sender=Discipline)
+@receiver(post_delete, sender=Discipline)
+@receiver(post_save, sender=Division)
+@receiver(post_delete, sender=Division)
+@receiver(post_save, sender=Institution)
+@receiver(post_delete, sender=Institution)
+def context_changed(sender, instance, **kwargs):
+    invalidate_context_on_commit(sender, instance.id, affected_user_ids(instance))
 
 def get_cached(attr, func, request):
     if not hasattr(request, attr):
@@ -15,27 +141,42 @@ def get_user(request):
     if request.user.is_authenticated:
         return request.user
     elif settings.ANONYMOUS_USER:
-        return Specifyuser.objects.get(name=settings.ANONYMOUS_USER)
+        return restore(cached_context(
+            ('anonymous user', settings.ANONYMOUS_USER),
+            lambda: snapshot(Specifyuser.objects.get(name=settings.ANONYMOUS_USER))))
     else:
         return None
 
 def get_collection(request):
-    qs = Collection.objects.select_related('discipline',
-                                           'discipline__division',
-                                           'discipline__division__institution')
-
     try:
         collection_id = int(request.COOKIES.get('collection', ''))
     except ValueError:
+        collection_id = None
+    return restore(cached_context(
+        ('collection', collection_id),
+        lambda: snapshot(load_collection(collection_id), 'discipline__division__institution')))
+
+def load_collection(collection_id):
+    qs = Collection.objects.select_related('discipline',
+                                           'discipline__division',
+                                           'discipline__division__institution')
+    if collection_id is None:
         return qs.all()[0]
     else:
         return qs.get(id=collection_id)
 
 def get_agent(request):
+    user = request.specify_user
+    collection = request.specify_collection
+    return restore(cached_context(
+        ('agent', user and user.id, collection.id),
+        lambda: snapshot(load_agent(user, collection), 'specifyuser')))
+
+def load_agent(user, collection):
     try:
-        return filter_by_collection(Agent.objects, request.specify_collection) \
+        return filter_by_collection(Agent.objects, collection) \
             .select_related('specifyuser') \
-            .get(specifyuser=request.specify_user)
+            .get(specifyuser=user)
     except Agent.DoesNotExist:
         return None
 
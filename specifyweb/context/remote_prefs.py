@@ -1,20 +1,80 @@
 from django.utils.encoding import force_text
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from specifyweb.specify.models import Spappresourcedata
+from specifyweb.specify.models import Spappresourcedir, Spappresourcedata, Spappresource
+from specifyweb.specify.cache import ProcessCache
 
+# Parsed preferences are cached by resource directory usertype. Changes
+# to app resources made by this process invalidate the cache through
+# the signal handlers below. Other processes' changes are seen once
+# the entry expires.
+PREFS_TTL = 60
 
-def get_remote_prefs() -> str:
+_prefs = ProcessCache('remote prefs', ttl=PREFS_TTL)
+
+class Preferences(object):
+    """The key=value lines of a preferences resource parsed into a
+    dict. If a key appears more than once the first value is used.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.values = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line[0] in '#!': continue
+            key, sep, value = line.partition('=')
+            if sep:
+                self.values.setdefault(key.strip(), value.strip())
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def get_bool(self, key: str, default: bool) -> bool:
+        value = self.values.get(key, '').lower()
+        return True if value == 'true' else False if value == 'false' else default
+
+    def get_int(self, key: str, default=None):
+        try:
+            return int(self.values[key])
+        except (KeyError, ValueError):
+            return default
+
+def load_prefs(usertype: str) -> Preferences:
     res = Spappresourcedata.objects.filter(
         spappresource__name='preferences',
-        spappresource__spappresourcedir__usertype='Prefs')
+        spappresource__spappresourcedir__usertype=usertype)
 
     # Spappresource.data is stored in a blob field even though we treat
     # it as a TextField. Starting in django 2.2 it doesn't automatically
     # get decoded from bytes to str.
-    return '\n'.join(force_text(r.data) for r in res)
+    return Preferences('\n'.join(force_text(r.data) for r in res))
+
+def parsed_remote_prefs() -> Preferences:
+    return _prefs.get('Prefs', lambda: load_prefs('Prefs'))
+
+def parsed_global_prefs() -> Preferences:
+    return _prefs.get('Global Prefs', lambda: load_prefs('Global Prefs'))
+
+def get_remote_prefs() -> str:
+    return parsed_remote_prefs().text
 
 def get_global_prefs() -> str:
-    res = Spappresourcedata.objects.filter(
-        spappresource__name='preferences',
-        spappresource__spappresourcedir__usertype='Global Prefs')
-    return '\n'.join(force_text(r.data) for r in res)
+    return parsed_global_prefs().text
+
+def invalidate_prefs():
+    _prefs.invalidate()
+
+@receiver(post_save, sender=Spappresourcedata)
+@receiver(post_delete, sender=Spappresourcedata)
+@receiver(post_save, sender=Spappresource)
+@receiver(post_delete, sender=Spappresource)
+@receiver(post_save, sender=Spappresourcedir)
+@receiver(post_delete, sender=Spappresourcedir)
+def prefs_changed(sender, **kwargs):
+    # Invalidate again on commit so a preference reloaded in the
+    # meantime from uncommitted data isn't kept.
+    invalidate_prefs()
+    transaction.on_commit(invalidate_prefs)
@@ -2,22 +2,56 @@ from collections import defaultdict
 import json
 
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from specifyweb.specify.models import (
     Splocalecontainer as Container,
     Splocalecontaineritem as Item,
     Splocaleitemstr as SpString)
+from specifyweb.specify.cache import ProcessCache, make_payload
 
-schema_localization_cache = {}
+# Schema localizations are cached as payloads by discipline, schema
+# type and language. Edits to the localization tables made by this
+# process invalidate the cache through the signal handlers below.
+# Edits made by other processes are seen once the entry expires.
+LOCALIZATION_TTL = 300
+
+_localizations = ProcessCache('schema localization', maxsize=100, ttl=LOCALIZATION_TTL)
 
 def get_schema_localization(collection, schematype):
-    disc = collection.discipline
-    if (disc, schematype) in schema_localization_cache:
-        return schema_localization_cache[(disc, schematype)]
+    """Return the schema localization of the collection's discipline
+    as JSON text.
+    """
+    return get_schema_localization_payload(collection, schematype).content.decode('utf-8')
 
+def get_schema_localization_payload(collection, schematype):
+    """Return the schema localization of the collection's discipline
+    as a Payload carrying the JSON, its ETag and a gzipped copy.
+    """
+    disciplineid = collection.discipline_id
     lang = settings.SCHEMA_LANGUAGE
+    return _localizations.get(
+        (disciplineid, schematype, lang),
+        lambda: make_payload(load_schema_localization(disciplineid, schematype, lang)))
+
+def invalidate_schema_localizations():
+    _localizations.invalidate()
+
+@receiver(post_save, sender=Container)
+@receiver(post_delete, sender=Container)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=SpString)
+@receiver(post_delete, sender=SpString)
+def schema_localization_changed(sender, **kwargs):
+    # Invalidate again on commit so a localization reloaded in the
+    # meantime from uncommitted data isn't kept.
+    invalidate_schema_localizations()
+    transaction.on_commit(invalidate_schema_localizations)
 
+def load_schema_localization(disciplineid, schematype, lang):
     cursor = connection.cursor()
     cursor.execute("""
     select name, format, ishidden!=0, isuiformatter, picklistname, type, aggregator, defaultui, n.text, d.text
@@ -25,7 +59,7 @@ def get_schema_localization(collection, schematype):
     left outer join splocaleitemstr n on n.splocalecontainernameid = splocalecontainerid and n.language = %s
     left outer join splocaleitemstr d on d.splocalecontainerdescid = splocalecontainerid and d.language = %s
     where schematype = %s and disciplineid = %s;
-    """, [lang, lang, schematype, disc.id])
+    """, [lang, lang, schematype, disciplineid])
 
     cfields = ('format', 'ishidden', 'isuiformatter', 'picklistname', 'type', 'aggregator', 'defaultui', 'name', 'desc')
 
@@ -43,13 +77,12 @@ def get_schema_localization(collection, schematype):
     left outer join splocaleitemstr n on n.splocalecontaineritemnameid = item.splocalecontaineritemid and n.language = %s
     left outer join splocaleitemstr d on d.splocalecontaineritemdescid = item.splocalecontaineritemid and d.language = %s
     where schematype = %s and disciplineid = %s;
-    """, [lang, lang, schematype, disc.id])
+    """, [lang, lang, schematype, disciplineid])
 
     ifields = ('format', 'ishidden', 'isuiformatter', 'picklistname', 'type', 'isrequired', 'weblinkname', 'name', 'desc')
 
     for row in cursor.fetchall():
         containers[row[0]]['items'][row[1].lower()] = {field: row[i+2] for i, field in enumerate(ifields)}
 
-    sl = schema_localization_cache[(disc, schematype)] = json.dumps(containers)
-    return sl
+    return json.dumps(containers)
 
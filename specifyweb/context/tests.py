@@ -1,7 +1,13 @@
 
+import gzip
+import json
+
+from django.db import connection
+from django.test import RequestFactory
+
 from specifyweb.specify import models, api
 from specifyweb.specify.api_tests import ApiTests
-from . import viewsets
+from . import viewsets, app_resource, schema_localization, middleware, views, remote_prefs
 
 class ViewTests(ApiTests):
     def setUp(self):
@@ -14,3 +20,155 @@ class ViewTests(ApiTests):
     def test_get_view(self):
         viewsets.get_view(self.collection, self.specifyuser, "CollectionObject")
 
+    def test_get_view_cached(self):
+        viewsets.invalidate_views()
+        data = viewsets.get_view(self.collection, self.specifyuser, "CollectionObject")
+        hits = viewsets.view_cache_stats()[0]['hits']
+        self.assertEqual(viewsets.get_view(self.collection, self.specifyuser, "CollectionObject"), data)
+        self.assertEqual(viewsets.view_cache_stats()[0]['hits'], hits + 1)
+
+class AppResourceTests(ApiTests):
+    def setUp(self):
+        super(AppResourceTests, self).setUp()
+        app_resource.invalidate_app_resources()
+        resourcedir = models.Spappresourcedir.objects.create(
+            collection=self.collection,
+            discipline=self.discipline,
+            ispersonal=False)
+        resource = models.Spappresource.objects.create(
+            level=0,
+            mimetype='text/plain',
+            name='TestResource',
+            spappresourcedir=resourcedir,
+            specifyuser=self.specifyuser)
+        self.resourcedata = models.Spappresourcedata.objects.create(
+            data='original',
+            spappresource=resource)
+
+    def test_cached(self):
+        self.assertEqual(app_resource.get_app_resource(self.collection, self.specifyuser, 'TestResource'),
+                         ('original', 'text/plain'))
+        hits = app_resource.app_resource_cache_stats()['hits']
+        app_resource.get_app_resource(self.collection, self.specifyuser, 'TestResource')
+        self.assertEqual(app_resource.app_resource_cache_stats()['hits'], hits + 1)
+
+    def test_invalidated_on_save(self):
+        app_resource.get_app_resource(self.collection, self.specifyuser, 'TestResource')
+        self.resourcedata.data = 'changed'
+        self.resourcedata.save()
+        self.assertEqual(app_resource.get_app_resource(self.collection, self.specifyuser, 'TestResource'),
+                         ('changed', 'text/plain'))
+
+class SchemaLocalizationTests(ApiTests):
+    def setUp(self):
+        super(SchemaLocalizationTests, self).setUp()
+        schema_localization.invalidate_schema_localizations()
+        self.container = models.Splocalecontainer.objects.create(
+            discipline=self.discipline,
+            name='collectionobject',
+            schematype=0,
+            ishidden=False,
+            issystem=False)
+
+    def test_cached(self):
+        payload = schema_localization.get_schema_localization_payload(self.collection, 0)
+        self.assertIn('collectionobject', json.loads(payload.content.decode('utf-8')))
+        self.assertEqual(gzip.decompress(payload.gzipped), payload.content)
+        self.assertIs(schema_localization.get_schema_localization_payload(self.collection, 0), payload)
+
+    def test_invalidated_on_save(self):
+        payload = schema_localization.get_schema_localization_payload(self.collection, 0)
+        models.Splocalecontainer.objects.create(
+            discipline=self.discipline,
+            name='accession',
+            schematype=0,
+            ishidden=False,
+            issystem=False)
+        changed = schema_localization.get_schema_localization_payload(self.collection, 0)
+        self.assertNotEqual(changed.etag, payload.etag)
+        self.assertIn('accession', json.loads(changed.content.decode('utf-8')))
+
+class ContextCacheTests(ApiTests):
+    def setUp(self):
+        super(ContextCacheTests, self).setUp()
+        middleware.invalidate_context()
+
+    def test_admin_cached(self):
+        self.specifyuser.clear_admin()
+        self.assertFalse(self.specifyuser.is_admin())
+        with self.assertNumQueries(0):
+            self.assertFalse(self.specifyuser.is_admin())
+
+    def test_admin_invalidated(self):
+        self.specifyuser.clear_admin()
+        self.assertFalse(self.specifyuser.is_admin())
+        self.specifyuser.set_admin()
+        self.assertTrue(self.specifyuser.is_admin())
+
+    def test_users_collections_invalidated(self):
+        cursor = connection.cursor()
+        views.set_users_collections(cursor, self.specifyuser, [self.collection.id])
+        self.assertEqual([row[0] for row in views.users_collections(cursor, self.specifyuser.id)],
+                         [self.collection.id])
+        views.set_users_collections(cursor, self.specifyuser, [])
+        self.assertEqual(views.users_collections(cursor, self.specifyuser.id), [])
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.COOKIES['collection'] = str(self.collection.id)
+        return request
+
+    def test_fresh_instances(self):
+        first = middleware.get_collection(self.request())
+        first.collectionname = 'changed'
+        with self.assertNumQueries(0):
+            second = middleware.get_collection(self.request())
+            self.assertIsNot(second, first)
+            self.assertIsNot(second.discipline, first.discipline)
+            self.assertEqual(second.discipline.division.institution.id, self.institution.id)
+        self.assertEqual(second.collectionname, self.collection.collectionname)
+
+    def test_invalidated_by_key(self):
+        middleware.get_collection(self.request())
+        models.Collection.objects.create(
+            catalognumformatname='test',
+            collectionname='OtherCollection',
+            isembeddedcollectingevent=False,
+            discipline=self.discipline)
+        with self.assertNumQueries(0):
+            middleware.get_collection(self.request())
+        self.discipline.save()
+        with self.assertNumQueries(1):
+            middleware.get_collection(self.request())
+
+class RemotePrefsTests(ApiTests):
+    def setUp(self):
+        super(RemotePrefsTests, self).setUp()
+        remote_prefs.invalidate_prefs()
+
+    def test_parse(self):
+        prefs = remote_prefs.Preferences(
+            "# comment\nauditing.do_audits=false\r\nAUDIT_LIFESPAN_MONTHS = 12\n"
+            "ui.formatting.scrdateformat=MM/dd/yyyy\nauditing.do_audits=true\n")
+        self.assertFalse(prefs.get_bool('auditing.do_audits', True))
+        self.assertTrue(prefs.get_bool('auditing.audit_field_updates', True))
+        self.assertEqual(prefs.get_int('AUDIT_LIFESPAN_MONTHS'), 12)
+        self.assertEqual(prefs.get('ui.formatting.scrdateformat'), 'MM/dd/yyyy')
+        self.assertIsNone(prefs.get_int('ui.formatting.scrdateformat'))
+
+    def test_invalidated_on_save(self):
+        self.assertIsNone(remote_prefs.parsed_remote_prefs().get('ui.formatting.scrdateformat'))
+        resourcedir = models.Spappresourcedir.objects.create(
+            discipline=self.discipline,
+            ispersonal=False,
+            usertype='Prefs')
+        resource = models.Spappresource.objects.create(
+            level=0,
+            mimetype='text/x-java-properties',
+            name='preferences',
+            spappresourcedir=resourcedir,
+            specifyuser=self.specifyuser)
+        models.Spappresourcedata.objects.create(
+            data='ui.formatting.scrdateformat=MM/dd/yyyy\n',
+            spappresource=resource)
+        self.assertEqual(remote_prefs.parsed_remote_prefs().get('ui.formatting.scrdateformat'), 'MM/dd/yyyy')
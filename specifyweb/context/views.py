@@ -1,11 +1,12 @@
 import re
 import json
 
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotModified, Http404, HttpResponseForbidden
 from django.utils.http import is_safe_url
 from django.views.decorators.http import require_http_methods, require_GET
 from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.utils.cache import patch_vary_headers
 from django.template.response import TemplateResponse
 from django.contrib.auth import authenticate, views as auth_views, logout as auth_logout, login as auth_login
 from django.contrib.auth.forms import AuthenticationForm
@@ -16,11 +17,14 @@ from django.db import connection, transaction
 from specifyweb.specify.models import Collection, Spversion,Agent, Institution, Specifyuser, Spprincipal
 from specifyweb.specify.serialize_datamodel import datamodel_to_json
 from specifyweb.specify.views import login_maybe_required
+from specifyweb.specify.api import etag_matches
+from specifyweb.specify.cache import make_payload
 from specifyweb.specify.specify_jar import specify_jar
 
 from .app_resource import get_app_resource
+from .middleware import cached_context, invalidate_context_on_commit
 from .viewsets import get_view
-from .schema_localization import get_schema_localization
+from .schema_localization import get_schema_localization_payload
 from .remote_prefs import get_remote_prefs
 
 
@@ -28,6 +32,9 @@ def set_collection_cookie(response, collection_id):
     response.set_cookie('collection', str(collection_id), max_age=365*24*60*60)
 
 def users_collections(cursor, user_id):
+    return cached_context(('collections', int(user_id)), lambda: load_users_collections(cursor, user_id))
+
+def load_users_collections(cursor, user_id):
     cursor.execute("""
     select distinct c.usergroupscopeid, c.collectionname from collection c
     inner join spprincipal p on p.usergroupscopeid = c.usergroupscopeid
@@ -56,6 +63,8 @@ def set_users_collections(cursor, user, collectionids):
             cursor.execute('insert specifyuser_spprincipal(SpecifyUserID, SpPrincipalID) '
                            'values (%s, %s)', [user.id, principal.id])
 
+        invalidate_context_on_commit(user_ids={user.id})
+
 @login_maybe_required
 @require_http_methods(['GET', 'PUT'])
 @never_cache
@@ -236,34 +245,55 @@ def available_related_searches(request):
 
     return HttpResponse(json.dumps(result), content_type='application/json')
 
-datamodel_json = None
+accepts_gzip = re.compile(r'\bgzip\b')
+
+def payload_response(request, payload, content_type='application/json'):
+    """Return a response for a cached Payload, answering a request that
+    already has it with 304 Not Modified and serving the gzipped copy
+    to clients that accept it.
+    """
+    gzipped = accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+    # Compressed responses get weak ETags as they would from GZipMiddleware.
+    etag = 'W/' + payload.etag if gzipped else payload.etag
+    if etag_matches(request, payload.etag):
+        response = HttpResponseNotModified()
+    elif gzipped:
+        response = HttpResponse(payload.gzipped, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(payload.content, content_type=content_type)
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+datamodel_payload = None
 
 @require_GET
 @login_maybe_required
 @cache_control(max_age=86400, public=True)
 def datamodel(request):
     from specifyweb.specify.models import datamodel
-    global datamodel_json
-    if datamodel_json is None:
-        datamodel_json = datamodel_to_json(datamodel)
+    global datamodel_payload
+    if datamodel_payload is None:
+        datamodel_payload = make_payload(datamodel_to_json(datamodel))
 
-    return HttpResponse(datamodel_json, content_type='application/json')
+    return payload_response(request, datamodel_payload)
 
 @require_GET
 @login_maybe_required
 @cache_control(max_age=86400, private=True)
 def schema_localization(request):
     """Return the schema localization information for the logged in collection."""
-    sl = get_schema_localization(request.specify_collection, 0)
-    return HttpResponse(sl, content_type='application/json')
+    sl = get_schema_localization_payload(request.specify_collection, 0)
+    return payload_response(request, sl)
 
 @require_GET
 @login_maybe_required
 @cache_control(max_age=86400, private=True)
 def wb_schema_localization(request):
     """Return the WB schema localization information for the logged in collection."""
-    sl = get_schema_localization(request.specify_collection, 1)
-    return HttpResponse(sl, content_type='application/json')
+    sl = get_schema_localization_payload(request.specify_collection, 1)
+    return payload_response(request, sl)
 
 @require_GET
 @login_maybe_required
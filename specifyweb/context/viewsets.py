@@ -7,18 +7,76 @@ import logging
 from xml.etree import ElementTree
 from xml.sax.saxutils import quoteattr
 
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.http import Http404
 from django.utils.encoding import force_bytes
 
-from specifyweb.specify.models import Spappresourcedata
+from specifyweb.specify.models import Spappresourcedata, Spappresourcedir, Spviewsetobj
+from specifyweb.specify.cache import ProcessCache, file_mtime, files_unchanged
 
 from . import app_resource as AR
 
 logger = logging.getLogger(__name__)
 
+# Resolved views are cached by collection, user and view name along
+# with the (path, mtime) of the files consulted to find them. Changes
+# to viewsets in the database made by this process invalidate the cache
+# through the signal handlers below. Changes made by other processes
+# are seen once the entry expires.
+VIEW_TTL = 60
+
+_views = ProcessCache('views', maxsize=2000, ttl=VIEW_TTL)
+
+# Parsed viewsets, keyed by ('file', path, mtime) or ('db', id, version).
+_viewsets = ProcessCache('viewsets', maxsize=200)
+
 def get_view(collection, user, viewname):
     """Return the data for the named view for the given user logged into the given collection."""
+    key = (collection.id, user and user.id, AR.get_usertype(user), viewname)
+    data, files = _views.get(key,
+                             lambda: resolve_view(collection, user, viewname),
+                             lambda resolved: files_unchanged(resolved[1]))
+    if data is None:
+        raise Http404("view: %s not found" % viewname)
+    return dict(data)
+
+def view_cache_stats():
+    return [_views.stats(), _viewsets.stats()]
+
+def invalidate_views(parsed=False):
+    """Clear the resolved views and, if 'parsed' is True, the parsed viewsets."""
+    _views.invalidate()
+    if parsed:
+        _viewsets.invalidate()
+
+@receiver(post_save, sender=Spappresourcedata)
+@receiver(post_delete, sender=Spappresourcedata)
+def viewset_data_changed(sender, instance, **kwargs):
+    # Invalidate again on commit so a viewset reloaded in the
+    # meantime from uncommitted data isn't kept.
+    invalidate = lambda: _viewsets.invalidate_where(lambda key: key[:2] == ('db', instance.id))
+    invalidate()
+    invalidate_views()
+    transaction.on_commit(invalidate)
+    transaction.on_commit(invalidate_views)
+
+@receiver(post_save, sender=Spviewsetobj)
+@receiver(post_delete, sender=Spviewsetobj)
+@receiver(post_save, sender=Spappresourcedir)
+@receiver(post_delete, sender=Spappresourcedir)
+def viewset_changed(sender, **kwargs):
+    invalidate_views()
+    transaction.on_commit(invalidate_views)
+
+def resolve_view(collection, user, viewname):
+    """Find the named view for the given user logged into the given
+    collection. Returns the data for the view, or None if there is no
+    such view, and a list of the (path, mtime) of the files consulted.
+    """
     logger.debug("get_view %s %s %s", collection, user, viewname)
+    files = []
     # setup a generator that looks for the view in the proper discovery order
     matches = ((viewset, view, src, level)
                # db first, then disk
@@ -26,7 +84,7 @@ def get_view(collection, user, viewname):
                # then by directory level
                for level in AR.DIR_LEVELS
                # then in the viewset files in a given directory level
-               for viewset in get_viewsets(collection, user, level)
+               for viewset in get_viewsets(collection, user, level, files)
                # finally in the list of views in the file
                for view in viewset.findall('views/view[@name=%s]' % quoteattr(viewname)))
 
@@ -34,7 +92,7 @@ def get_view(collection, user, viewname):
     try:
         viewset, view, source, level = next(matches)
     except StopIteration:
-        raise Http404("view: %s not found" % viewname)
+        return None, files
 
     altviews = view.findall('altviews/altview')
 
@@ -72,9 +130,9 @@ def get_view(collection, user, viewname):
     data['viewsetName'] = viewset.attrib['name']
     data['viewsetLevel'] = level
     data['viewsetSource'] = source
-    return data
+    return data, files
 
-def get_viewsets_from_db(collection, user, level):
+def get_viewsets_from_db(collection, user, level, files=None):
     """Try to get a viewset at a particular level in the given context from the database."""
     # The context directory structure for the viewset system is the same as for
     # the app resources, so we can use the same function to find the appropriate
@@ -83,42 +141,58 @@ def get_viewsets_from_db(collection, user, level):
 
     # Pull out all the SpAppResourceDatas that have an associated SpViewsetObj in
     # the SpAppResourceDirs we just found.
-    objs = Spappresourcedata.objects.filter(spviewsetobj__spappresourcedir__in=dirs)
+    # The data is only loaded for viewsets that haven't already been parsed.
+    objs = Spappresourcedata.objects.filter(spviewsetobj__spappresourcedir__in=dirs) \
+           .values_list('id', 'version')
     def viewsets():
-        for o in objs:
-            try:
-                yield ElementTree.fromstring(force_bytes(o.data))
-            except Exception as e:
-                logger.error("Bad XML in view set: %s\n%s  id = %s", e, o, o.id)
+        for id, version in objs:
+            viewset = _viewsets.get(('db', id, version), lambda: parse_viewset_from_db(id))
+            if viewset is not None:
+                yield viewset
 
     return viewsets()
 
-def load_viewsets(collection, user, level):
+def parse_viewset_from_db(id):
+    o = Spappresourcedata.objects.get(id=id)
+    try:
+        return ElementTree.fromstring(force_bytes(o.data))
+    except Exception as e:
+        logger.error("Bad XML in view set: %s\n%s  id = %s", e, o, o.id)
+        return None
+
+def load_viewsets(collection, user, level, files=None):
     """Try to get a viewset for a given level and context from the filesystem."""
     # The directory structure for viewsets are the same as for app resources.
     path = AR.get_path_for_level(collection, user, level)
     if not path: return []
 
     # The viewset registry lists all the viewset files for that directory.
-    registry = AR.load_registry(path, 'viewset_registry.xml')
+    registry = AR.load_registry(path, 'viewset_registry.xml', files)
     if registry is None: return []
 
     # Load them all.
     def viewsets():
         for f in registry.findall('file'):
             try:
-                yield get_viewset_from_file(path, f.attrib['file'])
+                yield get_viewset_from_file(path, f.attrib['file'], files)
             except Exception:
                 pass
 
     return viewsets()
 
-def web_only(collection, user, level):
-    return [get_viewset_from_file(os.path.dirname(__file__), 'web_only_views.xml')]
+def web_only(collection, user, level, files=None):
+    return [get_viewset_from_file(os.path.dirname(__file__), 'web_only_views.xml', files)]
 
-def get_viewset_from_file(path, filename):
-    """Just load the XML for a viewset from path and pull out the root."""
+def get_viewset_from_file(path, filename, files=None):
+    """Just load the XML for a viewset from path and pull out the root.
+    The parsed viewset is reused until the file is modified.
+    """
     file_path = os.path.join(path, filename)
+    mtime = file_mtime(file_path)
+    if files is not None: files.append((file_path, mtime))
+    return _viewsets.get(('file', file_path, mtime), lambda: parse_viewset_file(file_path))
+
+def parse_viewset_file(file_path):
     try:
         return ElementTree.parse(file_path).getroot()
     except Exception as e:
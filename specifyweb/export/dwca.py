@@ -5,6 +5,8 @@ import re
 import shutil
 from tempfile import mkdtemp
 from collections import namedtuple
+from itertools import compress
+from operator import itemgetter
 from uuid import uuid4
 from datetime import date
 
@@ -203,30 +205,42 @@ def make_dwca(collection, user, definition, output_file, eml=None):
             meta_xml.write(prettify(output_node))
 
         core_ids = set()
-        def collect_ids(row):
-            core_ids.add(row[core_stanza.id_field_idx + 1])
-            return True
-
         with session_context() as session:
             for query in core_stanza.queries:
                 path = os.path.join(output_dir, query.file_name)
                 query_to_csv(session, collection, user, query.tableid, query.get_field_specs(), path,
-                             strip_id=True, row_filter=collect_ids)
+                             strip_id=True, chunk_filter=collect_ids(core_ids, core_stanza.id_field_idx))
 
             for stanza in extension_stanzas:
-                def filter_ids(row):
-                    return row[stanza.id_field_idx + 1] in core_ids
-
                 for query in stanza.queries:
                     path = os.path.join(output_dir, query.file_name)
                     query_to_csv(session, collection, user, query.tableid, query.get_field_specs(), path,
-                                 strip_id=True, row_filter=filter_ids)
+                                 strip_id=True, chunk_filter=filter_ids(core_ids, stanza.id_field_idx))
 
         basename = re.sub(r'\.zip$', '', output_file)
         shutil.make_archive(basename, 'zip', output_dir, logger=logger)
     finally:
         shutil.rmtree(output_dir)
 
+def collect_ids(ids, id_field_idx):
+    """Return a chunk_filter for query_to_csv that adds the ids in the
+    'id_field_idx' export field of the rows to the set 'ids'.
+    """
+    get_id = itemgetter(id_field_idx + 1) # after the query's own id
+    def chunk_filter(rows):
+        ids.update(map(get_id, rows))
+        return rows
+    return chunk_filter
+
+def filter_ids(ids, id_field_idx):
+    """Return a chunk_filter for query_to_csv that keeps the rows whose
+    'id_field_idx' export field is in the set 'ids'.
+    """
+    get_id = itemgetter(id_field_idx + 1) # after the query's own id
+    def chunk_filter(rows):
+        return list(compress(rows, map(ids.__contains__, map(get_id, rows))))
+    return chunk_filter
+
 def write_eml(source, output_path, pub_date=None, package_id=None):
     if pub_date is None:
         pub_date = date.today()
@@ -5,8 +5,17 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import csv
+import os
+import zipfile
+from tempfile import TemporaryDirectory
+from unittest import mock
+
 from django.test import TestCase
 
+from specifyweb.stored_queries.execution import write_csv
+from . import dwca
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +23,67 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+DEFINITION = """
+<archive>
+  <core rowType="http://rs.tdwg.org/dwc/terms/Occurrence">
+    <queries>
+      <query name="occurrence.csv" contextTableId="1">
+        <id term="http://rs.tdwg.org/dwc/terms/occurrenceID"
+            stringId="1.collectionobject.catalogNumber" isRelFld="false" oper="8" value="" isNot="false"/>
+        <field term="http://rs.tdwg.org/dwc/terms/occurrenceRemarks"
+               stringId="1.collectionobject.remarks" isRelFld="false" oper="8" value="" isNot="false"/>
+      </query>
+    </queries>
+  </core>
+  <extension rowType="http://rs.tdwg.org/dwc/terms/Identification">
+    <queries>
+      <query name="identification.csv" contextTableId="9">
+        <field term="http://rs.tdwg.org/dwc/terms/identificationRemarks"
+               stringId="9.determination.remarks" isRelFld="false" oper="8" value="" isNot="false"/>
+        <id stringId="9,1-collectionObject.collectionobject.catalogNumber"
+            isRelFld="false" oper="8" value="" isNot="false"/>
+      </query>
+    </queries>
+  </extension>
+</archive>
+"""
+
+ROWS = {
+    1: [(1, 'num-1', 'a'), (2, 'num-2', 'b'), (3, 'num-3', 'c')],
+    9: [(10, 'x', 'num-1'), (11, 'orphan', 'num-4'), (12, 'y', 'num-3'), (13, 'z', 'num-2')],
+}
+
+def fake_query_to_csv(session, collection, user, tableid, field_specs, path,
+                      strip_id=False, chunk_filter=None):
+    rows = ROWS[tableid]
+    chunks = (rows[i:i + 2] for i in range(0, len(rows), 2))
+    return write_csv(path, map(chunk_filter, chunks), strip_id=strip_id)
+
+class ChunkFilterTests(TestCase):
+    def test_collect_ids(self):
+        ids = set()
+        collect = dwca.collect_ids(ids, 0)
+        self.assertEqual(collect(ROWS[1][:2]), ROWS[1][:2])
+        collect(ROWS[1][2:])
+        self.assertEqual(ids, {'num-1', 'num-2', 'num-3'})
+
+    def test_filter_ids(self):
+        keep = dwca.filter_ids({'num-1', 'num-2'}, 1)
+        self.assertEqual(keep(ROWS[9]), [ROWS[9][0], ROWS[9][3]])
+        self.assertEqual(keep([]), [])
+
+    def test_make_dwca_keeps_core_ids(self):
+        with TemporaryDirectory() as tmpdir, \
+             mock.patch.object(dwca, 'query_to_csv', fake_query_to_csv), \
+             mock.patch.object(dwca, 'session_context'):
+            output_file = os.path.join(tmpdir, 'archive.zip')
+            dwca.make_dwca(None, None, DEFINITION, output_file)
+            with zipfile.ZipFile(output_file) as archive:
+                core = archive.read('occurrence.csv').decode('utf-8')
+                extension = archive.read('identification.csv').decode('utf-8')
+
+        self.assertEqual(list(csv.reader(core.splitlines())),
+                         [['num-1', 'a'], ['num-2', 'b'], ['num-3', 'c']])
+        self.assertEqual(list(csv.reader(extension.splitlines())),
+                         [['x', 'num-1'], ['y', 'num-3'], ['z', 'num-2']])
@@ -265,7 +265,7 @@ var router             = require('./router.js');
                 countOnly: this.query.get('countonly'),
                 format: this.query.get('formatauditrecids'),
                 fetchResults: this.fetchResults(),
-                fetchCount: this.fetchCount(),
+                fetchCount: this.query.get('countonly') && this.fetchCount(),
                 fieldSpecs: _.chain(this.fieldUIs)
                     .filter(function(f) { return f.spqueryfield.get('isdisplay'); })
                     .sortBy(function(f) { return f.spqueryfield.get('position'); })
@@ -278,6 +278,8 @@ var router             = require('./router.js');
             var query = this.query.toJSON();
             return function(offset) {
                 query.offset = offset;
+                // The count comes with the first page.
+                query.includecount = offset === 0;
                 return $.post('/stored_query/ephemeral/', JSON.stringify(query));
             };
         },
@@ -59,6 +59,12 @@ WB_UPLOAD_LOG_DIR = "/home/specify/wb_upload_logs"
 # exports and Darwin Core archives.
 DEPOSITORY_DIR = '/home/specify/specify_depository'
 
+# The parsed datamodel is saved in the following directory
+# so that worker processes can load it without parsing
+# specify_datamodel.xml. Must be writeable by the web server
+# process. Set to None to disable.
+DATAMODEL_SNAPSHOT_DIR = None
+
 # Old notifications are deleted after this many days.
 # If DEPOSITORY_DIR is being cleaned out with a
 # scheduled job, this interval should be shorter
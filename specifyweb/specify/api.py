@@ -1,22 +1,32 @@
 from urllib.parse import urlencode
+from collections import namedtuple
+from itertools import islice
 import json
 import re
+import hashlib
+from operator import attrgetter
 import logging
 logger = logging.getLogger(__name__)
 
 from django import forms
-from django.db import transaction
-from django.http import (HttpResponse, HttpResponseBadRequest,
-                         Http404, HttpResponseNotAllowed, QueryDict)
-from django.core.exceptions import ObjectDoesNotExist, FieldError
+from django.db import connection, connections, router, transaction, DatabaseError
+from django.db.models import prefetch_related_objects, signals, CharField, F, Q, Value
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
+                         Http404, HttpResponseNotAllowed, QueryDict, StreamingHttpResponse)
+from django.utils.http import parse_etags
+from MySQLdb.cursors import SSCursor
+from django.core.exceptions import ObjectDoesNotExist, FieldError, ValidationError
 from django.db.models.fields.related import ForeignKey
 from django.db.models.fields import DateTimeField, FieldDoesNotExist, FloatField, DecimalField
 # from django.utils.deprecation import CallableBool
 
 from . import models
-from .autonumbering import autonumber_and_save, AutonumberOverflowException
+from .autonumbering import autonumber_and_save, AutonumberOverflowException, \
+    defer_autonumbering, AutonumberingDeferred
 from .filter_by_col import filter_by_collection
 from .auditlog import auditlog
+from specifyweb.businessrules.exceptions import AbortSave, BusinessRuleException
+from . import recordset_index
 
 # Regex matching api uris for extracting the model name and id number.
 URI_RE = re.compile(r'^/api/specify/(\w+)/($|(\d+))')
@@ -68,6 +78,10 @@ class OrderByError(Exception):
     """Raised for bad fields in order by clause."""
     pass
 
+class FieldsError(Exception):
+    """Raised for unknown fields in a sparse fieldset request."""
+    pass
+
 class HttpResponseCreated(HttpResponse):
     """Returned to the client when a POST request succeeds and a new
     resource is created.
@@ -96,8 +110,31 @@ def resource_dispatch(request, model, id):
 
     # Dispatch on the request type.
     if request.method == 'GET':
-        data = get_resource(model, id, request.GET.get('recordsetid', None))
+        control_params = GetResourceForm(request.GET)
+        if not control_params.is_valid():
+            return HttpResponseBadRequest(toJson(control_params.errors),
+                                          content_type='application/json')
+        fields = control_params.cleaned_data['fields']
+        depth = control_params.cleaned_data['depth']
+        recordsetid = request.GET.get('recordsetid', None)
+
+        try:
+            # The recordset info can change without the resource changing
+            # so those responses are not given ETags.
+            etag = None if recordsetid is not None else current_resource_etag(model, id, fields, depth)
+            if etag is not None and etag_matches(request, etag):
+                resp = HttpResponseNotModified()
+                resp['ETag'] = etag
+                return resp
+
+            data = get_resource(model, id, recordsetid, fields, depth)
+        except FieldsError as e:
+            return HttpResponseBadRequest(e)
         resp = HttpResponse(toJson(data), content_type='application/json')
+        # The ETag was computed before the data was read, so if the
+        # resource changed in between the client only misses a 304.
+        if etag is not None:
+            resp['ETag'] = etag
 
     elif request.method == 'PUT':
         data = json.load(request)
@@ -113,6 +150,9 @@ def resource_dispatch(request, model, id):
 
         resp = HttpResponse(toJson(obj_to_data(obj)),
                             content_type='application/json')
+        etag = current_resource_etag(obj.__class__.__name__, obj.id)
+        if etag is not None:
+            resp['ETag'] = etag
 
     elif request.method == 'DELETE':
         delete_resource(request.specify_user_agent, model, id, version)
@@ -124,7 +164,23 @@ def resource_dispatch(request, model, id):
 
     return resp
 
-class GetCollectionForm(forms.Form):
+class FieldsForm(forms.Form):
+    # Comma separated list of the fields to include.
+    # All fields if not given.
+    fields = forms.CharField(required=False)
+
+    # How many levels of dependent resources to inline.
+    # All levels if not given.
+    depth = forms.IntegerField(required=False, min_value=0)
+
+    def clean_fields(self):
+        fields = self.cleaned_data['fields']
+        return [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
+class GetResourceForm(FieldsForm):
+    pass
+
+class GetCollectionForm(FieldsForm):
     # Use the logged_in_collection to limit request
     # to relevant items.
     domainfilter = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false')),
@@ -139,11 +195,25 @@ class GetCollectionForm(forms.Form):
 
     orderby = forms.CharField(required=False)
 
+    # Return items following the item with id 'after' in the
+    # 'orderby' ordering instead of using 'offset'. Zero for
+    # the first page.
+    after = forms.IntegerField(required=False, min_value=0)
+
+    # Whether to include the total number of items, an
+    # estimate of it or nothing.
+    count = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false'), ('estimate', 'estimate')),
+                              required=False)
+
     defaults = dict(
         domainfilter=None,
         limit=0,
         offset=0,
         orderby=None,
+        fields=None,
+        depth=None,
+        after=None,
+        count='true',
     )
 
     def clean_limit(self):
@@ -154,6 +224,10 @@ class GetCollectionForm(forms.Form):
         offset = self.cleaned_data['offset']
         return 0 if offset is None else offset
 
+    def clean_count(self):
+        count = self.cleaned_data['count']
+        return count or 'true'
+
 def collection_dispatch(request, model):
     """Handles requests related to collections of resources.
 
@@ -166,12 +240,23 @@ def collection_dispatch(request, model):
         if not control_params.is_valid():
             return HttpResponseBadRequest(toJson(control_params.errors),
                                           content_type='application/json')
+        # Unlimited requests are streamed so the whole collection
+        # is never held in memory.
+        stream = (control_params.cleaned_data['limit'] == 0
+                  and control_params.cleaned_data['after'] is None)
         try:
-            data = get_collection(request.specify_collection, model,
-                                  control_params.cleaned_data, request.GET)
-        except (FilterError, OrderByError) as e:
+            if stream:
+                chunks = stream_collection(request.specify_collection, model,
+                                           control_params.cleaned_data, request.GET)
+            else:
+                data = get_collection(request.specify_collection, model,
+                                      control_params.cleaned_data, request.GET)
+        except (FilterError, OrderByError, FieldsError) as e:
             return HttpResponseBadRequest(e)
-        resp = HttpResponse(toJson(data), content_type='application/json')
+        if stream:
+            resp = StreamingHttpResponse(chunks, content_type='application/json')
+        else:
+            resp = HttpResponse(toJson(data), content_type='application/json')
 
     elif request.method == 'POST':
         obj = post_resource(request.specify_collection,
@@ -187,6 +272,31 @@ def collection_dispatch(request, model):
 
     return resp
 
+def bulk_dispatch(request, model):
+    """Handles requests to create or update many resources of a model
+    at once.
+
+    The request body is a JSON list of resources. Those with an id
+    are updated and the rest are created. The response gives the
+    result for each resource in the same order.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    items = json.load(request)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return HttpResponseBadRequest('expected a list of resources')
+
+    try:
+        results = bulk_post_resources(request.specify_collection,
+                                      request.specify_user_agent,
+                                      model, items,
+                                      request.GET.get('recordsetid', None))
+    except RecordSetException as e:
+        return HttpResponseBadRequest(e)
+
+    return HttpResponse(toJson({'objects': results}), content_type='application/json')
+
 def get_model_or_404(name):
     """Lookup a specify model by name. Raise Http404 if not found."""
     try:
@@ -203,54 +313,149 @@ def get_object_or_404(model, *args, **kwargs):
         model = get_model_or_404(model)
     return get_object(model, *args, **kwargs)
 
-def get_resource(name, id, recordsetid=None):
+def get_resource(name, id, recordsetid=None, fields=None, depth=None):
     """Return a dict of the fields from row 'id' in model 'name'.
 
     If given a recordset id, the data will be suplemented with
     data about the resource's relationship to the given record set.
+
+    'fields' and 'depth' have the same meaning as for obj_to_data.
     """
-    obj = get_object_or_404(name, id=int(id))
-    data = obj_to_data(obj)
+    model = get_model_or_404(name)
+    serializer = get_serializer(model)
+    fields = serializer.select_fields(fields)
+    objs = model.objects.all()
+    if fields is not None:
+        objs = objs.only(*serializer.only_columns(fields))
+    obj = get_object_or_404(objs, id=int(id))
+    prefetch_dependents([obj], fields, depth)
+    data = obj_to_data(obj, fields, depth)
     if recordsetid is not None:
         data['recordset_info'] = get_recordset_info(obj, recordsetid)
     return data
 
-def get_recordset_info(obj, recordsetid):
-    """Return a dict of info about how the resource 'obj' is related to
-    the recordset with id 'recordsetid'.
-    """
-    # Queryset of record set items in the given record set with
-    # the additional condition that they match the resource's table.
-    rsis = models.Recordsetitem.objects.filter(
-        recordset__id=recordsetid, recordset__dbtableid=obj.specify_model.tableId)
+# Models whose data include values computed from other tables, which
+# can change without the version of the resource changing.
+UNCACHEABLE_MODELS = {'Preparation', 'Specifyuser'}
 
-    # Get the one which points to the resource 'obj'.
-    try:
-        rsi = rsis.get(recordid=obj.id)
-    except models.Recordsetitem.DoesNotExist:
+def resource_etag(model, id, version, fields=None, depth=None, inlined=()):
+    """Return a strong ETag for the data of the resource with 'id' and
+    'version' in 'model' as returned for the given 'fields' and 'depth'
+    parameters, or None if the data cannot be identified by its version.
+    'inlined' is the list of (model name, id, version) triples of the
+    dependent resources included in the data.
+    """
+    if version is None or model.__name__ in UNCACHEABLE_MODELS:
+        return None
+    key = '%s:%d:%d:%s:%s:%s' % (model.__name__, int(id), int(version),
+                                 ','.join(sorted(fields)) if fields else '',
+                                 '' if depth is None else depth,
+                                 ';'.join('%s:%d:%d' % triple for triple in inlined))
+    return '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+def current_resource_etag(name, id, fields=None, depth=None):
+    """Return the ETag for the current version of the resource with 'id'
+    in model 'name'. Only the version columns of the resource, of the
+    dependent resources inlined in its data and of the collection or
+    discipline deciding what is embedded are read, with one query.
+    """
+    model = get_model_or_404(name)
+    if 'version' not in get_serializer(model).columns or model.__name__ in UNCACHEABLE_MODELS:
+        return None
+    objs = model.objects.filter(id=int(id))
+    related = inlined_version_queries(model, objs, get_serializer(model).select_fields(fields), depth)
+    if related is None:
+        return None
+    parts = [version_rows(model, objs)] + [version_rows(related_model, related_objs)
+                                           for related_model, related_objs in related]
+    rows = set(parts[0].union(*parts[1:], all=True))
+    if any(version is None or model_name in UNCACHEABLE_MODELS for _, version, model_name in rows):
         return None
+    key = (model.__name__, int(id))
+    versions = {(model_name, row_id): version for row_id, version, model_name in rows}
+    if key not in versions:
+        return None
+    inlined = sorted((model_name, row_id, version) for (model_name, row_id), version in versions.items()
+                     if (model_name, row_id) != key)
+    return resource_etag(model, id, versions[key], fields, depth, inlined)
+
+def version_rows(model, objs):
+    """Return the (id, version, model name) rows of the queryset 'objs'
+    of 'model' in a form that can be combined into one UNION query.
+    """
+    return objs.order_by().annotate(model_name=Value(model.__name__, output_field=CharField())) \
+               .values_list('id', 'version', 'model_name')
+
+def inlined_version_queries(model, objs, fields=None, depth=None, seen=frozenset()):
+    """Return (model, queryset) pairs selecting the dependent resources
+    that obj_to_data may inline in the data of the queryset 'objs' of
+    'model', or None if any of them is not versioned. Dependent
+    resources can be changed through their own URIs without the
+    version of the resources they belong to changing. The querysets
+    are not evaluated.
+
+    Embeddable to-one resources are included whether or not they are
+    inlined, together with the collection or discipline whose settings
+    decide if they are.
+    """
+    if depth is not None and depth <= 0:
+        return []
+    serializer = get_serializer(model)
+    child_depth = None if depth is None else depth - 1
+    seen = seen | {model}
+    wanted = lambda names: [name for name in names if fields is None or name in fields]
+
+    related = []
+    for name in wanted(serializer.dependent_to_manys):
+        rel = model._meta.get_field(name)
+        related.append((rel.related_model,
+                        rel.related_model.objects.filter(**{rel.field.name + '__in': objs.values('id')})))
+    embeddable_to_ones = wanted(serializer.embeddable_to_ones)
+    for name in wanted(serializer.dependent_to_ones) + embeddable_to_ones:
+        field = model._meta.get_field(name)
+        related.append((field.related_model,
+                        field.related_model.objects.filter(id__in=objs.values(field.attname))))
+
+    queries = []
+    for related_model, related_objs in related:
+        if related_model in seen:
+            continue
+        if 'version' not in get_serializer(related_model).columns:
+            return None
+        queries.append((related_model, related_objs))
+        nested = inlined_version_queries(related_model, related_objs, depth=child_depth, seen=seen)
+        if nested is None:
+            return None
+        queries.extend(nested)
 
-    # Querysets for the recordset items before and after the one in question.
-    prev_rsis = rsis.filter(recordid__lt=obj.id).order_by('-recordid')
-    next_rsis = rsis.filter(recordid__gt=obj.id).order_by('recordid')
+    if embeddable_to_ones:
+        domain_model, lookup = model, []
+        for name in EMBEDDING_DOMAINS[model].split('__'):
+            domain_model = domain_model._meta.get_field(name).related_model
+            lookup.append(name)
+            queries.append((domain_model, domain_model.objects.filter(id__in=objs.values('__'.join(lookup)))))
+    return queries
 
-    # Build URIs for the previous and the next recordsetitem, if present.
-    try:
-        prev = uri_for_model(obj.__class__, prev_rsis[0].recordid)
-    except IndexError:
-        prev = None
+def etag_matches(request, etag):
+    """Return True if the request's If-None-Match header matches 'etag'."""
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return '*' in etags or etag in (e[2:] if e.startswith('W/') else e for e in etags)
 
-    try:
-        next = uri_for_model(obj.__class__, next_rsis[0].recordid)
-    except IndexError:
-        next = None
+def get_recordset_info(obj, recordsetid):
+    """Return a dict of info about how the resource 'obj' is related to
+    the recordset with id 'recordsetid'. The position of the resource
+    is found from the cached index of the record set.
+    """
+    pos = recordset_index.position(recordsetid, obj.specify_model.tableId, obj.id)
+    if pos is None:
+        return None
 
     return {
-        'recordsetid': rsi.recordset_id,
-        'total_count': rsis.count(),
-        'index': prev_rsis.count(),
-        'previous': prev,
-        'next': next
+        'recordsetid': int(recordsetid),
+        'total_count': pos.total_count,
+        'index': pos.index,
+        'previous': None if pos.previous is None else uri_for_model(obj.__class__, pos.previous),
+        'next': None if pos.next is None else uri_for_model(obj.__class__, pos.next)
         }
 
 @transaction.atomic
@@ -281,18 +486,122 @@ def post_resource(collection, agent, name, data, recordsetid=None):
         recordset.recordsetitems.create(recordid=obj.id)
     return obj
 
+# Validation exceptions that cause one resource of a bulk request to
+# fail without affecting the others, with the HTTP status reported for
+# them. Any other exception, including database errors, aborts the
+# whole request.
+BULK_ITEM_ERRORS = (
+    (StaleObjectException, 409),
+    (MissingVersionException, 400),
+    (Http404, 404),
+    (ObjectDoesNotExist, 404),
+    (BusinessRuleException, 400),
+    (ValidationError, 400),
+    (FilterError, 400),
+)
+
+def bulk_post_resources(collection, agent, name, items, recordsetid=None):
+    """Create or update each of the resources in the list 'items' of
+    model 'name', returning a list of the result for each: its status
+    and either its id, version and uri or an error message.
+
+    The resources are saved in one transaction with a savepoint for
+    each, so a failing resource doesn't affect the others. Resources
+    that need autonumbering can't share the transaction, as the table
+    lock it takes commits the transaction in MySQL, so they are saved
+    afterwards in a transaction each.
+
+    Created resources are added to the recordset with 'recordsetid',
+    if given.
+    """
+    model = get_model_or_404(name)
+    recordset = None
+    if recordsetid is not None:
+        try:
+            recordset = models.Recordset.objects.get(id=recordsetid)
+        except models.Recordset.DoesNotExist as e:
+            raise RecordSetException(e)
+        if recordset.dbtableid != model.specify_model.tableId:
+            raise RecordSetException(
+                "expected %s, got %s when adding objects to recordset" %
+                (models.models_by_tableid[recordset.dbtableid].__name__, model.__name__))
+
+    results = [None] * len(items)
+    deferred = []
+
+    with transaction.atomic():
+        created_ids = []
+        with defer_autonumbering():
+            for i, data in enumerate(items):
+                try:
+                    with transaction.atomic():
+                        results[i] = bulk_post_item(collection, agent, model, data)
+                except AutonumberingDeferred:
+                    deferred.append(i)
+                    continue
+                except tuple(e for e, status in BULK_ITEM_ERRORS) as e:
+                    results[i] = bulk_item_error(e)
+                    continue
+                if results[i]['status'] == 201:
+                    created_ids.append(results[i]['id'])
+        add_to_recordset(recordset, created_ids)
+
+    for i in deferred:
+        try:
+            with transaction.atomic():
+                results[i] = bulk_post_item(collection, agent, model, items[i])
+                if results[i]['status'] == 201:
+                    add_to_recordset(recordset, [results[i]['id']])
+        except tuple(e for e, status in BULK_ITEM_ERRORS) as e:
+            results[i] = bulk_item_error(e)
+
+    return results
+
+def bulk_post_item(collection, agent, model, data):
+    if data.get('id') is None:
+        obj = create_obj(collection, agent, model, data)
+        status = 201
+    else:
+        obj = update_obj(collection, agent, model, data['id'], data.get('version', None), data)
+        status = 200
+    result = {'status': status,
+              'id': obj.id,
+              'resource_uri': uri_for_model(model, obj.id)}
+    if hasattr(obj, 'version'):
+        result['version'] = obj.version
+    return result
+
+def bulk_item_error(e):
+    status = next(status for error, status in BULK_ITEM_ERRORS if isinstance(e, error))
+    logger.info("bulk item failed with %d: %s", status, e)
+    return {'status': status, 'error': str(e)}
+
+def add_to_recordset(recordset, ids):
+    """Add items for 'ids' to 'recordset', if it isn't None, with one insert."""
+    if recordset is None or not ids: return
+    models.Recordsetitem.objects.bulk_create([
+        models.Recordsetitem(recordset=recordset, recordid=id) for id in ids])
+    # bulk_create doesn't send the signals that keep the index current.
+    recordset_index.invalidate_on_commit(recordset.id)
+
 def set_field_if_exists(obj, field, value):
     """Where 'obj' is a Django model instance, a resource object, check
     if a field named 'field' exists and set it to 'value' if so. Do nothing otherwise.
     """
-    try:
-        f = obj._meta.get_field(field)
-    except FieldDoesNotExist:
-        return
-
-    if f.concrete:
+    if field in concrete_field_names(obj.__class__):
         setattr(obj, field, value)
 
+_concrete_field_names = {}
+
+def concrete_field_names(model):
+    """Return the set of names of the concrete fields of 'model'."""
+    try:
+        return _concrete_field_names[model]
+    except KeyError:
+        names = _concrete_field_names[model] = frozenset(
+            f.name for f in model._meta.get_fields() if f.concrete)
+        return names
+
 def cleanData(model, data, agent):
     """Returns a copy of data with only fields that are part of model, removing
     metadata fields and warning on unexpected extra fields."""
@@ -497,8 +806,8 @@ def handle_to_many(collection, agent, obj, data):
 
     The assumption is that provided data represents ALL related objects for
     'obj'. Any existing related objects not in the nested data will be deleted.
-    Nested data items with ids will be updated. Those without ids will be
-    created as new resources.
+    Nested data items with ids will be updated, unless they match the
+    existing objects. Those without ids will be created as new resources.
     """
     for field_name, val in list(data.items()):
         field = obj._meta.get_field(field_name)
@@ -515,8 +824,22 @@ def handle_to_many(collection, agent, obj, data):
             continue
 
         rel_model = field.related_model
+
+        # Load the existing objects that are being sent back, with their
+        # own dependents, so unchanged ones can be recognized and skipped.
+        sent_ids = [int(rel_data['id']) for rel_data in val if 'id' in rel_data]
+        existing = rel_model.objects.filter(**{field.field.name: obj, 'id__in': sent_ids}) if sent_ids else []
+        existing = {rel_obj.id: rel_obj for rel_obj in existing}
+        prefetch_dependents(list(existing.values()))
+
         ids = [] # Ids not in this list will be deleted at the end.
         for rel_data in val:
+            if 'id' in rel_data and int(rel_data['id']) in existing and \
+               data_matches_obj(existing[int(rel_data['id'])], rel_data, ignore=[field.field.name]):
+                # Nothing to update.
+                ids.append(int(rel_data['id']))
+                continue
+
             rel_data[field.field.name] = obj
             if 'id' in rel_data:
                 # Update an existing related object.
@@ -536,6 +859,28 @@ def handle_to_many(collection, agent, obj, data):
             auditlog.remove(rel_obj, agent, obj)
         to_delete.delete()
 
+def data_matches_obj(obj, data, ignore=()):
+    """Return True if 'data' has the same version as the Django model
+    instance 'obj' and the same values for each of the fields it
+    includes, other than those in 'ignore', so that updating 'obj'
+    with it would change nothing. The values are compared in the form
+    obj_to_data gives them to the client.
+    """
+    if 'version' in get_serializer(obj.__class__).columns:
+        try:
+            if int(data.get('version')) != obj.version:
+                return False
+        except (TypeError, ValueError):
+            return False
+
+    current = json.loads(toJson(obj_to_data(obj)))
+    for field_name, value in data.items():
+        if field_name in ('resource_uri', 'recordset_info') or field_name in ignore:
+            continue
+        if field_name in current and current[field_name] != value:
+            return False
+    return True
+
 @transaction.atomic
 def delete_resource(agent, name, id, version):
     """Delete the resource with 'id' and model named 'name' with optimistic
@@ -577,21 +922,59 @@ def update_obj(collection, agent, name, id, version, data, parent_obj=None):
     dependents_to_delete = fk_info[0]
     dirty = fk_info[1] + set_fields_from_data(obj, data, auditlog.isAuditingFlds())
 
-    try:
-        obj._meta.get_field('modifiedbyagent')
-    except FieldDoesNotExist:
-        pass
-    else:
-        obj.modifiedbyagent = agent
+    set_field_if_exists(obj, 'modifiedbyagent', agent)
 
-    bump_version(obj, version)
-    obj.save(force_update=True)
+    save_versioned(obj, version)
     auditlog.update(obj, agent, parent_obj, dirty)
     for dep in dependents_to_delete:
         delete_obj(agent, dep, parent_obj=obj)
     handle_to_many(collection, agent, obj, data)
     return obj
 
+def save_versioned(obj, version):
+    """Save the changes to the Django model resource 'obj' if its version
+    in the database matches 'version' which comes from the client,
+    incrementing the version. Otherwise a StaleObjectException is raised.
+
+    The version check, the increment and the changes are made by one
+    UPDATE statement which affects no rows if the version is stale.
+    The save signals are sent around it so the business rules still apply.
+    """
+    if 'version' not in concrete_field_names(obj.__class__):
+        obj.save(force_update=True)
+        return
+
+    version = client_version(obj, version)
+    logger.info("Incrementing version of %s object %d from %d.", obj.__class__.__name__, obj.id, version)
+
+    model = obj.__class__
+    using = router.db_for_write(model, instance=obj)
+    with transaction.atomic(using=using):
+        try:
+            signals.pre_save.send(sender=model, instance=obj, raw=False, using=using, update_fields=None)
+        except AbortSave:
+            return
+
+        changed_fields = {
+            field.attname: field.pre_save(obj, False)
+            for field in model._meta.concrete_fields
+            if not field.primary_key and field.attname != 'version'
+        }
+        rows = model.objects.using(using).filter(pk=obj.pk, version=version) \
+            .update(**changed_fields, version=F('version') + 1)
+        if rows == 0:
+            raise StaleObjectException("%s object %d is out of date" % (obj.__class__.__name__, obj.id))
+
+        obj.version = version + 1
+        obj._state.db = using
+        signals.post_save.send(sender=model, instance=obj, created=False, raw=False, using=using, update_fields=None)
+
+def client_version(obj, version):
+    try:
+        return int(version)
+    except (ValueError, TypeError):
+        raise MissingVersionException("%s object cannot be updated without version info" % obj.__class__.__name__)
+
 def bump_version(obj, version):
     """Implements the optimistic locking mechanism.
 
@@ -601,15 +984,10 @@ def bump_version(obj, version):
     is incremented.
     """
     # If the object has no version field, there's nothing to do.
-    try:
-        obj._meta.get_field('version')
-    except FieldDoesNotExist:
+    if 'version' not in concrete_field_names(obj.__class__):
         return
 
-    try:
-        version = int(version)
-    except (ValueError, TypeError):
-        raise MissingVersionException("%s object cannot be updated without version info" % obj.__class__.__name__)
+    version = client_version(obj, version)
 
     # Try to update a row with the PK and the version number we have.
     # If our version is stale, the rows updated will be 0.
@@ -632,88 +1010,321 @@ def parse_uri(uri):
         groups = match.groups()
         return (groups[0], groups[2])
 
-def obj_to_data(obj):
+def obj_to_data(obj, fields=None, depth=None):
     """Return a (potentially nested) dictionary of the fields of the
     Django model instance 'obj'.
-    """
-    # Get regular and *-to-one fields.
-    fields = obj._meta.get_fields()
-    if isinstance(obj, models.Specifyuser):
-        # block out password field from users table
-        fields = [f for f in fields if f.name != 'password']
-
-    data = dict((field.name, field_to_val(obj, field))
-                for field in fields
-                if not (field.auto_created or field.one_to_many or field.many_to_many))
-    # Get *-to-many fields.
-    data.update(dict((ro.get_accessor_name(), to_many_to_data(obj, ro))
-                     for ro in obj._meta.get_fields()
-                     if ro.one_to_many))
-    # Add a meta data field with the resource's URI.
-    data['resource_uri'] = uri_for_model(obj.__class__.__name__.lower(), obj.id)
-    # Special cases
-    if isinstance(obj, models.Preparation):
-        data['isonloan'] = obj.isonloan()
-    elif isinstance(obj, models.Specifyuser):
-        data['isadmin'] = obj.is_admin()
-    elif isinstance(obj, models.Collectionobject):
-        dets = data['determinations']
-        currDets = [det['resource_uri'] for det in dets if det['iscurrent']] if dets is not None else []
-        data['currentdetermination'] = currDets[0] if len(currDets) > 0 else None;
-    elif isinstance(obj, models.Loan):
-        preps = data['loanpreparations']
-        items = 0
-        quantities = 0
-        unresolvedItems = 0
-        unresolvedQuantities = 0
-        for prep in preps:
-            items = items + 1;
-            prep_quantity = prep['quantity'] if prep['quantity'] is not None else 0
-            prep_quantityresolved = prep['quantityresolved'] if prep['quantityresolved'] is not None else 0
-            quantities = quantities + prep_quantity
-            if not prep['isresolved']:
-                unresolvedItems = unresolvedItems + 1;
-                unresolvedQuantities = unresolvedQuantities + (prep_quantity - prep_quantityresolved)
-        data['totalPreps'] = items
-        data['totalItems'] = quantities
-        data['unresolvedPreps'] = unresolvedItems
-        data['unresolvedItems'] = unresolvedQuantities
-        data['resolvedPreps'] = items - unresolvedItems
-        data['resolvedItems'] = quantities - unresolvedQuantities
-    return data
 
-def to_many_to_data(obj, rel):
-    """Return the URI or nested data of the 'rel' collection
-    depending on if the field is included in the 'inlined_fields' global.
+    If 'fields' is given, only the named fields are included. If
+    'depth' is given, dependent resources are inlined only that many
+    levels deep; beyond that they are represented by URIs like
+    independent resources.
+    """
+    return get_serializer(obj.__class__).to_data(obj, fields, depth)
+
+# To-one fields that are inlined or not depending on the settings
+# of the object's collection or discipline. See is_dependent_field.
+EMBEDDABLE_FIELDS = {
+    'Collectionobject': ('collectingevent', 'paleocontext'),
+    'Collectingevent': ('paleocontext',),
+    'Locality': ('paleocontext',),
+}
+
+# Models whose embedded collectingevent or paleocontext depends on the
+# settings of the collection or discipline. The given lookup is loaded
+# along with the objects so is_dependent_field doesn't have to query
+# for each object.
+EMBEDDING_DOMAINS = {
+    models.Collectionobject: 'collection__discipline',
+    models.Collectingevent: 'discipline',
+    models.Locality: 'discipline',
+}
+
+def isonloan_to_data(obj, data):
+    data['isonloan'] = obj.isonloan()
+
+def isadmin_to_data(obj, data):
+    data['isadmin'] = obj.is_admin()
+
+def currentdetermination_to_data(obj, data):
+    dets = data['determinations']
+    currDets = [det['resource_uri'] for det in dets if det['iscurrent']] if dets is not None else []
+    data['currentdetermination'] = currDets[0] if len(currDets) > 0 else None
+
+def loan_totals_to_data(obj, data):
+    preps = data['loanpreparations']
+    items = 0
+    quantities = 0
+    unresolvedItems = 0
+    unresolvedQuantities = 0
+    for prep in preps:
+        items = items + 1;
+        prep_quantity = prep['quantity'] if prep['quantity'] is not None else 0
+        prep_quantityresolved = prep['quantityresolved'] if prep['quantityresolved'] is not None else 0
+        quantities = quantities + prep_quantity
+        if not prep['isresolved']:
+            unresolvedItems = unresolvedItems + 1;
+            unresolvedQuantities = unresolvedQuantities + (prep_quantity - prep_quantityresolved)
+    data['totalPreps'] = items
+    data['totalItems'] = quantities
+    data['unresolvedPreps'] = unresolvedItems
+    data['unresolvedItems'] = unresolvedQuantities
+    data['resolvedPreps'] = items - unresolvedItems
+    data['resolvedItems'] = quantities - unresolvedQuantities
+
+SpecialCase = namedtuple('SpecialCase', 'function keys source')
+
+# Computed values added to the data of particular models after the
+# regular fields. 'keys' are the names of the values added and
+# 'source' is the inlined to-many field they are computed from, if any.
+SPECIAL_CASES = {
+    'Preparation': SpecialCase(isonloan_to_data, ('isonloan',), None),
+    'Specifyuser': SpecialCase(isadmin_to_data, ('isadmin',), None),
+    'Collectionobject': SpecialCase(currentdetermination_to_data, ('currentdetermination',), 'determinations'),
+    'Loan': SpecialCase(loan_totals_to_data, ('totalPreps', 'totalItems',
+                                              'unresolvedPreps', 'unresolvedItems',
+                                              'resolvedPreps', 'resolvedItems'), 'loanpreparations'),
+}
+
+# Fields never sent to the client.
+EXCLUDED_FIELDS = {
+    'Specifyuser': ('password',),
+}
+
+class ModelSerializer(object):
+    """Converts instances of a single Django model into the structures
+    returned by the API. Everything that depends only on the model -
+    which fields to include, how each is represented, the URI prefixes
+    of related resources - is worked out once when the serializer is
+    built, leaving only attribute reads to be done for each object.
+
+    Each field has a getter returning its value or URI and, for
+    dependent relationships, an inline getter returning the nested
+    data of the related resources.
+    """
+    def __init__(self, model):
+        self.model = model
+        name = model.__name__
+        specify_model = model.specify_model
+        excluded = EXCLUDED_FIELDS.get(name, ())
+        embeddable = EMBEDDABLE_FIELDS.get(name, ())
+
+        self.getters = []
+        self.field_names = []
+        self.columns = {}
+        self.dependent_to_ones = []
+        self.embeddable_to_ones = []
+        self.dependent_to_manys = []
+
+        for field in model._meta.get_fields():
+            if field.auto_created or field.one_to_many or field.many_to_many or field.name in excluded:
+                continue
+            inline_getter = None
+            if field.many_to_one or field.one_to_one:
+                getter = self.to_one_uri_getter(field)
+                spfield = specify_model.get_field(field.name)
+                if spfield is not None and spfield.dependent:
+                    inline_getter = self.dependent_to_one_getter(field.name)
+                    self.dependent_to_ones.append(field.name)
+                elif field.name in embeddable:
+                    inline_getter = self.embeddable_to_one_getter(field, getter)
+                    self.embeddable_to_ones.append(field.name)
+            else:
+                getter = attrgetter(field.name)
+            self.getters.append((field.name, getter, inline_getter))
+            self.field_names.append(field.name)
+            self.columns[field.name] = field.name
+
+        for rel in model._meta.get_fields():
+            if not rel.one_to_many: continue
+            field_name = rel.get_accessor_name()
+            getter = self.to_many_uri_getter(rel)
+            inline_getter = None
+            spfield = specify_model.get_field(field_name)
+            if spfield is not None and spfield.dependent:
+                inline_getter = self.dependent_to_many_getter(field_name)
+                self.dependent_to_manys.append(field_name)
+            self.getters.append((field_name, getter, inline_getter))
+
+        self.uri_prefix = uri_for_model(model)
+        self.special_case = SPECIAL_CASES.get(name, None)
+        self.domain_field = EMBEDDING_DOMAINS[model].split('__')[0] if model in EMBEDDING_DOMAINS else None
+
+    @staticmethod
+    def dependent_to_one_getter(field_name):
+        def getter(obj, depth):
+            related_obj = getattr(obj, field_name)
+            if related_obj is None: return None
+            return obj_to_data(related_obj, depth=depth)
+        return getter
+
+    @staticmethod
+    def embeddable_to_one_getter(field, uri_getter):
+        field_name = field.name
+        def getter(obj, depth):
+            if is_dependent_field(obj, field_name):
+                related_obj = getattr(obj, field_name)
+                if related_obj is None: return None
+                return obj_to_data(related_obj, depth=depth)
+            return uri_getter(obj)
+        return getter
+
+    @staticmethod
+    def to_one_uri_getter(field):
+        id_attr = field.attname
+        prefix = uri_for_model(field.related_model)
+        def getter(obj):
+            related_id = getattr(obj, id_attr)
+            if related_id is None: return None
+            return prefix + '%d/' % int(related_id)
+        return getter
+
+    @staticmethod
+    def dependent_to_many_getter(field_name):
+        def getter(obj, depth):
+            return [obj_to_data(o, depth=depth) for o in getattr(obj, field_name).all()]
+        return getter
+
+    @staticmethod
+    def to_many_uri_getter(rel):
+        prefix = uri_for_model(rel.related_model) + '?' + urlencode([(rel.field.name.lower(), '')])
+        def getter(obj):
+            return prefix + str(obj.id)
+        return getter
+
+    def select_fields(self, names):
+        """Return the set of fields to include in the data when the
+        client asks for the given field names, or None if all fields
+        should be included. The inlined fields that requested special
+        values are computed from are added to the set.
+        """
+        if names is None: return None
+        names = set(names)
+        known = set(name for name, _, _ in self.getters)
+        special = self.special_case
+        if special is not None:
+            known.update(special.keys)
+            if special.source is not None and not names.isdisjoint(special.keys):
+                names.add(special.source)
+        unknown = names - known
+        if unknown:
+            raise FieldsError("unknown fields for %s: %s" % (self.model.__name__, ', '.join(sorted(unknown))))
+        return frozenset(names)
+
+    def only_columns(self, fields):
+        """Return the names to pass to QuerySet.only() so that just the
+        columns needed to serialize 'fields' are loaded.
+        """
+        columns = set(self.columns[name] for name in fields if name in self.columns)
+        columns.add('id')
+        if self.domain_field is not None and not fields.isdisjoint(self.embeddable_to_ones):
+            columns.add(self.domain_field)
+        return columns
+
+    def to_data(self, obj, fields=None, depth=None):
+        inline = depth is None or depth > 0
+        child_depth = None if depth is None else depth - 1
+        data = {}
+        for name, getter, inline_getter in self.getters:
+            if fields is not None and name not in fields:
+                continue
+            if inline and inline_getter is not None:
+                data[name] = inline_getter(obj, child_depth)
+            else:
+                data[name] = getter(obj)
+        # Add a meta data field with the resource's URI.
+        data['resource_uri'] = self.uri_prefix + '%d/' % int(obj.id)
+        special = self.special_case
+        if (special is not None
+            and (fields is None or not fields.isdisjoint(special.keys))
+            and (special.source is None or isinstance(data.get(special.source), list))):
+            special.function(obj, data)
+        return data
+
+_serializers = {}
+
+def get_serializer(model):
+    """Return the ModelSerializer for the Django model 'model',
+    building it on first use.
     """
-    parent_model = rel.model.specify_model
-    field_name = rel.get_accessor_name()
-    field = parent_model.get_field(field_name)
-    if field is not None and field.dependent:
-        objs = getattr(obj, field_name)
-        return [obj_to_data(o) for o in objs.all()]
+    try:
+        return _serializers[model]
+    except KeyError:
+        serializer = _serializers[model] = ModelSerializer(model)
+        return serializer
 
-    collection_uri = uri_for_model(rel.related_model)
-    return collection_uri + '?' + urlencode([(rel.field.name.lower(), str(obj.id))])
+def prefetch_dependents(objs, fields=None, depth=None):
+    """Load the dependent resources that obj_to_data will inline for
+    all the Django model instances in 'objs', which should be of the
+    same model. Each dependent relationship is fetched with one query
+    for the whole list rather than one query per object, and the
+    process is repeated for each level of the dependent hierarchy.
 
-def field_to_val(obj, field):
-    """Return the value or nested data or URI for the given field which should
-    be either a regular field or a *-to-one field.
+    'fields' and 'depth' have the same meaning as for obj_to_data.
     """
-    if field.many_to_one or (field.one_to_one and not field.auto_created):
-        if is_dependent_field(obj, field.name):
-            related_obj = getattr(obj, field.name)
-            if related_obj is None: return None
-            return obj_to_data(related_obj)
-        related_id = getattr(obj, field.name + '_id')
-        if related_id is None: return None
-        return uri_for_model(field.related_model, related_id)
-    else:
-        return getattr(obj, field.name)
+    objs = [obj for obj in objs if obj is not None]
+    if not objs: return
+    model = objs[0].__class__
+    serializer = get_serializer(model)
+
+    def wanted(field_names):
+        return [name for name in field_names if fields is None or name in fields]
+
+    if model is models.Preparation and wanted(['isonloan']):
+        models.Preparation.prefetch_isonloan(objs)
+
+    if depth is not None and depth <= 0: return
+    child_depth = None if depth is None else depth - 1
+
+    embeddable_to_ones = wanted(serializer.embeddable_to_ones)
+    if embeddable_to_ones:
+        prefetch_related_objects(objs, EMBEDDING_DOMAINS[model])
+
+    for field_name in wanted(serializer.dependent_to_manys):
+        prefetch_related_objects(objs, field_name)
+        prefetch_dependents([related
+                             for obj in objs
+                             for related in getattr(obj, field_name).all()],
+                            depth=child_depth)
+
+    for field_name in wanted(serializer.dependent_to_ones):
+        prefetch_related_objects(objs, field_name)
+        prefetch_dependents([getattr(obj, field_name) for obj in objs], depth=child_depth)
+
+    for field_name in embeddable_to_ones:
+        with_dependent = [obj for obj in objs if is_dependent_field(obj, field_name)]
+        if not with_dependent: continue
+        prefetch_related_objects(with_dependent, field_name)
+        prefetch_dependents([getattr(obj, field_name) for obj in with_dependent], depth=child_depth)
 
 def get_collection(logged_in_collection, model, control_params=GetCollectionForm.defaults, params={}):
     """Return a list of structured data for the objects from 'model'
     subject to the request 'params'."""
+    objs = collection_queryset(logged_in_collection, model, control_params, params)
+    fields = get_serializer(objs.model).select_fields(control_params['fields'])
+    try:
+        return objs_to_data(objs, control_params['offset'], control_params['limit'],
+                            fields, control_params['depth'],
+                            control_params['count'], control_params['after'])
+    except FieldError as e:
+        raise OrderByError(e)
+
+def stream_collection(logged_in_collection, model, control_params=GetCollectionForm.defaults, params={}):
+    """Return an iterator over pieces of the JSON text of the collection
+    structure for all the objects from 'model' subject to the request
+    'params', starting at the requested offset. The objects are loaded
+    and serialized a chunk at a time as the iterator is consumed.
+    """
+    objs = collection_queryset(logged_in_collection, model, control_params, params)
+    fields = get_serializer(objs.model).select_fields(control_params['fields'])
+    try:
+        return stream_objs_to_json(objs, control_params['offset'], fields,
+                                   control_params['depth'], control_params['count'])
+    except FieldError as e:
+        raise OrderByError(e)
+
+def collection_queryset(logged_in_collection, model, control_params=GetCollectionForm.defaults, params={}):
+    """Return the queryset of the objects from 'model' subject to the
+    request 'params'."""
     if isinstance(model, str):
         model = get_model_or_404(model)
 
@@ -740,26 +1351,218 @@ def get_collection(logged_in_collection, model, control_params=GetCollectionForm
             objs = objs.order_by(control_params['orderby'])
         except FieldError as e:
             raise OrderByError(e)
-    try:
-        return objs_to_data(objs, control_params['offset'], control_params['limit'])
-    except FieldError as e:
-        raise OrderByError(e)
+    return objs
+
+def total_count(objs, count):
+    """Return the exact or estimated number of objects in the queryset
+    'objs', or None, according to the 'count' control parameter.
+    """
+    if count == 'true':
+        return objs.count()
+    elif count == 'estimate':
+        return estimate_count(objs)
+    else:
+        return None
 
-def objs_to_data(objs, offset=0, limit=20):
+def count_meta(count):
+    return {'true': 'exact', 'estimate': 'estimate'}.get(count, 'none')
+
+def objs_to_data(objs, offset=0, limit=20, fields=None, depth=None, count='true', after=None):
     """Return a collection structure with a list of the data of given objects
     and collection meta data.
+
+    'fields' and 'depth' have the same meaning as for obj_to_data.
+
+    If 'count' is 'estimate' the total count is taken from the
+    database's row estimates and if it is 'false' it is omitted.
+
+    If 'after' is given the objects following the one with that id
+    are returned instead of those starting at 'offset'. See keyset_page.
     """
-    total_count = objs.count()
+    if after is not None:
+        offset = 0
+
+    meta = {'limit': limit,
+            'offset': offset,
+            'total_count': total_count(objs, count),
+            'count': count_meta(count),
+            'pagination': 'offset' if after is None else 'keyset'}
+
+    if fields is not None:
+        objs = objs.only(*get_serializer(objs.model).only_columns(fields))
+
+    if after is not None:
+        objs = keyset_page(objs, after)
 
     if limit == 0:
-        objs = objs[offset:]
+        objs = list(objs[offset:])
     else:
-        objs = objs[offset:offset + limit]
+        objs = list(objs[offset:offset + limit])
+
+    prefetch_dependents(objs, fields, depth)
+
+    if after is not None:
+        meta['after'] = after
+        meta['next_after'] = objs[-1].id if limit and len(objs) == limit else None
+
+    return {'objects': [obj_to_data(o, fields, depth) for o in objs],
+            'meta': meta}
 
-    return {'objects': [obj_to_data(o) for o in objs],
-            'meta': {'limit': limit,
-                     'offset': offset,
-                     'total_count': total_count}}
+# Number of objects loaded at a time when streaming.
+STREAM_CHUNK_SIZE = 1000
+
+def stream_objs_to_json(objs, offset=0, fields=None, depth=None, count='true', chunk_size=STREAM_CHUNK_SIZE):
+    """Return an iterator over pieces of the JSON text of the collection
+    structure that objs_to_data would return for all the objects of the
+    queryset 'objs' from 'offset' on, in the same order.
+
+    The objects are loaded, prefetched and serialized 'chunk_size' at a
+    time, so memory use is bounded by the chunk size rather than the
+    number of objects. If the objects are not ordered, or ordered by id
+    alone, each chunk is fetched by keyset pagination on the id from
+    the last object of the previous one. Otherwise, since an ordering
+    on other fields may not be total, their ids are read in order by
+    stream_ids and each chunk is loaded by its ids. The first chunk is
+    loaded before returning so that errors in the query are raised here.
+    """
+    meta = {'limit': 0,
+            'offset': offset,
+            'total_count': total_count(objs, count),
+            'count': count_meta(count),
+            'pagination': 'offset'}
+
+    if fields is not None:
+        objs = objs.only(*get_serializer(objs.model).only_columns(fields))
+
+    if orders_by_id(objs):
+        first_chunk = list(keyset_page(objs, 0)[offset:offset + chunk_size])
+        def next_chunk(chunk):
+            return list(keyset_page(objs, chunk[-1].id)[:chunk_size])
+    else:
+        id_chunks = stream_ids(objs, offset, chunk_size)
+        def next_chunk(chunk):
+            ids = next(id_chunks, [])
+            by_id = objs.order_by().in_bulk(ids)
+            return [by_id[id] for id in ids if id in by_id]
+        first_chunk = next_chunk(None)
+
+    def chunks():
+        chunk = first_chunk
+        while chunk:
+            prefetch_dependents(chunk, fields, depth)
+            yield [obj_to_data(o, fields, depth) for o in chunk]
+            if len(chunk) < chunk_size: break
+            chunk = next_chunk(chunk)
+
+    return json_array_chunks(chunks(), '{"objects": [', '], "meta": %s}' % toJson(meta))
+
+def orders_by_id(objs):
+    """Return True if the queryset 'objs' is not ordered, explicitly or
+    by its model's default ordering, or is ordered by the id alone.
+    """
+    ordering = objs.query.order_by or (objs.model._meta.ordering if objs.query.default_ordering else ())
+    return all(field.lstrip('-') in ('id', 'pk') for field in ordering)
+
+def stream_ids(objs, offset=0, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield lists of up to 'chunk_size' ids of the objects of the
+    queryset 'objs' in order from 'offset' on. They are read by
+    stream_values_list on a connection of their own, so the usual
+    connection remains free to load the objects while the ids are read.
+    """
+    db = connections[objs.db].copy()
+    try:
+        for rows in stream_values_list(objs.values_list('id')[offset:], chunk_size, db):
+            yield [id for id, in rows]
+    finally:
+        db.close()
+
+def json_array_chunks(chunks, prefix='[', suffix=']'):
+    """Yield the JSON text of the array of the items in the lists yielded
+    by 'chunks', one piece per chunk, surrounded by 'prefix' and 'suffix'.
+    """
+    yield prefix
+    separator = ''
+    for chunk in chunks:
+        if not chunk: continue
+        yield separator + toJson(chunk)[1:-1]
+        separator = ', '
+    yield suffix
+
+def keyset_page(objs, after):
+    """Return the objects in the queryset 'objs' that follow the object
+    with id 'after' in the queryset's ordering, which may be on at most
+    one field besides the id. If the queryset is not explicitly ordered
+    the model's default ordering is used. The id is used to break ties
+    so the ordering is total. An 'after' of zero gives the first page.
+
+    Unlike an OFFSET, the filter can be satisfied from an index
+    however deep the page is.
+    """
+    ordering = objs.query.order_by or (objs.model._meta.ordering if objs.query.default_ordering else ())
+    order_by = [f for f in ordering if f.lstrip('-') not in ('id', 'pk')]
+    if len(order_by) > 1:
+        raise OrderByError("keyset pagination supports ordering by one field")
+
+    if not order_by:
+        descending = any(f.startswith('-') for f in ordering)
+        objs = objs.order_by('-id' if descending else 'id')
+        if after == 0: return objs
+        return objs.filter(id__lt=after) if descending else objs.filter(id__gt=after)
+
+    field = order_by[0]
+    descending = field.startswith('-')
+    name = field.lstrip('-')
+    objs = objs.order_by(field, '-id' if descending else 'id')
+    if after == 0: return objs
+
+    values = objs.model.objects.filter(id=after).values_list(name, flat=True)[:1]
+    if not values:
+        raise FilterError("%s %d does not exist" % (objs.model.__name__, after))
+    value = values[0]
+
+    # MySQL sorts NULLs before all other values.
+    if descending:
+        if value is None:
+            after_filter = Q(**{name + '__isnull': True, 'id__lt': after})
+        else:
+            after_filter = (Q(**{name + '__lt': value})
+                            | Q(**{name: value, 'id__lt': after})
+                            | Q(**{name + '__isnull': True}))
+    else:
+        if value is None:
+            after_filter = (Q(**{name + '__isnull': True, 'id__gt': after})
+                            | Q(**{name + '__isnull': False}))
+        else:
+            after_filter = (Q(**{name + '__gt': value})
+                            | Q(**{name: value, 'id__gt': after}))
+    return objs.filter(after_filter)
+
+def estimate_count(objs):
+    """Return an estimate of the number of objects in the queryset 'objs'
+    from the table statistics if it is unfiltered or from the query
+    plan otherwise. Falls back to an exact count if no estimate
+    is available.
+    """
+    objs = objs.order_by()
+    try:
+        with connection.cursor() as cursor:
+            if not objs.query.where:
+                cursor.execute("select table_rows from information_schema.tables "
+                               "where table_schema = database() and table_name = %s",
+                               [objs.model._meta.db_table])
+                row = cursor.fetchone()
+                estimate = row[0] if row is not None else None
+            else:
+                sql, params = objs.query.sql_with_params()
+                cursor.execute('explain ' + sql, params)
+                columns = [c[0].lower() for c in cursor.description]
+                plan = cursor.fetchall()
+                estimate = plan[0][columns.index('rows')] if plan and 'rows' in columns else None
+    except DatabaseError as e:
+        logger.warning("count estimate failed: %s", e)
+        estimate = None
+
+    return objs.count() if estimate is None else int(estimate)
 
 def uri_for_model(model, id=None):
     """Given a Django model and optionally an id, return a URI
@@ -795,7 +1598,34 @@ def rows(request, model_name):
     if form.cleaned_data['distinct']:
         query = query.distinct()
     limit = form.cleaned_data['limit']
-    if limit:
-        query = query[:limit]
+    if not limit:
+        return StreamingHttpResponse(json_array_chunks(stream_values_list(query)),
+                                     content_type='application/json')
+    query = query[:limit]
     data = list(query)
     return HttpResponse(toJson(data), content_type='application/json')
+
+def stream_values_list(query, chunk_size=STREAM_CHUNK_SIZE, db=None):
+    """Yield lists of up to 'chunk_size' rows of the values_list queryset
+    'query'. The rows are read through an unbuffered cursor so the
+    result set is never held in memory, and converted as Django
+    would convert them. The connection, which is the query's unless
+    'db' is given, cannot be used for other queries until the
+    iteration is finished.
+    """
+    compiler = query.query.get_compiler(using=query.db)
+    sql, params = compiler.as_sql()
+    if db is None:
+        db = connections[query.db]
+    db.ensure_connection()
+    cursor = db.connection.cursor(SSCursor)
+    try:
+        cursor.execute(sql, params)
+        results = iter(lambda: cursor.fetchmany(chunk_size), ())
+        rows = compiler.results_iter(results=results, tuple_expected=True)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk: break
+            yield chunk
+    finally:
+        cursor.close()
@@ -1,10 +1,12 @@
 from unittest import skip
+import json
 
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from django.db.models import Max
 from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from specifyweb.specify import api, models
+from specifyweb.specify import api, models, recordset_index
 
 class MainSetupTearDown:
     def setUp(self):
@@ -201,6 +203,56 @@ class RecordSetTests(ApiTests):
         info = api.get_recordset_info(self.collectionobjects[0], self.recordset.id)
         self.assertEqual(info, None)
 
+    def test_recordset_info_follows_changes(self):
+        ids = [co.id for co in self.collectionobjects]
+        for id in ids:
+            self.recordset.recordsetitems.create(recordid=id)
+
+        info = api.get_recordset_info(self.collectionobjects[2], self.recordset.id)
+        self.assertEqual(info['index'], 2)
+
+        self.recordset.recordsetitems.filter(recordid=ids[0]).delete()
+        info = api.get_recordset_info(self.collectionobjects[2], self.recordset.id)
+        self.assertEqual(info['index'], 1)
+        self.assertEqual(info['total_count'], len(ids) - 1)
+
+        with CaptureQueriesContext(connection) as context:
+            api.get_recordset_info(self.collectionobjects[3], self.recordset.id)
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_recordset_window(self):
+        ids = sorted(co.id for co in self.collectionobjects)
+        for id in ids:
+            self.recordset.recordsetitems.create(recordid=id)
+
+        window = recordset_index.window(self.recordset.id, self.recordset.dbtableid, ids[1], 2)
+        self.assertEqual(window['index'], 1)
+        self.assertEqual(window['offset'], 0)
+        self.assertEqual(window['recordids'], ids[0:4])
+
+    def test_recordset_window_view(self):
+        from django.http import Http404
+        from specifyweb.specify.views import recordset_window
+        for co in self.collectionobjects:
+            self.recordset.recordsetitems.create(recordid=co.id)
+
+        def get(collection):
+            request = RequestFactory().get('/api/specify/recordset/%d/window/' % self.recordset.id,
+                                           {'recordid': self.collectionobjects[0].id, 'size': 2})
+            request.user = self.specifyuser
+            request.specify_collection = collection
+            return recordset_window(request, str(self.recordset.id))
+
+        self.assertEqual(json.loads(get(self.collection).content)['index'], 0)
+
+        other_collection = models.Collection.objects.create(
+            catalognumformatname='test',
+            collectionname='OtherCollection',
+            isembeddedcollectingevent=False,
+            discipline=self.discipline)
+        with self.assertRaises(Http404):
+            get(other_collection)
+
     def test_recordsetitem_ordering(self):
         ids = [co.id for co in self.collectionobjects]
         ids.sort()
@@ -260,6 +312,16 @@ class VersionCtrlApiTests(ApiTests):
                              data['id'], data['version'], data)
         self.assertEqual(obj.version, data['version'] + 1)
 
+    def test_single_update_statement(self):
+        data = api.get_resource('collection', self.collection.id)
+        data['collectionname'] = 'New Name'
+        with CaptureQueriesContext(connection) as context:
+            api.update_obj(self.collection, self.agent, 'collection',
+                           data['id'], data['version'], data)
+        updates = [q['sql'] for q in context.captured_queries
+                   if q['sql'].lower().startswith('update') and 'collection' in q['sql'].lower()]
+        self.assertEqual(len(updates), 1)
+
     def test_update_object(self):
         data = api.get_resource('collection', self.collection.id)
         data['collectionname'] = 'New Name'
@@ -421,4 +483,355 @@ class InlineApiTests(ApiTests):
         self.assertEqual(obj.collectionobjectattribute.text1, 'look! an attribute')
 
 
+    def test_unchanged_inlines_not_updated(self):
+        for i in range(3):
+            self.collectionobjects[0].determinations.create(
+                collectionmemberid=self.collection.id,
+                number1=i)
+
+        data = api.get_resource('collectionobject', self.collectionobjects[0].id)
+        data['determinations'][0]['remarks'] = 'changed'
+        versions = {d['id']: d['version'] for d in data['determinations']}
+
+        with CaptureQueriesContext(connection) as context:
+            api.update_obj(self.collection, self.agent, 'collectionobject',
+                           data['id'], data['version'], data)
+
+        updates = [q['sql'] for q in context.captured_queries
+                   if q['sql'].lower().startswith('update') and 'determination' in q['sql'].lower()]
+        self.assertEqual(len(updates), 1)
+
+        for det in models.Determination.objects.filter(collectionobject=self.collectionobjects[0]):
+            changed = det.id == data['determinations'][0]['id']
+            self.assertEqual(det.version, versions[det.id] + (1 if changed else 0))
+            self.assertEqual(det.remarks, 'changed' if changed else None)
+
+    def test_stale_inline_not_skipped(self):
+        det = self.collectionobjects[0].determinations.create(
+            collectionmemberid=self.collection.id,
+            number1=1)
+
+        data = api.get_resource('collectionobject', self.collectionobjects[0].id)
+        data['determinations'][0]['version'] -= 1
+
+        with self.assertRaises(api.StaleObjectException):
+            api.update_obj(self.collection, self.agent, 'collectionobject',
+                           data['id'], data['version'], data)
+
     # version control on inlined resources should be tested
+
+class PrefetchApiTests(ApiTests):
+    def setUp(self):
+        super(PrefetchApiTests, self).setUp()
+        preptype = models.Preptype.objects.create(collection=self.collection)
+        for co in self.collectionobjects:
+            co.determinations.create(iscurrent=True, number1=1)
+            co.preparations.create(collectionmemberid=self.collection.id, preptype=preptype)
+
+    def test_prefetched_data_matches(self):
+        data = api.get_collection(self.collection, 'collectionobject')
+        for obj in data['objects']:
+            co = models.Collectionobject.objects.get(id=obj['id'])
+            self.assertEqual(obj, api.obj_to_data(co))
+
+    def test_queries_independent_of_page_size(self):
+        def count_queries(limit):
+            control_params = dict(api.GetCollectionForm.defaults, limit=limit)
+            with CaptureQueriesContext(connection) as context:
+                api.get_collection(self.collection, 'collectionobject', control_params)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(len(self.collectionobjects)))
+
+class SerializerTests(ApiTests):
+    def test_serializer_built_once(self):
+        self.assertIs(api.get_serializer(models.Collectionobject),
+                      api.get_serializer(models.Collectionobject))
+
+    def test_password_not_serialized(self):
+        data = api.obj_to_data(self.specifyuser)
+        self.assertNotIn('password', data)
+        self.assertIn('isadmin', data)
+
+    def test_uris(self):
+        data = api.obj_to_data(self.collectionobjects[0])
+        self.assertEqual(data['resource_uri'],
+                         '/api/specify/collectionobject/%d/' % self.collectionobjects[0].id)
+        self.assertEqual(data['collection'],
+                         '/api/specify/collection/%d/' % self.collection.id)
+        self.assertEqual(data['currentdetermination'], None)
+
+class SparseFieldsetTests(ApiTests):
+    def setUp(self):
+        super(SparseFieldsetTests, self).setUp()
+        for co in self.collectionobjects:
+            co.determinations.create(iscurrent=True, number1=1)
+
+    def test_fields(self):
+        control_params = dict(api.GetCollectionForm.defaults, fields=['catalognumber'])
+        data = api.get_collection(self.collection, 'collectionobject', control_params)
+        for obj in data['objects']:
+            self.assertEqual(set(obj.keys()), {'catalognumber', 'resource_uri'})
+
+    def test_unknown_fields(self):
+        control_params = dict(api.GetCollectionForm.defaults, fields=['nosuchfield'])
+        with self.assertRaises(api.FieldsError):
+            api.get_collection(self.collection, 'collectionobject', control_params)
+
+    def test_special_case_source_included(self):
+        co = self.collectionobjects[0]
+        data = api.get_resource('collectionobject', co.id, fields=['currentdetermination'])
+        self.assertEqual(data['currentdetermination'], data['determinations'][0]['resource_uri'])
+
+    def test_depth(self):
+        co = self.collectionobjects[0]
+        data = api.get_resource('collectionobject', co.id, depth=0)
+        self.assertEqual(data['determinations'],
+                         '/api/specify/determination/?collectionobject=%d' % co.id)
+        self.assertNotIn('currentdetermination', data)
+
+        data = api.get_resource('collectionobject', co.id, depth=1)
+        self.assertEqual(len(data['determinations']), 1)
+
+    def test_fields_limit_columns(self):
+        control_params = dict(api.GetCollectionForm.defaults, fields=['catalognumber'])
+        with CaptureQueriesContext(connection) as context:
+            api.get_collection(self.collection, 'collectionobject', control_params)
+        self.assertNotIn('remarks', context.captured_queries[-1]['sql'].lower())
+
+class KeysetPaginationTests(ApiTests):
+    def get_pages(self, orderby=None):
+        ids = []
+        after = 0
+        while after is not None:
+            control_params = dict(api.GetCollectionForm.defaults,
+                                  limit=2, after=after, orderby=orderby, count='false')
+            data = api.get_collection(self.collection, 'collectionobject', control_params)
+            self.assertEqual(data['meta']['pagination'], 'keyset')
+            self.assertEqual(data['meta']['total_count'], None)
+            ids.extend(obj['id'] for obj in data['objects'])
+            after = data['meta']['next_after']
+        return ids
+
+    def test_keyset_by_id(self):
+        self.assertEqual(self.get_pages(), sorted(co.id for co in self.collectionobjects))
+
+    def test_keyset_by_field(self):
+        self.collectionobjects[2].catalognumber = None
+        self.collectionobjects[2].save()
+        expected = list(models.Collectionobject.objects.order_by('-catalognumber', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(self.get_pages('-catalognumber'), expected)
+
+    def test_offset_is_default(self):
+        data = api.get_collection(self.collection, 'collectionobject')
+        self.assertEqual(data['meta']['pagination'], 'offset')
+        self.assertEqual(data['meta']['count'], 'exact')
+        self.assertEqual(data['meta']['total_count'], len(self.collectionobjects))
+
+    def test_count_estimate(self):
+        control_params = dict(api.GetCollectionForm.defaults, count='estimate')
+        data = api.get_collection(self.collection, 'collectionobject', control_params)
+        self.assertEqual(data['meta']['count'], 'estimate')
+        self.assertIsInstance(data['meta']['total_count'], int)
+
+class ConditionalGetTests(ApiTests):
+    def get(self, obj, **headers):
+        request = RequestFactory().get('/api/specify/collectionobject/%d/' % obj.id, **headers)
+        return api.resource_dispatch(request, 'collectionobject', str(obj.id))
+
+    def test_not_modified(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.get(co, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        for query in context.captured_queries:
+            self.assertNotIn('remarks', query['sql'].lower())
+
+    def test_modified(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co)['ETag']
+        data = api.get_resource('collectionobject', co.id)
+        data['remarks'] = 'changed'
+        api.update_obj(self.collection, self.agent, 'collectionobject',
+                       co.id, data['version'], data)
+        response = self.get(co, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_params(self):
+        co = self.collectionobjects[0]
+        self.assertNotEqual(api.current_resource_etag('collectionobject', co.id),
+                            api.current_resource_etag('collectionobject', co.id, ['catalognumber']))
+
+    def test_no_etag_for_computed_values(self):
+        self.assertIsNone(api.current_resource_etag('specifyuser', self.specifyuser.id))
+
+    def test_dependent_modified(self):
+        co = self.collectionobjects[0]
+        det = co.determinations.create(iscurrent=True)
+        etag = self.get(co)['ETag']
+        data = api.get_resource('determination', det.id)
+        data['remarks'] = 'changed'
+        api.update_obj(self.collection, self.agent, 'determination',
+                       det.id, data['version'], data)
+        self.assertEqual(models.Collectionobject.objects.get(id=co.id).version, co.version)
+        response = self.get(co, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['determinations'][0]['remarks'], 'changed')
+
+    def test_dependent_added(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co)['ETag']
+        co.determinations.create(iscurrent=True)
+        self.assertEqual(self.get(co, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_one_query(self):
+        co = self.collectionobjects[0]
+        co.determinations.create(iscurrent=True)
+        with CaptureQueriesContext(connection) as context:
+            api.current_resource_etag('collectionobject', co.id)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_embedding_setting_changes_etag(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co)['ETag']
+        data = api.get_resource('collection', self.collection.id)
+        data['isembeddedcollectingevent'] = not self.collection.isembeddedcollectingevent
+        api.update_obj(self.collection, self.agent, 'collection',
+                       self.collection.id, data['version'], data)
+        self.assertEqual(self.get(co, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_etag_for_computed_dependents(self):
+        co = self.collectionobjects[0]
+        self.assertIsNotNone(api.current_resource_etag('collectionobject', co.id))
+        preptype = models.Preptype.objects.create(collection=self.collection)
+        co.preparations.create(collectionmemberid=self.collection.id, preptype=preptype)
+        self.assertIsNone(api.current_resource_etag('collectionobject', co.id))
+        self.assertIsNotNone(api.current_resource_etag('collectionobject', co.id, depth=0))
+
+class StreamingTests(ApiTests):
+    def test_stream_matches_collection(self):
+        control_params = dict(api.GetCollectionForm.defaults, limit=0, offset=1)
+        streamed = json.loads(''.join(api.stream_collection(
+            self.collection, 'collectionobject', control_params)))
+        self.assertEqual(streamed, api.get_collection(
+            self.collection, 'collectionobject', control_params))
+
+    def test_stream_chunks(self):
+        objs = models.Collectionobject.objects.order_by('id')
+        streamed = json.loads(''.join(api.stream_objs_to_json(objs, chunk_size=2)))
+        self.assertEqual([obj['id'] for obj in streamed['objects']],
+                         sorted(co.id for co in self.collectionobjects))
+
+    def test_unordered_streamed_by_id(self):
+        for objs in (models.Collectionobject.objects.all(),
+                     models.Collectionobject.objects.order_by('-id'),
+                     models.Determination.objects.order_by()):
+            self.assertTrue(api.orders_by_id(objs))
+        for objs in (models.Collectionobject.objects.order_by('catalognumber'),
+                     models.Determination.objects.all()):
+            self.assertFalse(api.orders_by_id(objs))
+
+        objs = models.Collectionobject.objects.all()
+        streamed = json.loads(''.join(api.stream_objs_to_json(objs, 1, chunk_size=2)))
+        self.assertEqual([obj['id'] for obj in streamed['objects']],
+                         sorted(co.id for co in self.collectionobjects)[1:])
+
+    def test_queries_per_chunk(self):
+        models.Collectionobject.objects.bulk_create([
+            models.Collectionobject(collection=self.collection, catalognumber="bulk-%d" % i)
+            for i in range(3000 - len(self.collectionobjects))])
+
+        def query_count(objs):
+            with CaptureQueriesContext(connection) as context:
+                for piece in api.stream_objs_to_json(objs, count='false', chunk_size=100):
+                    pass
+            return len(context.captured_queries)
+
+        objs = models.Collectionobject.objects.all()
+        small = query_count(objs.filter(id__lte=objs.order_by('id')[299].id))
+        large = query_count(objs)
+        # Each full chunk takes the same queries, and one more finds
+        # there are no objects after the last chunk.
+        self.assertEqual((large - 1) * 3, (small - 1) * 30)
+
+class OrderedStreamingTests(MainSetupTearDown, TransactionTestCase):
+    # The ids of ordered objects are read on a separate connection,
+    # which only sees committed records.
+    def test_stream_matches_objs_to_data(self):
+        for i, co in enumerate(self.collectionobjects):
+            co.determinations.create(iscurrent=i % 2 == 0)
+            co.determinations.create(iscurrent=False)
+        for objs in (models.Collectionobject.objects.all(),
+                     models.Collectionobject.objects.order_by('-id'),
+                     models.Collectionobject.objects.order_by('-catalognumber'),
+                     models.Determination.objects.order_by('-iscurrent', 'id'),
+                     models.Determination.objects.order_by('collectionobject__catalognumber', 'id')):
+            for offset in (0, 3):
+                streamed = json.loads(''.join(api.stream_objs_to_json(objs, offset, chunk_size=2)))
+                self.assertEqual(streamed, json.loads(api.toJson(api.objs_to_data(objs, offset, limit=0))))
+
+    def test_ordered_queries_per_chunk(self):
+        objs = models.Collectionobject.objects.order_by('-catalognumber')
+        with CaptureQueriesContext(connection) as context:
+            streamed = json.loads(''.join(api.stream_objs_to_json(objs, count='false', chunk_size=2)))
+        self.assertEqual([obj['catalognumber'] for obj in streamed['objects']],
+                         ["num-%d" % i for i in reversed(range(5))])
+        loads = [q for q in context.captured_queries
+                 if '`collectionobject`.`CollectionObjectID` IN (' in q['sql']]
+        self.assertEqual(len(loads), 3)
+
+class BulkApiTests(ApiTests):
+    def setUp(self):
+        super(BulkApiTests, self).setUp()
+        self.recordset = models.Recordset.objects.create(
+            collectionmemberid=self.collection.id,
+            dbtableid=models.Collectionobject.specify_model.tableId,
+            name="Test recordset",
+            type=0,
+            specifyuser=self.specifyuser)
+
+    def test_bulk_create_and_update(self):
+        co = self.collectionobjects[0]
+        collection_uri = api.uri_for_model('collection', self.collection.id)
+        results = api.bulk_post_resources(self.collection, self.agent, 'collectionobject', [
+            {'collection': collection_uri, 'catalognumber': 'bulk-1'},
+            {'id': co.id, 'version': co.version, 'remarks': 'bulk update'},
+            {'id': co.id, 'version': co.version, 'remarks': 'stale update'},
+            {'collection': collection_uri, 'catalognumber': 'bulk-2'},
+        ], recordsetid=self.recordset.id)
+
+        self.assertEqual([r['status'] for r in results], [201, 200, 409, 201])
+        self.assertEqual(models.Collectionobject.objects.get(id=co.id).remarks, 'bulk update')
+        created = [results[0]['id'], results[3]['id']]
+        self.assertEqual(
+            set(models.Collectionobject.objects.filter(id__in=created).values_list('catalognumber', flat=True)),
+            {'bulk-1', 'bulk-2'})
+        self.assertEqual(
+            sorted(self.recordset.recordsetitems.values_list('recordid', flat=True)),
+            sorted(created))
+
+        info = api.get_recordset_info(models.Collectionobject.objects.get(id=created[0]), self.recordset.id)
+        self.assertEqual(info['total_count'], 2)
+
+    def test_bulk_unexpected_error_aborts(self):
+        collection_uri = api.uri_for_model('collection', self.collection.id)
+        with self.assertRaises(ValueError):
+            api.bulk_post_resources(self.collection, self.agent, 'collectionobject', [
+                {'collection': collection_uri, 'catalognumber': 'bulk-1'},
+                {'id': 'not an id', 'version': 0},
+            ])
+        self.assertFalse(models.Collectionobject.objects.filter(catalognumber='bulk-1').exists())
+
+    def test_bulk_bad_recordset(self):
+        recordset = models.Recordset.objects.create(
+            collectionmemberid=self.collection.id,
+            dbtableid=models.Agent.specify_model.tableId,
+            name="Agent recordset",
+            type=0,
+            specifyuser=self.specifyuser)
+        with self.assertRaises(api.RecordSetException):
+            api.bulk_post_resources(self.collection, self.agent, 'collectionobject', [],
+                                    recordsetid=recordset.id)
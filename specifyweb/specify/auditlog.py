@@ -1,7 +1,6 @@
 from time import time
 import logging
 logger = logging.getLogger(__name__)
-import re
 
 from django.db import connection
 from django.conf import settings
@@ -9,38 +8,26 @@ from django.conf import settings
 from specifyweb.specify.models import Spauditlog
 from specifyweb.specify.models import Spauditlogfield
 from specifyweb.context.app_resource import get_app_resource
-from specifyweb.context.remote_prefs import get_remote_prefs, get_global_prefs
+from specifyweb.context.remote_prefs import parsed_remote_prefs, parsed_global_prefs
 from specifyweb.specify.models import datamodel, Splocalecontainer, Splocalecontaineritem
 
 from . import auditcodes
 
 class AuditLog(object):
 
-    _auditingFlds = None
-    _auditing = None
     _lastCheck = None
     _checkInterval = 900
     
     def isAuditingFlds(self):
-        return self.isAuditing() and self._auditingFlds
+        return self.isAuditing() and parsed_remote_prefs().get_bool('auditing.audit_field_updates', True)
         
     def isAuditing(self):
         if settings.DISABLE_AUDITING:
             return False
-        if self._auditing is None or self._lastCheck is None or time() - self._lastCheck > self._checkInterval:
-            match = re.search(r'auditing\.do_audits=(.+)', get_remote_prefs())
-            if match is None:
-                self._auditing = True
-            else:
-                self._auditing = False if match.group(1).lower() == 'false' else True
-            match = re.search(r'auditing\.audit_field_updates=(.+)', get_remote_prefs())
-            if match is None:
-                self._auditingFlds = True
-            else:
-                self._auditingFlds = False if match.group(1).lower() == 'false' else True
+        if self._lastCheck is None or time() - self._lastCheck > self._checkInterval:
             self.purge()
             self._lastCheck = time()
-        return self._auditing;
+        return parsed_remote_prefs().get_bool('auditing.do_audits', True)
     
     def update(self, obj, agent, parent_record, dirty_flds):
         self.log_action(auditcodes.UPDATE, obj, agent, parent_record, dirty_flds)
@@ -117,16 +104,16 @@ class AuditLog(object):
             modifiedbyagent=agent)
 
     def purge(self):
-        match = re.search(r'AUDIT_LIFESPAN_MONTHS=(.+)', get_global_prefs())
+        months = parsed_global_prefs().get_int('AUDIT_LIFESPAN_MONTHS')
         logger.info("checking to see if purge is required")
-        if match is not None:
+        if months is not None:
             cursor = connection.cursor()
-            sql = "delete from spauditlogfield where date_sub(curdate(), Interval " +  match.group(1).lower()+ " month) > timestampcreated"
-            logger.info("purging audit log: %s", [sql]);
-            cursor.execute(sql)
-            sql = "delete from spauditlog where date_sub(curdate(), Interval " +  match.group(1).lower()+ " month) > timestampcreated"
-            logger.info("purging audit log: %s", [sql]);
-            cursor.execute(sql)
+            sql = "delete from spauditlogfield where date_sub(curdate(), Interval %s month) > timestampcreated"
+            logger.info("purging audit log: %s", [sql, months]);
+            cursor.execute(sql, [months])
+            sql = "delete from spauditlog where date_sub(curdate(), Interval %s month) > timestampcreated"
+            logger.info("purging audit log: %s", [sql, months]);
+            cursor.execute(sql, [months])
         return True
     
 auditlog = AuditLog()
@@ -1,11 +1,37 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import threading
+from contextlib import contextmanager
+
 from .lock_tables import lock_tables
 from .models import Splocalecontaineritem as Item
 from .models import Collectionobject
 from .uiformatters import get_uiformatter, AutonumberOverflowException
 
+class AutonumberingDeferred(Exception):
+    """Raised instead of autonumbering an object while autonumbering
+    is deferred. See defer_autonumbering.
+    """
+    pass
+
+_local = threading.local()
+
+@contextmanager
+def defer_autonumbering():
+    """Within this context, objects that need autonumbering are not
+    saved and AutonumberingDeferred is raised instead. Locking the table
+    for autonumbering implicitly commits the current transaction in
+    MySQL, which would end a transaction shared by many objects along
+    with its savepoints.
+    """
+    previous = getattr(_local, 'defer', False)
+    _local.defer = True
+    try:
+        yield
+    finally:
+        _local.defer = previous
+
 def autonumber_and_save(collection, user, obj):
     filters = dict(container__discipline=collection.discipline,
                    container__name=obj.__class__.__name__.lower(),
@@ -43,6 +69,9 @@ def autonumber_and_save(collection, user, obj):
 def do_autonumbering(collection, obj, fields):
     logger.debug("autonumbering %s fields: %s", obj, fields)
 
+    if getattr(_local, 'defer', False):
+        raise AutonumberingDeferred("autonumbering of %s deferred" % obj)
+
     # The autonumber action is prepared and thunked outside the locked table
     # context since it looks at other tables and that is not allowed by mysql
     # if those tables are not also locked.
@@ -0,0 +1,120 @@
+"""A small in-process cache for values that are expensive to compute
+from the database but change rarely.
+
+Each worker process has its own cache. Signal handlers invalidate
+entries when the underlying rows change, but changes made in other
+processes are only seen once an entry expires, so caches of data
+that other processes can modify should be given a 'ttl'.
+"""
+
+from collections import OrderedDict, namedtuple
+from hashlib import sha1
+from threading import RLock
+from time import time
+import gzip
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+class ProcessCache(object):
+    """A thread safe least recently used cache holding at most 'maxsize'
+    entries, each for at most 'ttl' seconds. Either limit may be None.
+    """
+
+    def __init__(self, name, maxsize=None, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key, compute, valid=None):
+        """Return the value cached for 'key', calling 'compute' with no
+        arguments to produce it if there is no current entry. If given,
+        'valid' is called with a cached value and the value is discarded
+        if it returns False.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            if entry is not _missing:
+                value, expires = entry
+                if (expires is None or time() < expires) and (valid is None or valid(value)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def peek(self, key, default=None):
+        """Return the value cached for 'key' if there is a current entry,
+        without computing it or counting a hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            if entry is _missing: return default
+            value, expires = entry
+            return value if expires is None or time() < expires else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, None if self.ttl is None else time() + self.ttl)
+            self._entries.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, key=_missing):
+        """Remove the entry for 'key' or, if no key is given, all entries."""
+        with self._lock:
+            if key is _missing:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Remove the entries whose keys satisfy 'predicate'."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'name': self.name,
+                    'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+def file_mtime(pathname):
+    """Return the modification time of the file at 'pathname', or None
+    if it doesn't exist. Cached values derived from files record these
+    to check that the files haven't changed.
+    """
+    try:
+        return os.stat(pathname).st_mtime
+    except FileNotFoundError:
+        return None
+
+def files_unchanged(files):
+    """Return True if none of the files in 'files', a sequence of
+    (pathname, mtime) pairs, has been modified, created or deleted.
+    """
+    return all(file_mtime(pathname) == mtime for pathname, mtime in files)
+
+# A response body cached together with its ETag and a gzip compressed
+# copy so neither has to be recomputed for each request.
+Payload = namedtuple('Payload', 'content etag gzipped')
+
+def make_payload(text):
+    content = text.encode('utf-8')
+    return Payload(
+        content=content,
+        etag='"%s"' % sha1(content).hexdigest(),
+        gzipped=gzip.compress(content))
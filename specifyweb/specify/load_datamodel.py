@@ -1,23 +1,46 @@
 from xml.etree import ElementTree
+from hashlib import sha1
 import os
+import pickle
+import tempfile
+import logging
 
 from django.conf import settings
 
+from .startup import timed
+
+logger = logging.getLogger(__name__)
+
+# Snapshots of the parsed datamodel are named for this version and the
+# hash of the XML they were parsed from. The version must be increased
+# whenever the classes below or the way the datamodel is built change
+# so that older snapshots are not loaded.
+SNAPSHOT_VERSION = 1
+
 class Datamodel(object):
+    def index_tables(self):
+        """Build the indexes used to look up tables by name and id. Must
+        be called again if the tables or their fields are changed.
+        """
+        self._tables_by_name = {}
+        self._tables_by_id = {}
+        for table in self.tables:
+            self._tables_by_name.setdefault(table.name.lower(), table)
+            self._tables_by_id.setdefault(table.tableId, table)
+            table.index_fields()
+
     def get_table(self, tablename, strict=False):
         tablename = tablename.lower()
-        for table in self.tables:
-            if table.name.lower() == tablename:
-                return table
-        if strict:
+        table = self._tables_by_name.get(tablename, None)
+        if table is None and strict:
             raise Exception("No table with name: %r" % tablename)
+        return table
 
     def get_table_by_id(self, table_id, strict=False):
-        for table in self.tables:
-            if table.tableId == table_id:
-                return table
-        if strict:
+        table = self._tables_by_id.get(table_id, None)
+        if table is None and strict:
             raise Exception("No table with id: %d" % table_id)
+        return table
 
     def reverse_relationship(self, relationship):
         if hasattr(relationship, 'otherSideName'):
@@ -36,14 +59,21 @@ class Table(object):
     def django_name(self):
         return self.name.capitalize()
 
+    def index_fields(self):
+        """Build the index used to look up fields, relationships and
+        the id field by name. Must be called again if they are changed.
+        """
+        self._fields_by_name = {}
+        for field in self.fields + self.relationships + [self.idField]:
+            self._fields_by_name.setdefault(field.name.lower(), field)
+
     def get_field(self, fieldname, strict=False):
         fieldname = fieldname.lower()
-        for field in self.fields + self.relationships + [self.idField]:
-            if field.name.lower() == fieldname:
-                return field
-        if strict:
+        field = self._fields_by_name.get(fieldname, None)
+        if field is None and strict:
             raise Exception("Field %s not in table %s. " % (fieldname, self.name) +
                             "Fields: %s" % [f.name for f in self.fields + self.relationships])
+        return field
 
     @property
     def attachments_field(self):
@@ -132,14 +162,52 @@ def make_field_alias(aliasdef):
     return alias
 
 def load_datamodel():
-    datamodeldef = ElementTree.parse(os.path.join(settings.SPECIFY_CONFIG_DIR, 'specify_datamodel.xml'))
+    with open(os.path.join(settings.SPECIFY_CONFIG_DIR, 'specify_datamodel.xml'), 'rb') as f:
+        xml = f.read()
+
+    if settings.DATAMODEL_SNAPSHOT_DIR is None:
+        return build_datamodel(xml)
+
+    path = os.path.join(settings.DATAMODEL_SNAPSHOT_DIR,
+                        'datamodel-%d-%s.pickle' % (SNAPSHOT_VERSION, sha1(xml).hexdigest()))
+    datamodel = load_snapshot(path)
+    if datamodel is None:
+        datamodel = build_datamodel(xml)
+        save_snapshot(path, datamodel)
+    return datamodel
+
+def load_snapshot(path):
+    try:
+        with timed('load datamodel snapshot'), open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("ignoring unreadable datamodel snapshot %s", path, exc_info=True)
+        return None
+
+def save_snapshot(path, datamodel):
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            pickle.dump(datamodel, f, pickle.HIGHEST_PROTOCOL)
+        # Other processes may be loading the snapshot, so it is written
+        # to a temporary file and moved into place.
+        os.replace(f.name, path)
+    except OSError:
+        logger.warning("couldn't save datamodel snapshot %s", path, exc_info=True)
+
+def build_datamodel(xml):
+    with timed('parse datamodel'):
+        datamodeldef = ElementTree.fromstring(xml)
 
     datamodel = Datamodel()
-    datamodel.tables = [make_table(tabledef) for tabledef in datamodeldef.findall('table')]
-    add_collectingevents_to_locality(datamodel)
+    with timed('build datamodel'):
+        datamodel.tables = [make_table(tabledef) for tabledef in datamodeldef.findall('table')]
+        datamodel.index_tables()
+        add_collectingevents_to_locality(datamodel)
 
-    flag_dependent_fields(datamodel)
-    flag_system_tables(datamodel)
+        flag_dependent_fields(datamodel)
+        flag_system_tables(datamodel)
 
     return datamodel
 
@@ -152,7 +220,9 @@ def add_collectingevents_to_locality(datamodel):
     rel.otherSideName = 'locality'
 
     datamodel.get_table('collectingevent').get_field('locality').otherSideName = 'collectingEvents'
-    datamodel.get_table('locality').relationships.append(rel)
+    locality = datamodel.get_table('locality')
+    locality.relationships.append(rel)
+    locality.index_fields()
 
 def flag_dependent_fields(datamodel):
     for name in dependent_fields:
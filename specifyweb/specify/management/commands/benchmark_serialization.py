@@ -0,0 +1,86 @@
+from timeit import default_timer
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify import api
+
+def baseline_obj_to_data(obj):
+    """obj_to_data as it was before serializers were compiled per model:
+    the model's fields are introspected and looked up in the datamodel
+    for every object serialized.
+    """
+    fields = obj._meta.get_fields()
+    if isinstance(obj, api.models.Specifyuser):
+        fields = [f for f in fields if f.name != 'password']
+
+    data = dict((field.name, baseline_field_to_val(obj, field))
+                for field in fields
+                if not (field.auto_created or field.one_to_many or field.many_to_many))
+    data.update(dict((ro.get_accessor_name(), baseline_to_many_to_data(obj, ro))
+                     for ro in obj._meta.get_fields()
+                     if ro.one_to_many))
+    data['resource_uri'] = api.uri_for_model(obj.__class__.__name__.lower(), obj.id)
+    special = api.SPECIAL_CASES.get(obj.__class__.__name__, None)
+    if special is not None:
+        special.function(obj, data)
+    return data
+
+def baseline_to_many_to_data(obj, rel):
+    field_name = rel.get_accessor_name()
+    field = rel.model.specify_model.get_field(field_name)
+    if field is not None and field.dependent:
+        return [baseline_obj_to_data(o) for o in getattr(obj, field_name).all()]
+    collection_uri = api.uri_for_model(rel.related_model)
+    return collection_uri + '?' + urlencode([(rel.field.name.lower(), str(obj.id))])
+
+def baseline_field_to_val(obj, field):
+    if field.many_to_one or (field.one_to_one and not field.auto_created):
+        if api.is_dependent_field(obj, field.name):
+            related_obj = getattr(obj, field.name)
+            if related_obj is None: return None
+            return baseline_obj_to_data(related_obj)
+        related_id = getattr(obj, field.name + '_id')
+        if related_id is None: return None
+        return api.uri_for_model(field.related_model, related_id)
+    else:
+        return getattr(obj, field.name)
+
+class Command(BaseCommand):
+    help = 'Measures the rate at which objects of a table are serialized by the API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help='name of the table to serialize, e.g. collectionobject')
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=1000,
+            help='number of objects to serialize',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='number of passes over the objects; the best is reported',
+        )
+
+    def handle(self, **options):
+        model = getattr(api.models, options['table'].capitalize(), None)
+        if model is None:
+            raise CommandError('no such table: %s' % options['table'])
+
+        objs = list(model.objects.all()[:options['limit']])
+        if not objs:
+            raise CommandError('table %s is empty' % options['table'])
+        api.prefetch_dependents(objs)
+
+        for label, serialize in (('baseline', baseline_obj_to_data), ('compiled', api.obj_to_data)):
+            best = None
+            for _ in range(options['repeat']):
+                start = default_timer()
+                for obj in objs:
+                    serialize(obj)
+                elapsed = default_timer() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write('%s: %d objects in %.3fs, %.0f objects/s' % (
+                label, len(objs), best, len(objs) / best))
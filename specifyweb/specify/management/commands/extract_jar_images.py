@@ -0,0 +1,40 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from specifyweb.specify import specify_jar
+
+class Command(BaseCommand):
+    help = ('Extracts the images in specify.jar into a directory from which the web server can '
+            'serve them as static files in place of the /images/ view, along with their ETags.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='directory to extract the images into')
+        parser.add_argument(
+            '--manifest',
+            default='etags.json',
+            help='name of the file in the directory that maps image paths to their ETags',
+        )
+
+    def handle(self, **options):
+        directory = options['directory']
+        root = os.path.realpath(directory)
+        etags = {}
+        for name in specify_jar.specify_jar.namelist():
+            if not name.startswith(specify_jar.IMAGES_PATH) or name.endswith('/'): continue
+            path = name[len(specify_jar.IMAGES_PATH):]
+            filename = os.path.realpath(os.path.join(root, *path.split('/')))
+            if os.path.commonpath([root, filename]) != root:
+                self.stderr.write('skipping %s, which is outside the directory' % name)
+                continue
+            entry = specify_jar.load_entry(name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as f:
+                f.write(entry.content)
+            etags[path] = entry.etag
+
+        with open(os.path.join(directory, options['manifest']), 'w') as f:
+            json.dump(etags, f, indent=2, sort_keys=True)
+
+        self.stdout.write('extracted %d images to %s' % (len(etags), directory))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from specifyweb.specify import startup
+
+class Command(BaseCommand):
+    help = 'Reports the time taken by each phase of loading the datamodel and building the models when this process started.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--map',
+            action='store_true',
+            help='also map the SQLAlchemy classes and configure their mappers, which is otherwise put off until first use',
+        )
+
+    def handle(self, **options):
+        from sqlalchemy import orm
+        from specifyweb.stored_queries import models
+
+        if options['map']:
+            models.map_models()
+            with startup.timed('configure sqlalchemy mappers'):
+                orm.configure_mappers()
+
+        for phase, seconds in startup.timings:
+            self.stdout.write('%s: %.1fms' % (phase, 1000 * seconds))
+        self.stdout.write('total: %.1fms' % (1000 * sum(seconds for _, seconds in startup.timings)))
@@ -5,12 +5,36 @@ from django.contrib.auth.base_user import BaseUserManager
 from django.conf import settings
 
 from .tree_extras import Tree
+from .cache import ProcessCache
 
 if settings.AUTH_LDAP_SERVER_URI is not None:
     from . import ldap_extras
 
 logger = logging.getLogger(__name__)
 
+# Whether users are administrators is cached by user id. Changes made
+# through set_admin and clear_admin, or to users and principals in this
+# process, invalidate the cache. Other processes' changes are seen
+# once the entry expires.
+ADMIN_TTL = 30
+
+_admins = ProcessCache('administrators', maxsize=1000, ttl=ADMIN_TTL)
+
+def invalidate_admins(user_id=None):
+    if user_id is None:
+        _admins.invalidate()
+    else:
+        _admins.invalidate(user_id)
+
+def invalidate_admins_on_commit(user_id=None):
+    """Invalidate the cached status now and again when the current
+    transaction commits, so a status reloaded in the meantime from
+    uncommitted data isn't kept.
+    """
+    from django.db import transaction
+    invalidate_admins(user_id)
+    transaction.on_commit(lambda: invalidate_admins(user_id))
+
 class SpecifyUserManager(BaseUserManager):
     def create_user(self, name, password=None):
         raise NotImplementedError()
@@ -53,6 +77,9 @@ class Specifyuser(models.Model):
         return decrypted == password
 
     def is_admin(self):
+        return _admins.get(self.id, self.load_is_admin)
+
+    def load_is_admin(self):
         from django.db import connection
         cursor = connection.cursor()
         cursor.execute("""
@@ -79,6 +106,7 @@ class Specifyuser(models.Model):
         except IntegrityError:
             # It's already in there.
             pass
+        invalidate_admins_on_commit(self.id)
 
     def clear_admin(self):
         from django.db import connection, transaction
@@ -92,6 +120,7 @@ class Specifyuser(models.Model):
           WHERE Name = 'Administrator'
         )
         """, [self.id])
+        invalidate_admins_on_commit(self.id)
 
     def save(self, *args, **kwargs):
         # There is a signal handler that updates last_login when
@@ -116,6 +145,12 @@ class Specifyuser(models.Model):
 class Preparation(models.Model):
     def isonloan(self):
         # TODO: needs unit tests
+        try:
+            # Set by prefetch_isonloan when serializing many preparations.
+            return self._prefetched_isonloan
+        except AttributeError:
+            pass
+
         from django.db import connection
         cursor = connection.cursor()
 
@@ -130,6 +165,31 @@ class Preparation(models.Model):
         result = cursor.fetchone()
         return result[0] > 0
 
+    @classmethod
+    def prefetch_isonloan(cls, preps):
+        """Compute isonloan() for all the given preparations with a
+        single query and cache the results on the instances.
+        """
+        preps = [prep for prep in preps if prep.id is not None]
+        if not preps: return
+
+        from django.db import connection
+        cursor = connection.cursor()
+
+        ids = [prep.id for prep in preps]
+        cursor.execute("""
+        SELECT PreparationID
+        FROM loanpreparation
+        WHERE PreparationID IN ({ids}) AND NOT IsResolved
+        GROUP BY PreparationID
+        HAVING SUM({GREATEST}(0, COALESCE(Quantity - QuantityResolved, 0))) > 0
+        """.format(ids=', '.join(['%s'] * len(ids)),
+                   GREATEST='MAX' if connection.vendor == 'sqlite' else 'GREATEST'), ids)
+
+        on_loan = set(row[0] for row in cursor.fetchall())
+        for prep in preps:
+            prep._prefetched_isonloan = prep.id in on_loan
+
     class Meta:
         abstract = True
 
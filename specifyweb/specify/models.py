@@ -1,8 +1,10 @@
 from .build_models import build_models
 from .check_versions import check_versions
 from .datamodel import datamodel
+from .startup import timed
 
-models_by_tableid = build_models(__name__, datamodel)
+with timed('build django models'):
+    models_by_tableid = build_models(__name__, datamodel)
 
 # inject the model definitions into this module's namespace
 globals().update((model.__name__, model)
@@ -11,4 +13,4 @@ globals().update((model.__name__, model)
 #check_versions(Spversion)
 
 # clean up namespace
-del build_models, check_versions
+del build_models, check_versions, timed
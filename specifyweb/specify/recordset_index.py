@@ -0,0 +1,97 @@
+"""Sorted arrays of the record ids in record sets, used to find the
+position and neighbours of a record when stepping through a record
+set without querying the recordsetitem table each time.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from django.db import transaction
+
+from . import models
+from .cache import ProcessCache
+
+# Other processes' changes to record sets are seen once an index expires.
+INDEX_TTL = 60
+
+RecordsetIndex = namedtuple('RecordsetIndex', 'dbtableid recordids')
+
+RecordsetPosition = namedtuple('RecordsetPosition', 'index total_count previous next')
+
+_indexes = ProcessCache('recordset index', maxsize=200, ttl=INDEX_TTL)
+
+def load_index(recordsetid):
+    dbtableid = models.Recordset.objects.filter(id=recordsetid).values_list('dbtableid', flat=True)[:1]
+    recordids = models.Recordsetitem.objects.filter(recordset_id=recordsetid) \
+                .order_by('recordid').values_list('recordid', flat=True)
+    return RecordsetIndex(dbtableid[0] if dbtableid else None, array('l', recordids))
+
+def get_index(recordsetid):
+    recordsetid = int(recordsetid)
+    return _indexes.get(recordsetid, lambda: load_index(recordsetid))
+
+def invalidate(recordsetid=None):
+    if recordsetid is None:
+        _indexes.invalidate()
+    else:
+        _indexes.invalidate(int(recordsetid))
+
+def invalidate_on_commit(recordsetid):
+    """Invalidate the index of the record set now and again when the
+    current transaction commits, so an index reloaded in the meantime
+    from uncommitted data isn't kept.
+    """
+    invalidate(recordsetid)
+    transaction.on_commit(lambda: invalidate(recordsetid))
+
+def contains(index, tableid, recordid):
+    if index.dbtableid != tableid: return False
+    i = bisect_left(index.recordids, recordid)
+    return i < len(index.recordids) and index.recordids[i] == recordid
+
+def find_index(recordsetid, tableid, recordid):
+    """Return the index of the record set with 'recordsetid' if it contains
+    'recordid' of the table with 'tableid', otherwise None. A cached
+    index that does not contain the record is reloaded in case it
+    was changed by another process.
+    """
+    index = get_index(recordsetid)
+    if not contains(index, tableid, recordid):
+        invalidate(recordsetid)
+        index = get_index(recordsetid)
+        if not contains(index, tableid, recordid):
+            return None
+    return index
+
+def position(recordsetid, tableid, recordid):
+    """Return a RecordsetPosition giving the number of items before the
+    one for 'recordid', the total number of items and the record ids
+    of the preceding and following items, or None if the record is
+    not in the record set.
+    """
+    index = find_index(recordsetid, tableid, recordid)
+    if index is None: return None
+    ids = index.recordids
+    i = bisect_left(ids, recordid)
+    j = bisect_right(ids, recordid)
+    return RecordsetPosition(
+        index=i,
+        total_count=len(ids),
+        previous=ids[i - 1] if i > 0 else None,
+        next=ids[j] if j < len(ids) else None)
+
+def window(recordsetid, tableid, recordid, size):
+    """Return the index of the item for 'recordid', the total number of
+    items and the record ids of up to 'size' items either side of it
+    (including it), or None if the record is not in the record set.
+    """
+    index = find_index(recordsetid, tableid, recordid)
+    if index is None: return None
+    ids = index.recordids
+    i = bisect_left(ids, recordid)
+    start = max(0, i - size)
+    return {'index': i,
+            'total_count': len(ids),
+            'offset': start,
+            'recordids': ids[start:i + size + 1].tolist()}
@@ -133,11 +133,16 @@ class FreshDBTests(MainSetupTearDown, SeleniumTests):
         self.discipline.save()
 
         # inject a schema localization into the cache to avoid having to load it into the db
-        self.schema_localization_cache[self.discipline] = self.sl
+        from django.conf import settings
+        from specifyweb.context import schema_localization
+        from .cache import make_payload
+        schema_localization._localizations.set(
+            (self.discipline.id, 0, settings.SCHEMA_LANGUAGE), make_payload(self.sl))
 
     def tearDown(self):
         super(FreshDBTests, self).tearDown()
-        del self.schema_localization_cache[self.discipline]
+        from specifyweb.context import schema_localization
+        schema_localization.invalidate_schema_localizations()
 
     def test_login(self):
         self.selenium.get(self.live_server_url)
@@ -1,6 +1,30 @@
 import os
+from collections import namedtuple
+from hashlib import sha1
 from zipfile import ZipFile
 
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 
-specify_jar = ZipFile(os.path.join(settings.SPECIFY_THICK_CLIENT, 'specify.jar'))
+from .cache import ProcessCache
+
+# The jar is opened when it is first read rather than when a process starts.
+specify_jar = SimpleLazyObject(lambda: ZipFile(os.path.join(settings.SPECIFY_THICK_CLIENT, 'specify.jar')))
+
+IMAGES_PATH = 'edu/ku/brc/specify/images/'
+
+JarEntry = namedtuple('JarEntry', 'content etag')
+
+# The jar doesn't change while the server is running, so decompressed
+# entries are kept until they are pushed out by others.
+_entries = ProcessCache('specify.jar entries', maxsize=1000)
+
+def read_entry(path):
+    """Return the decompressed content of the entry at 'path' in the jar
+    and its ETag as a JarEntry. Raises KeyError if there is no such entry.
+    """
+    return _entries.get(path, lambda: load_entry(path))
+
+def load_entry(path):
+    content = specify_jar.read(path)
+    return JarEntry(content, '"%s"' % sha1(content).hexdigest())
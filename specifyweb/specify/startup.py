@@ -0,0 +1,17 @@
+"""Timings of the phases of loading the datamodel and building the
+models when a process starts, reported by the startup_timings
+management command.
+"""
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+timings = []
+
+@contextmanager
+def timed(phase):
+    start = default_timer()
+    try:
+        yield
+    finally:
+        timings.append((phase, default_timer() - start))
@@ -1,8 +1,38 @@
-from django.test import TestCase
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
 from specifyweb.specify.models import datamodel
+from specifyweb.specify.load_datamodel import load_datamodel
 
 class DatamodelTests(TestCase):
-    pass
+    def test_get_table(self):
+        table = datamodel.get_table('CollectionObject')
+        self.assertEqual(table.name, 'CollectionObject')
+        self.assertIs(datamodel.get_table_by_id(table.tableId), table)
+        self.assertIsNone(datamodel.get_table('nosuchtable'))
+        with self.assertRaises(Exception):
+            datamodel.get_table('nosuchtable', strict=True)
+
+    def test_get_field(self):
+        table = datamodel.get_table('collectionobject')
+        self.assertEqual(table.get_field('CATALOGNUMBER').name, 'catalogNumber')
+        self.assertTrue(table.get_field('cataloger').is_relationship)
+        self.assertIs(table.get_field(table.idFieldName), table.idField)
+        self.assertIsNone(table.get_field('nosuchfield'))
+
+    def test_added_relationship_indexed(self):
+        rel = datamodel.get_table('locality').get_field('collectingevents')
+        self.assertEqual(rel.otherSideName, 'locality')
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir, \
+             override_settings(DATAMODEL_SNAPSHOT_DIR=snapshot_dir):
+            built = load_datamodel()
+            self.assertEqual(len(os.listdir(snapshot_dir)), 1)
+            loaded = load_datamodel()
+        self.assertEqual([t.name for t in loaded.tables], [t.name for t in built.tables])
+        self.assertTrue(loaded.get_table('collectionobject').get_field('determinations').dependent)
 
 
 def make_attachments_field_dependent_test(table):
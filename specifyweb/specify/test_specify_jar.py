@@ -0,0 +1,66 @@
+import io
+import os
+import tempfile
+from unittest import mock
+from zipfile import ZipFile
+
+from django.core.management import call_command
+from django.http import Http404
+from django.test import SimpleTestCase, RequestFactory
+
+from specifyweb.specify import specify_jar, views
+
+def make_jar(entries):
+    buffer = io.BytesIO()
+    with ZipFile(buffer, 'w') as jar:
+        for name, content in entries.items():
+            jar.writestr(name, content)
+    return ZipFile(buffer)
+
+class SpecifyJarTests(SimpleTestCase):
+    def setUp(self):
+        jar = make_jar({
+            specify_jar.IMAGES_PATH + 'icon.png': b'icon',
+            specify_jar.IMAGES_PATH + 'sub/other.png': b'other',
+            specify_jar.IMAGES_PATH + '../escaped.png': b'escaped',
+        })
+        patcher = mock.patch.object(specify_jar, 'specify_jar', jar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        specify_jar._entries.invalidate()
+        self.addCleanup(specify_jar._entries.invalidate)
+
+    def get(self, path, **headers):
+        request = RequestFactory().get('/images/' + path, **headers)
+        return views.jar_entry_response(request, specify_jar.IMAGES_PATH + path, 'image/png')
+
+    def test_read_entry(self):
+        entry = specify_jar.read_entry(specify_jar.IMAGES_PATH + 'icon.png')
+        self.assertEqual(entry.content, b'icon')
+        self.assertIs(specify_jar.read_entry(specify_jar.IMAGES_PATH + 'icon.png'), entry)
+        self.assertNotEqual(entry.etag, specify_jar.read_entry(specify_jar.IMAGES_PATH + 'sub/other.png').etag)
+        with self.assertRaises(KeyError):
+            specify_jar.read_entry(specify_jar.IMAGES_PATH + 'missing.png')
+
+    def test_etag(self):
+        response = self.get('icon.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'icon')
+        etag = response['ETag']
+        response = self.get('icon.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get('icon.png', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_missing_entry(self):
+        with self.assertRaises(Http404):
+            self.get('missing.png')
+
+    def test_extract_images(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = os.path.join(tmpdir, 'images')
+            call_command('extract_jar_images', directory, stdout=io.StringIO(), stderr=io.StringIO())
+            with open(os.path.join(directory, 'sub', 'other.png'), 'rb') as f:
+                self.assertEqual(f.read(), b'other')
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['images'])
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'escaped.png')))
@@ -0,0 +1,67 @@
+from django.test import SimpleTestCase
+
+from specifyweb.specify import uiformatters
+
+UIFORMATTERS = '''
+<formats>
+  <format system="true" name="CatalogNumberNumeric" class="edu.ku.brc.specify.datamodel.CollectionObject" fieldname="catalogNumber">
+    <external>edu.ku.brc.specify.ui.CatalogNumberUIFieldFormatter</external>
+  </format>
+  <format system="false" name="AccessionNumber" class="edu.ku.brc.specify.datamodel.Accession" fieldname="accessionNumber">
+    <field type="year" size="4" value="YEAR" byyear="true"/>
+    <field type="separator" size="1" value="-"/>
+    <field type="numeric" size="3" inc="true"/>
+  </format>
+  <format system="false" name="AccessionNumber" class="edu.ku.brc.specify.datamodel.Accession" fieldname="accessionNumber">
+    <field type="alpha" size="2" value="AA"/>
+  </format>
+  <format system="false" name="Broken" class="edu.ku.brc.specify.datamodel.Accession" fieldname="accessionNumber">
+    <field type="nosuchtype" size="2"/>
+  </format>
+</formats>
+'''
+
+class UIFormatterTests(SimpleTestCase):
+    def test_parse(self):
+        formatter = uiformatters.UIFormatterRegistry(UIFORMATTERS).get('AccessionNumber')
+        self.assertEqual(formatter.model_name, 'Accession')
+        self.assertEqual(formatter.field_name, 'accessionNumber')
+        self.assertEqual([type(f) for f in formatter.fields],
+                         [uiformatters.YearField, uiformatters.SeparatorField, uiformatters.NumericField])
+        self.assertEqual(formatter.parse('2020-012'), ('2020', '-', '012'))
+        self.assertTrue(formatter.needs_autonumber(formatter.parse('YEAR-###')))
+        with self.assertRaises(ValueError):
+            formatter.parse('2020-12')
+
+    def test_external(self):
+        formatter = uiformatters.UIFormatterRegistry(UIFORMATTERS).get('CatalogNumberNumeric')
+        self.assertEqual(formatter.model_name, 'CollectionObject')
+        self.assertEqual(formatter.parse('000000123'), ('000000123',))
+
+    def test_first_definition_wins(self):
+        formatter = uiformatters.UIFormatterRegistry(UIFORMATTERS).get('AccessionNumber')
+        self.assertEqual(len(formatter.fields), 3)
+
+    def test_unknown_name(self):
+        self.assertIsNone(uiformatters.UIFormatterRegistry(UIFORMATTERS).get('NoSuchFormatter'))
+
+    def test_malformed_definition_raises(self):
+        registry = uiformatters.UIFormatterRegistry(UIFORMATTERS)
+        with self.assertRaises(KeyError):
+            registry.get('Broken')
+        self.assertIsNotNone(registry.get('AccessionNumber'))
+
+    def test_registry_cached(self):
+        registry = uiformatters.get_registry(UIFORMATTERS)
+        self.assertIs(uiformatters.get_registry(UIFORMATTERS), registry)
+        self.assertIs(registry.get('AccessionNumber'), registry.get('AccessionNumber'))
+        self.assertIsNot(uiformatters.get_registry(UIFORMATTERS + ' '), registry)
+
+    def test_anchored_regexp(self):
+        field = uiformatters.NumericField(size=3, inc=True)
+        self.assertIs(field.value_re, field.value_re)
+        self.assertTrue(field.value_re.match('123'))
+        self.assertFalse(field.value_re.match('1234'))
+        self.assertFalse(field.value_re.match('x123'))
+        self.assertTrue(field.is_wild('###'))
+        self.assertFalse(field.is_wild('123'))
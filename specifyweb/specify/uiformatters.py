@@ -10,11 +10,49 @@ logger = logging.getLogger(__name__)
 from specifyweb.context.app_resource import get_app_resource
 
 from .filter_by_col import filter_by_collection
+from .cache import ProcessCache
+
+# The registries of each distinct UIFormatters resource, keyed by the
+# resource text. A changed resource is simply a new key.
+_registries = ProcessCache('uiformatters', maxsize=50)
 
 def get_uiformatter(collection, user, formatter_name):
     xml, __ = get_app_resource(collection, user, "UIFormatters")
-    node = ElementTree.XML(xml).find('.//format[@name=%s]' % quoteattr(formatter_name))
-    if node is None: return None
+    return get_registry(xml).get(formatter_name)
+
+def get_registry(xml):
+    """Return the UIFormatterRegistry of the UIFormatters resource 'xml',
+    parsing the resource on first use.
+    """
+    return _registries.get(xml, lambda: UIFormatterRegistry(xml))
+
+class UIFormatterRegistry(object):
+    """The format definitions of a UIFormatters resource by name. If a
+    name is defined more than once the first definition is used. Each
+    definition is parsed into a UIFormatter the first time it is looked
+    up, so a malformed definition raises an exception when it is used
+    but doesn't affect the others.
+    """
+
+    def __init__(self, xml):
+        self.nodes = {}
+        for node in ElementTree.XML(xml).iter('format'):
+            name = node.attrib.get('name', None)
+            if name is not None:
+                self.nodes.setdefault(name, node)
+        self.formatters = {}
+
+    def get(self, formatter_name):
+        try:
+            return self.formatters[formatter_name]
+        except KeyError:
+            pass
+        node = self.nodes.get(formatter_name, None)
+        if node is None: return None
+        formatter = self.formatters[formatter_name] = parse_uiformatter(node, formatter_name)
+        return formatter
+
+def parse_uiformatter(node, formatter_name):
     external = node.find('external')
     if external is not None:
         name = external.text.split('.')[-1]
@@ -35,6 +73,20 @@ class AutonumberOverflowException(Exception):
 
 ScopeInfo = namedtuple('ScopeInfo', "db_id_field id scope django_id_field")
 
+def anchored_regexp(method):
+    """Turn 'method', which returns a regular expression, into a property
+    giving the expression anchored at both ends and compiled. It is
+    compiled on first use and kept in the instance.
+    """
+    attr = '_' + method.__name__
+    def getter(self):
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            compiled = self.__dict__[attr] = re.compile('^%s$' % method(self))
+            return compiled
+    return property(getter)
+
 def get_autonumber_group_filter(model, collection, format_name):
     default = lambda objs: filter_by_collection(objs, collection)
 
@@ -76,12 +128,12 @@ def get_autonumber_group_filter(model, collection, format_name):
 
 class UIFormatter(namedtuple('UIFormatter', "model_name field_name fields format_name")):
 
-    def parse_regexp(self):
-        regexp = ''.join('(%s)' % f.wild_or_value_regexp() for f in self.fields)
-        return '^%s$' % regexp
+    @anchored_regexp
+    def parse_re(self):
+        return ''.join('(%s)' % f.wild_or_value_regexp() for f in self.fields)
 
     def parse(self, value):
-        match = re.match(self.parse_regexp(), value)
+        match = self.parse_re.match(value)
         if match is None:
             raise ValueError("value doesn't match formatter")
         return match.groups()
@@ -185,10 +237,18 @@ class Field(namedtuple("Field", "size value inc by_year")):
     def wild_regexp(self):
         return re.escape(self.value)
 
+    @anchored_regexp
+    def wild_re(self):
+        return self.wild_regexp()
+
+    @anchored_regexp
+    def value_re(self):
+        return self.value_regexp()
+
     def is_wild(self, value):
         logger.debug("%s checking if value %s is wild", self, value)
-        return (re.match("^%s$" % self.wild_regexp(), value) and not
-                re.match("^%s$" % self.value_regexp(), value))
+        return (self.wild_re.match(value) and not
+                self.value_re.match(value))
 
     def wild_or_value_regexp(self):
         if self.can_autonumber():
@@ -9,6 +9,9 @@ urlpatterns = [
     url(r'^specify/(?P<model>\w+)/(?P<id>\d+)/$', views.resource),
     url(r'^specify/(?P<model>\w+)/$', views.collection),
     url(r'^specify_rows/(?P<model>\w+)/$', views.rows),
+    url(r'^specify_bulk/(?P<model>\w+)/$', views.bulk),
+
+    url(r'^recordset_window/(?P<recordsetid>\d+)/$', views.recordset_window),
 
     url(r'^delete_blockers/(?P<model>\w+)/(?P<id>\d+)/$', views.delete_blockers),
 
@@ -8,8 +8,8 @@ from django import http
 from django.db.models.deletion import Collector
 from django.db import router
 
-from .specify_jar import specify_jar
-from . import api, models
+from .specify_jar import IMAGES_PATH, read_entry
+from . import api, models, recordset_index
 
 if settings.ANONYMOUS_USER:
     login_maybe_required = lambda func: func
@@ -52,6 +52,7 @@ def api_view(dispatch_func):
 
 resource = api_view(api.resource_dispatch)
 collection = api_view(api.collection_dispatch)
+bulk = api_view(api.bulk_dispatch)
 
 def raise_error(request):
     raise Exception('This error is a test. You may now return to your regularly '
@@ -74,25 +75,56 @@ def delete_blockers(request, model, id):
 def rows(request, model):
     return api.rows(request, model)
 
+@login_maybe_required
+@require_GET
+def recordset_window(request, recordsetid):
+    """Returns the record ids of the items around the given record in a
+    record set, so the client can prefetch the neighbouring resources.
+    """
+    try:
+        recordid = int(request.GET['recordid'])
+        size = int(request.GET.get('size', 10))
+    except (KeyError, ValueError):
+        return http.HttpResponseBadRequest('recordid and size must be integers')
+
+    if not models.Recordset.objects.filter(
+            id=recordsetid, collectionmemberid=request.specify_collection.id).exists():
+        raise http.Http404()
+
+    tableid = recordset_index.get_index(recordsetid).dbtableid
+    result = None if tableid is None else \
+             recordset_index.window(recordsetid, tableid, recordid, max(0, size))
+    if result is None:
+        raise http.Http404()
+    result['recordsetid'] = int(recordsetid)
+    result['model'] = models.models_by_tableid[tableid].__name__.lower()
+    return http.HttpResponse(api.toJson(result), content_type='application/json')
+
 @require_GET
 @cache_control(max_age=365*24*60*60, public=True)
 def images(request, path):
     """A Django view that serves images and icons from the Specify thickclient jar file."""
     mimetype = mimetypes.guess_type(path)[0]
-    path = 'edu/ku/brc/specify/images/' + path
-    try:
-        image = specify_jar.read(path)
-    except KeyError as e:
-        raise http.Http404(e)
-    return http.HttpResponse(image, content_type=mimetype)
+    return jar_entry_response(request, IMAGES_PATH + path, mimetype)
 
 @login_maybe_required
 @require_GET
 @cache_control(max_age=24*60*60, public=True)
 def properties(request, name):
     """A Django view that serves .properities files from the thickclient jar file."""
-    path = name + '.properties'
-    return http.HttpResponse(specify_jar.read(path), content_type='text/plain')
+    return jar_entry_response(request, name + '.properties', 'text/plain')
+
+def jar_entry_response(request, path, content_type):
+    try:
+        entry = read_entry(path)
+    except KeyError as e:
+        raise http.Http404(e)
+    if api.etag_matches(request, entry.etag):
+        response = http.HttpResponseNotModified()
+    else:
+        response = http.HttpResponse(entry.content, content_type=content_type)
+    response['ETag'] = entry.etag
+    return response
 
 @login_maybe_required
 @require_POST
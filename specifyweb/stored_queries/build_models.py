@@ -57,9 +57,9 @@ field_type_map = {'text'                 : types.Text,
 def make_tables(datamodel):
     return {td.table: make_table(datamodel, td) for td in datamodel.tables}
 
-def make_classes(datamodel):
+def make_classes(datamodel, metaclass=type):
     def make_class(tabledef):
-        return type(tabledef.name, (object,), { 'tableid': tabledef.tableId, '_id': tabledef.idFieldName })
+        return metaclass(tabledef.name, (object,), { 'tableid': tabledef.tableId, '_id': tabledef.idFieldName })
 
     return {td.name: make_class(td) for td in datamodel.tables}
 
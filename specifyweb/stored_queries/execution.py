@@ -1,30 +1,79 @@
 import os
-import re
+import io
 import logging
 import json
 import csv
 import xml.dom.minidom
 
 from collections import namedtuple
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from hashlib import sha1
+from timeit import default_timer
 
 from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
+from sqlalchemy import orm
 from sqlalchemy.sql.expression import asc, desc, insert, literal
 
-from ..specify.models import Collection
+from ..specify import models as spmodels
+from ..specify.models import Collection, datamodel
+from ..specify.cache import ProcessCache
 from ..notifications.models import Message
+from ..context.app_resource import get_app_resource
 
 from . import models
 from .queryfield import QueryField
-from .format import ObjectFormatter
-from .query_construct import QueryConstruct
+from .format import ObjectFormatter, get_date_format
+from .query_construct import QueryConstruct, tree_numbering
+from .queryfieldspec import QueryFieldSpec
 
 
 logger = logging.getLogger(__name__)
 
 SORT_TYPES = [None, asc, desc]
 
+# Built queries are cached by everything that goes into building them
+# so that paging through or re-running a query doesn't build it again.
+# The cached queries aren't bound to a session. Changes this process
+# makes to the tree definitions and schema formatters looked up while
+# building invalidate the cache; other processes' changes are seen
+# once the plan expires.
+PLAN_TTL = 300
+
+_plans = ProcessCache('query plans', maxsize=200, ttl=PLAN_TTL)
+
+# Aggregated to-many columns are computed by correlated subqueries, which
+# MySQL evaluates once per row, for results limited to at most this many
+# rows. Unlimited or larger results aggregate each relationship once in
+# a derived table restricted to the parents among the results.
+CORRELATED_AGGREGATE_MAX_ROWS = 100
+
+# Exports fetch and write rows in chunks of this many rows through a
+# buffer of this many bytes.
+EXPORT_CHUNK_SIZE = 10000
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+ExportStats = namedtuple('ExportStats', 'rows bytes seconds')
+
+# Replaces line breaks within exported values with spaces.
+_line_breaks = str.maketrans('\r\n', '  ')
+
+# Result counts are remembered briefly so re-running a query doesn't
+# count it again. The counts are keyed by the tables the query joins,
+# and saving or deleting a record of any of those tables in this
+# process drops them. Only the models of remembered counts are watched.
+COUNT_TTL = 60
+
+_counts = ProcessCache('query counts', maxsize=1000, ttl=COUNT_TTL)
+
+# Counts requested together with a page of results are run on these
+# threads, each with its own session and so its own connection.
+_count_executor = ThreadPoolExecutor(max_workers=4)
+
 def set_group_concat_max_len(session):
     """The default limit on MySQL group concat function is quite
     small. This function increases it for the database connection for
@@ -95,17 +144,33 @@ def filter_by_collection(model, query, collection):
 
 EphemeralField = namedtuple('EphemeralField', "stringId isRelFld operStart startValue isNot isDisplay sortType formatName")
 
-def field_specs_from_json(json_fields):
+def fields_from_json(json_fields):
     """Given deserialized json data representing an array of SpQueryField
-    records, return an array of QueryField objects that can build the
-    corresponding sqlalchemy query.
+    records, return an array of EphemeralFields in the order of their
+    positions.
     """
     def ephemeral_field_from_json(json):
         return EphemeralField(**{field: json.get(field.lower(), None) for field in EphemeralField._fields})
 
-    return [QueryField.from_spqueryfield(ephemeral_field_from_json(data))
+    return [ephemeral_field_from_json(data)
             for data in sorted(json_fields, key=lambda field: field['position'])]
 
+def ephemeral_field(field, value=None):
+    """Return an EphemeralField copying the SpQueryField 'field', with
+    'value' in place of its start value if it is given.
+    """
+    data = {name: getattr(field, name) for name in EphemeralField._fields}
+    if value is not None:
+        data['startValue'] = value
+    return EphemeralField(**data)
+
+def field_specs_from_json(json_fields):
+    """Given deserialized json data representing an array of SpQueryField
+    records, return an array of QueryField objects that can build the
+    corresponding sqlalchemy query.
+    """
+    return [QueryField.from_spqueryfield(field) for field in fields_from_json(json_fields)]
+
 def do_export(spquery, collection, user, filename, exporttype, host):
     """Executes the given deserialized query definition, sending the
     to a file, and creates "export completed" message when finished.
@@ -149,35 +214,111 @@ def stored_query_to_csv(query_id, collection, user, path):
         query_to_csv(session, collection, user, tableid, field_specs, path)
 
 def query_to_csv(session, collection, user, tableid, field_specs, path,
-                 recordsetid=None, add_header=False, strip_id=False, row_filter=None):
+                 recordsetid=None, add_header=False, strip_id=False, chunk_filter=None,
+                 chunk_size=EXPORT_CHUNK_SIZE):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs and send the results to a CSV file at the given
-    file path.
+    file path. Returns the ExportStats of the file written.
+
+    chunk_size = number of rows fetched from the database and written at a time.
+
+    chunk_filter = if given, a function called with each list of rows
+    fetched which returns the rows that are to be written.
 
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True)
+    query = build_export_query(session, collection, user, tableid, field_specs, recordsetid)
 
     logger.debug('query_to_csv starting')
 
-    with open(path, 'w', newline='', encoding='utf-8') as f:
-        csv_writer = csv.writer(f)
-        if add_header:
-            header = [fs.fieldspec.to_stringid() for fs in field_specs if fs.display]
-            if not strip_id:
-                header = ['id'] + header
-            csv_writer.writerow(header)
+    header = None
+    if add_header:
+        header = [fs.fieldspec.to_stringid() for fs in field_specs if fs.display]
+        if not strip_id:
+            header = ['id'] + header
+
+    chunks = fetch_chunks(session, query, chunk_size)
+    if chunk_filter is not None:
+        chunks = map(chunk_filter, chunks)
+
+    stats = write_csv(path, chunks, header=header, strip_id=strip_id)
+    logger.info('query_to_csv wrote %d rows, %d bytes in %.1fs (%.0f rows/s)',
+                stats.rows, stats.bytes, stats.seconds, stats.rows / stats.seconds if stats.seconds else 0)
+    return stats
+
+def build_export_query(session, collection, user, tableid, field_specs, recordsetid=None):
+    """Build the query exporting the results of the QueryField objects
+    'field_specs'. Exports are not limited, so aggregated columns are
+    computed in derived tables.
+    """
+    return build_query(session, collection, user, tableid, field_specs, recordsetid,
+                       replace_nulls=True,
+                       derived_aggregates=use_derived_aggregates([fs.fieldspec for fs in field_specs]))[0]
+
+def use_derived_aggregates(fieldspecs, limit=0):
+    """Return True if the aggregated to-many columns of a query with
+    the QueryFieldSpecs 'fieldspecs' are to be computed in derived
+    tables. That is if there are any and the results are not limited
+    to at most CORRELATED_AGGREGATE_MAX_ROWS rows. The limit is used
+    rather than a count of the results, which would cost as much as
+    the aggregation being avoided.
+    """
+    aggregated = any(fs.is_relationship() and fs.get_field().type != 'many-to-one'
+                     for fs in fieldspecs)
+    return aggregated and (not limit or limit > CORRELATED_AGGREGATE_MAX_ROWS)
 
-        for row in query.yield_per(1):
-            if row_filter is not None and not row_filter(row): continue
-            encoded = [
-                re.sub('\r|\n', ' ', str(f))
-                for f in (row[1:] if strip_id else row)
-            ]
-            csv_writer.writerow(encoded)
+def fetch_chunks(session, query, chunk_size):
+    """Yield the rows of 'query' in lists of up to 'chunk_size' rows
+    fetched from the server side cursor.
+    """
+    result = session.execute(query.statement)
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows: break
+            yield rows
+    finally:
+        result.close()
+
+def write_csv(path, chunks, header=None, strip_id=False):
+    """Write the rows in 'chunks', an iterable of lists of rows, to a CSV
+    file at 'path' preceded by the 'header' row if given. The first
+    column of each row is left out if 'strip_id' is True.
+    """
+    start = default_timer()
+    rows = nbytes = 0
+    with open(path, 'wb', buffering=EXPORT_BUFFER_SIZE) as f:
+        if header is not None:
+            nbytes += f.write(encode_csv_chunk([header]))
+        for chunk in chunks:
+            if strip_id:
+                chunk = [row[1:] for row in chunk]
+            rows += len(chunk)
+            nbytes += f.write(encode_csv_chunk(chunk))
+    return ExportStats(rows=rows, bytes=nbytes, seconds=default_timer() - start)
+
+def encode_csv_chunk(rows):
+    """Return the rows as UTF-8 encoded CSV lines, with line breaks in
+    values replaced by spaces.
+    """
+    if not rows: return b''
+    width = len(rows[0])
+    # The values of the whole chunk are joined so that line breaks are
+    # replaced in one pass, then split apart again. If a value contains
+    # the separator or the rows differ in length they are handled one
+    # value at a time instead.
+    values = '\0'.join(map(str, chain.from_iterable(rows))).translate(_line_breaks).split('\0')
+    if len(values) == width * len(rows):
+        rows = [values[i:i + width] for i in range(0, len(values), width)]
+    else:
+        rows = [[str(value).translate(_line_breaks) for value in row] for row in rows]
+    return render_csv(rows).encode('utf-8')
 
-    logger.debug('query_to_csv finished')
+def render_csv(rows):
+    out = io.StringIO()
+    csv.writer(out).writerows(rows)
+    return out.getvalue()
 
 def row_has_geocoords(coord_cols, row):
     """Assuming single point
@@ -194,7 +335,7 @@ def query_to_kml(session, collection, user, tableid, field_specs, path, captions
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True)
+    query = build_export_query(session, collection, user, tableid, field_specs, recordsetid)
 
     logger.debug('query_to_kml starting')
 
@@ -366,15 +507,17 @@ def run_ephemeral_query(collection, user, spquery):
     distinct = spquery['selectdistinct']
     tableid = spquery['contexttableid']
     count_only = spquery['countonly']
+    include_count = spquery.get('includecount', False)
     try:
         format_audits = spquery['formatauditrecids']
     except:
         format_audits = False
     with models.session_context() as session:
-        field_specs = field_specs_from_json(spquery['fields'])
+        fields = fields_from_json(spquery['fields'])
 
         return execute(session, collection, user, tableid, distinct, count_only,
-                       field_specs, limit, offset, recordsetid, formatauditobjs=format_audits)
+                       fields, limit, offset, recordsetid, formatauditobjs=format_audits,
+                       include_count=include_count)
 
 def augment_field_specs(field_specs, formatauditobjs=False):
     print("augment_field_specs ######################################")
@@ -435,30 +578,210 @@ def recordset(collection, user, user_agent, recordset_info):
 
     return new_rs_id
 
-def execute(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset, recordsetid=None, formatauditobjs=False):
-    "Build and execute a query, returning the results as a data structure for json serialization"
+def execute(session, collection, user, tableid, distinct, count_only, fields, limit, offset, recordsetid=None, formatauditobjs=False, include_count=False):
+    """Build and execute a query, returning the results as a data structure for json serialization.
+    The query is given by 'fields', a list of SpQueryField or EphemeralField records.
+    If 'include_count' is True the total count is returned with the results.
+    """
 
     set_group_concat_max_len(session)
-    query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid, formatauditobjs=formatauditobjs)
+    model = models.models_by_tableid[tableid]
+    fieldspecs = [QueryFieldSpec.from_stringid(field.stringId, field.isRelFld) for field in fields]
+    numbering = tree_numbering(collection, fieldspecs)
+
+    # Counts are taken from the plan with correlated aggregates since
+    # selecting only the id leaves those out altogether. The same plan
+    # gives the results unless the limit allows enough rows to use
+    # derived aggregates.
+    key = plan_key(collection, user, tableid, fields, formatauditobjs, numbering=numbering)
+    query, order_by_exprs = get_query_plan(session, collection, user, tableid, fields,
+                                           recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                                           key=key, numbering=numbering)
+    counter = count_query(query, getattr(model, model._id), distinct)
+    # Counts of record set queries change as items are added, so they are not remembered.
+    count_key = None if recordsetid is not None else (queried_tables(fieldspecs), key, distinct)
+
+    if count_only:
+        return {'count': get_count(count_key, counter)}
+
+    if use_derived_aggregates(fieldspecs, limit):
+        query, order_by_exprs = get_query_plan(session, collection, user, tableid, fields,
+                                               recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                                               derived_aggregates=True, numbering=numbering)
 
     if distinct:
         query = query.distinct()
 
-    if count_only:
-        return {'count': query.count()}
-    else:
-        logger.debug("order by: %s", order_by_exprs)
-        query = query.order_by(*order_by_exprs).offset(offset)
-        if limit:
-            query = query.limit(limit)
+    logger.debug("order by: %s", order_by_exprs)
+    query = query.order_by(*order_by_exprs).offset(offset)
+    if limit:
+        query = query.limit(limit)
 
+    if not include_count:
         return {'results': list(query)}
 
-def build_query(session, collection, user, tableid, field_specs, recordsetid=None, replace_nulls=False, formatauditobjs=False):
+    if count_key is None:
+        # Record set queries refer to objects loaded in this session,
+        # so they are not counted in another.
+        return {'results': list(query), 'count': counter.count()}
+
+    count = _counts.peek(count_key)
+    if count is not None:
+        return {'results': list(query), 'count': count}
+
+    future = _count_executor.submit(count_in_new_session, count_key, counter)
+    results = list(query)
+    return {'results': results, 'count': future.result()}
+
+def count_query(query, id_field, distinct):
+    """Return a query for counting the rows of 'query'. Unless the rows
+    are to be distinct, which depends on all of the columns, only the
+    id column is selected, leaving out the formatted and aggregated
+    columns. The ordering is dropped in either case.
+    """
+    if distinct:
+        return query.distinct().order_by(None)
+    return query.with_entities(id_field).order_by(None)
+
+def get_count(key, query):
+    """Return the number of rows of 'query', remembering it under 'key'
+    unless that is None. The first element of 'key' is the set of ids of
+    the tables the query joins, as given by queried_tables.
+    """
+    if key is None:
+        return query.count()
+    watch_counted_tables(key[0])
+    count = _counts.get(key, query.count)
+    logger.debug("query count cache: %s", _counts.stats())
+    return count
+
+def count_in_new_session(key, query):
+    with models.session_context() as session:
+        set_group_concat_max_len(session)
+        return get_count(key, query.with_session(session))
+
+def query_count_cache_stats():
+    return _counts.stats()
+
+def queried_tables(fieldspecs):
+    """Return the frozenset of the ids of the tables joined by a query
+    made of the QueryFieldSpecs 'fieldspecs'.
+    """
+    tables = set()
+    for fieldspec in fieldspecs:
+        tables.add(fieldspec.root_table.tableId)
+        tables.add(fieldspec.table.tableId)
+        tables.update(datamodel.get_table(field.relatedModelName).tableId
+                      for field in fieldspec.join_path if field.is_relationship)
+    return frozenset(tables)
+
+_watched_tables = set()
+
+def watch_counted_tables(tableids):
+    """Connect counted_table_changed to the save and delete signals of
+    the models of the tables with 'tableids', once for each model.
+    """
+    for tableid in tableids - _watched_tables:
+        model = spmodels.models_by_tableid.get(tableid)
+        if model is not None:
+            post_save.connect(counted_table_changed, sender=model)
+            post_delete.connect(counted_table_changed, sender=model)
+        _watched_tables.add(tableid)
+
+def counted_table_changed(sender, **kwargs):
+    tableid = sender.specify_model.tableId
+    _counts.invalidate_where(lambda key: tableid in key[0])
+
+def get_query_plan(session, collection, user, tableid, fields, recordsetid=None, formatauditobjs=False,
+                   derived_aggregates=False, key=None, numbering=None):
+    """Return the sqlalchemy query for the SpQueryField or EphemeralField
+    records 'fields', bound to 'session', and its order by expressions
+    as build_query does. The results are cached under 'key', or the
+    plan_key of the arguments if it isn't given, unless the query is
+    restricted to a record set. 'numbering' is the fields_tree_numbering
+    of the fields, which is checked again if it isn't given.
+    """
+    if numbering is None:
+        numbering = fields_tree_numbering(collection, fields)
+
+    def build(session):
+        start = default_timer()
+        plan = build_query(session, collection, user, tableid,
+                           [QueryField.from_spqueryfield(field) for field in fields],
+                           recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                           derived_aggregates=derived_aggregates, tree_ranks_by_nodenumber=numbering)
+        logger.info("built query plan in %.1fms", 1000 * (default_timer() - start))
+        return plan
+
+    if recordsetid is not None:
+        # The query refers to the record set object loaded in 'session'.
+        return build(session)
+
+    if key is None:
+        key = plan_key(collection, user, tableid, fields, formatauditobjs, derived_aggregates, numbering)
+    query, order_by_exprs = _plans.get(key, lambda: build(None))
+    logger.debug("query plan cache: %s", _plans.stats())
+    return query.with_session(session), order_by_exprs
+
+def plan_key(collection, user, tableid, fields, formatauditobjs, derived_aggregates=False, numbering=None):
+    if numbering is None:
+        numbering = fields_tree_numbering(collection, fields)
+    formatters, _ = get_app_resource(collection, user, 'DataObjFormatters')
+    return (tableid, collection.id, user.id, formatauditobjs, derived_aggregates,
+            tuple(sorted(numbering.items())),
+            sha1((formatters or '').encode('utf-8')).hexdigest(),
+            get_date_format(),
+            tuple(tuple(getattr(field, name) for name in EphemeralField._fields)
+                  for field in fields))
+
+def fields_tree_numbering(collection, fields):
+    """Return tree_numbering for the trees queried by rank by the
+    SpQueryField or EphemeralField records 'fields'. Whether a tree's
+    node numbers can be used decides how its rank columns are built,
+    so this is part of the plan key.
+    """
+    return tree_numbering(collection, [QueryFieldSpec.from_stringid(field.stringId, field.isRelFld)
+                                       for field in fields])
+
+def query_plan_cache_stats():
+    return _plans.stats()
+
+def invalidate_query_plans():
+    _plans.invalidate()
+
+@receiver(post_save, sender=spmodels.Taxontreedef)
+@receiver(post_delete, sender=spmodels.Taxontreedef)
+@receiver(post_save, sender=spmodels.Taxontreedefitem)
+@receiver(post_delete, sender=spmodels.Taxontreedefitem)
+@receiver(post_save, sender=spmodels.Geographytreedef)
+@receiver(post_delete, sender=spmodels.Geographytreedef)
+@receiver(post_save, sender=spmodels.Geographytreedefitem)
+@receiver(post_delete, sender=spmodels.Geographytreedefitem)
+@receiver(post_save, sender=spmodels.Storagetreedef)
+@receiver(post_delete, sender=spmodels.Storagetreedef)
+@receiver(post_save, sender=spmodels.Storagetreedefitem)
+@receiver(post_delete, sender=spmodels.Storagetreedefitem)
+@receiver(post_save, sender=spmodels.Geologictimeperiodtreedef)
+@receiver(post_delete, sender=spmodels.Geologictimeperiodtreedef)
+@receiver(post_save, sender=spmodels.Geologictimeperiodtreedefitem)
+@receiver(post_delete, sender=spmodels.Geologictimeperiodtreedefitem)
+@receiver(post_save, sender=spmodels.Lithostrattreedef)
+@receiver(post_delete, sender=spmodels.Lithostrattreedef)
+@receiver(post_save, sender=spmodels.Lithostrattreedefitem)
+@receiver(post_delete, sender=spmodels.Lithostrattreedefitem)
+@receiver(post_save, sender=spmodels.Splocalecontainer)
+@receiver(post_delete, sender=spmodels.Splocalecontainer)
+def plan_inputs_changed(sender, **kwargs):
+    invalidate_query_plans()
+
+def build_query(session, collection, user, tableid, field_specs, recordsetid=None, replace_nulls=False, formatauditobjs=False,
+                derived_aggregates=False, tree_ranks_by_nodenumber=None):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs.
 
-    session = an sqlalchemy Session instance.
+    session = an sqlalchemy Session instance, or None to build a query
+    that isn't bound to a session. A session is needed if recordsetid
+    is given.
 
     collection = an instance of specifyweb.specify.models.Collection.
     Returned records will be filtered to the scope of the collection.
@@ -477,14 +800,22 @@ def build_query(session, collection, user, tableid, field_specs, recordsetid=Non
     will be filtered to items from the given record set unless None.
 
     replace_nulls = if True, replace null values with ""
+
+    derived_aggregates = if True, aggregated to-many fields are computed
+    for all rows at once in derived tables joined to the query rather
+    than by a subquery for each row. See ObjectFormatter.aggregate.
+
+    tree_ranks_by_nodenumber = how tree rank columns are found. See
+    QueryConstruct.
     """
     model = models.models_by_tableid[tableid]
     id_field = getattr(model, model._id)
 
     query = QueryConstruct(
         collection=collection,
-        objectformatter=ObjectFormatter(collection, user, replace_nulls),
-        query=session.query(id_field),
+        objectformatter=ObjectFormatter(collection, user, replace_nulls, derived_aggregates),
+        query=orm.Query(id_field, session),
+        tree_ranks_by_nodenumber=tree_ranks_by_nodenumber,
     )
 
 
@@ -509,5 +840,7 @@ def build_query(session, collection, user, tableid, field_specs, recordsetid=Non
         if sort_type is not None:
             order_by_exprs.append(sort_type(field))
 
+    query = query.join_derived()
+
     logger.debug("query: %s", query.query)
     return query.query, order_by_exprs
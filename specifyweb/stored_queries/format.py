@@ -1,5 +1,4 @@
 import logging
-import re
 
 from xml.etree import ElementTree
 from xml.sax.saxutils import quoteattr
@@ -10,7 +9,7 @@ from sqlalchemy.sql.functions import concat, count
 from sqlalchemy import types
 
 from specifyweb.context.app_resource import get_app_resource
-from specifyweb.context.remote_prefs import get_remote_prefs
+from specifyweb.context.remote_prefs import parsed_remote_prefs
 from specifyweb.specify.models import datamodel, Spappresourcedata, Splocalecontainer, Splocalecontaineritem
 
 from . import models
@@ -25,7 +24,7 @@ Agent_model = datamodel.get_table('Agent')
 Spauditlog_model = datamodel.get_table('SpAuditLog')
 
 class ObjectFormatter(object):
-    def __init__(self, collection, user, replace_nulls):
+    def __init__(self, collection, user, replace_nulls, derived_aggregates=False):
         formattersXML, _ = get_app_resource(collection, user, 'DataObjFormatters')
         self.formattersDom = ElementTree.fromstring(formattersXML)
         self.date_format = get_date_format()
@@ -33,6 +32,7 @@ class ObjectFormatter(object):
         self.date_format_month = MYSQL_TO_MONTH.get(self.date_format)
         self.collection = collection
         self.replace_nulls = replace_nulls
+        self.derived_aggregates = derived_aggregates
 
     def getFormatterDef(self, specify_model, formatter_name):
         def lookup(attr, val):
@@ -141,12 +141,22 @@ class ObjectFormatter(object):
         return query, blank_nulls(expr)
 
     def aggregate(self, query, field, rel_table, aggregator_name):
+        """Return the query and a column giving the related objects of the
+        to-many 'field' of 'rel_table' formatted by the named aggregator.
+
+        By default the column is a scalar subquery correlated with the
+        rows of 'rel_table', which MySQL evaluates once per result row.
+        If derived_aggregates is set the related objects are instead
+        aggregated for all rows at once in a derived table grouped by
+        the foreign key, which QueryConstruct.join_derived outer joins
+        to the query restricted to the query's rows of 'rel_table'.
+        """
         logger.info('aggregating field %s on %s using %s', field, rel_table, aggregator_name)
         specify_model = datamodel.get_table(field.relatedModelName, strict=True)
         aggregatorNode = self.getAggregatorDef(specify_model, aggregator_name)
         if aggregatorNode is None:
             logger.warn("aggregator is not defined")
-            return literal("<Aggregator not defined.>")
+            return query, literal("<Aggregator not defined.>")
         logger.debug("using aggregator: %s", ElementTree.tostring(aggregatorNode))
         formatter_name = aggregatorNode.attrib.get('format', None)
         separator = aggregatorNode.attrib.get('separator', ',')
@@ -156,16 +166,31 @@ class ObjectFormatter(object):
         order_by = [getattr(orm_table, order_by)] if order_by != '' else []
 
         join_column = list(inspect(getattr(orm_table, field.otherSideName)).property.local_columns)[0]
+        rel_id = getattr(rel_table, rel_table._id)
+
+        if self.derived_aggregates:
+            subquery = QueryConstruct(
+                collection=query.collection,
+                objectformatter=self,
+                query=orm.Query([]).select_from(orm_table).filter(join_column != None)
+            )
+            subquery, formatted = self.objformat(subquery, orm_table, formatter_name)
+            aggregated = group_concat(formatted, separator, *order_by)
+            statement = subquery.query.add_columns(join_column.label('parent_id'), aggregated.label('aggregated')) \
+                        .group_by(join_column).statement
+            query, derived = query.add_derived_join(statement, join_column, rel_id)
+            return query, blank_nulls(derived.c.aggregated)
+
         subquery = QueryConstruct(
             collection=query.collection,
             objectformatter=self,
             query=orm.Query([]).select_from(orm_table) \
-                             .filter(join_column == getattr(rel_table, rel_table._id)) \
+                             .filter(join_column == rel_id) \
                              .correlate(rel_table)
         )
         subquery, formatted = self.objformat(subquery, orm_table, formatter_name)
         aggregated = blank_nulls(group_concat(formatted, separator, *order_by))
-        return subquery.query.add_column(aggregated).as_scalar()
+        return query, subquery.query.add_column(aggregated).as_scalar()
 
     def fieldformat(self, query_field, field):
         field_spec = query_field.fieldspec
@@ -226,8 +251,7 @@ class ObjectFormatter(object):
 
 
 def get_date_format():
-    match = re.search(r'ui\.formatting\.scrdateformat=(.+)', get_remote_prefs())
-    date_format = match.group(1).strip() if match is not None else 'yyyy-MM-dd'
+    date_format = parsed_remote_prefs().get('ui.formatting.scrdateformat', 'yyyy-MM-dd')
     mysql_date_format = LDLM_TO_MYSQL.get(date_format, "%Y-%m-%d")
     logger.debug("dateformat = %s = %s", date_format, mysql_date_format)
     return mysql_date_format
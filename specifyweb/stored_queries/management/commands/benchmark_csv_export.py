@@ -0,0 +1,71 @@
+import csv
+import os
+import re
+from random import Random
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from specifyweb.stored_queries.execution import write_csv, EXPORT_CHUNK_SIZE
+
+def synthetic_chunks(row_count, chunk_size):
+    """Yield lists of rows resembling those of a collection object export:
+    an id followed by catalog numbers, names, dates, numbers, blanks and
+    aggregated values, some of which contain line breaks.
+    """
+    random = Random(0)
+    names = ['Smith, J.', 'Doe, A.; Roe, B.', 'Garcia, M.', '', 'Nguyen, T.\nLee, K.']
+    for start in range(0, row_count, chunk_size):
+        yield [(i,
+                '%09d' % i,
+                random.choice(names),
+                '2019-%02d-%02d' % (i % 12 + 1, i % 28 + 1),
+                random.random() * 180 - 90,
+                i % 7 or None,
+                'Lot of %d specimens, "preserved"' % (i % 50))
+               for i in range(start, min(start + chunk_size, row_count))]
+
+def write_csv_by_row(path, chunks, strip_id=False):
+    """Write the rows as query_to_csv did before exports were chunked."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv_writer = csv.writer(f)
+        for chunk in chunks:
+            for row in chunk:
+                csv_writer.writerow([
+                    re.sub('\r|\n', ' ', str(f))
+                    for f in (row[1:] if strip_id else row)
+                ])
+
+class Command(BaseCommand):
+    help = 'Measures the rate at which synthetic query results are written to a CSV export.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='number of rows to export',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='number of rows written at a time',
+        )
+
+    def handle(self, **options):
+        rows, chunk_size = options['rows'], options['chunk_size']
+
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'by_row.csv')
+            start = default_timer()
+            write_csv_by_row(path, synthetic_chunks(rows, chunk_size), strip_id=True)
+            elapsed = default_timer() - start
+            self.stdout.write('by row: %d rows, %d bytes in %.2fs, %.0f rows/s' % (
+                rows, os.path.getsize(path), elapsed, rows / elapsed))
+
+            path = os.path.join(tmpdir, 'chunked.csv')
+            stats = write_csv(path, synthetic_chunks(rows, chunk_size), strip_id=True)
+            self.stdout.write('chunked: %d rows, %d bytes in %.2fs, %.0f rows/s' % (
+                stats.rows, stats.bytes, stats.seconds, stats.rows / stats.seconds))
@@ -0,0 +1,77 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify.models import Collection, Specifyuser, datamodel
+from specifyweb.stored_queries import models
+from specifyweb.stored_queries.execution import build_query
+from specifyweb.stored_queries.queryfield import QueryField
+from specifyweb.stored_queries.queryfieldspec import QueryFieldSpec
+
+# Collection object fields and fields reached through some of its
+# relationships, from which the query's fields are drawn.
+JOIN_PATHS = [
+    [],
+    ['cataloger'],
+    ['collectingEvent'],
+    ['collectingEvent', 'locality'],
+    ['accession'],
+]
+
+def make_paths(count):
+    paths = []
+    for join_path in JOIN_PATHS:
+        node = datamodel.get_table('collectionobject')
+        for name in join_path:
+            node = datamodel.get_table(node.get_field(name, strict=True).relatedModelName)
+        paths.extend(['collectionobject'] + join_path + [field.name] for field in node.fields)
+    return paths[:count]
+
+class Command(BaseCommand):
+    help = 'Measures the time to parse the fields of a collection object query and build it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='name of the specify user to build the query as')
+        parser.add_argument('collectionid', type=int, help='id of the collection to build the query in')
+        parser.add_argument(
+            '--fields',
+            type=int,
+            default=30,
+            help='number of fields in the query',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='number of times to build the query; the best is reported',
+        )
+
+    def handle(self, **options):
+        try:
+            user = Specifyuser.objects.get(name=options['username'])
+            collection = Collection.objects.get(id=options['collectionid'])
+        except (Specifyuser.DoesNotExist, Collection.DoesNotExist) as e:
+            raise CommandError(e)
+
+        stringids = [QueryFieldSpec.from_path(path).to_stringid()
+                     for path in make_paths(options['fields'])]
+        tableid = datamodel.get_table('collectionobject').tableId
+
+        parse_times = []
+        build_times = []
+        with models.session_context() as session:
+            for _ in range(options['repeat']):
+                start = default_timer()
+                field_specs = [
+                    QueryField(fieldspec=QueryFieldSpec.from_stringid(stringid, False),
+                               op_num=8, value='', negate=False, display=True,
+                               format_name=None, sort_type=0)
+                    for stringid in stringids]
+                parse_times.append(default_timer() - start)
+
+                start = default_timer()
+                build_query(session, collection, user, tableid, field_specs)
+                build_times.append(default_timer() - start)
+
+        self.stdout.write('%d fields: parse %.2fms, build %.2fms' % (
+            len(stringids), 1000 * min(parse_times), 1000 * min(build_times)))
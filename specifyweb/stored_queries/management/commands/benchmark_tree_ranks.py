@@ -0,0 +1,82 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify.models import Collection, Specifyuser, datamodel
+from specifyweb.stored_queries import models
+from specifyweb.stored_queries.execution import filter_by_collection, set_group_concat_max_len
+from specifyweb.stored_queries.format import ObjectFormatter
+from specifyweb.stored_queries.query_construct import QueryConstruct, tree_numbering_valid, get_treedef
+from specifyweb.stored_queries.queryfieldspec import QueryFieldSpec
+
+class Command(BaseCommand):
+    help = ('Compares the time to run a tree query with rank columns found by joining every '
+            'ancestor and by node number ranges.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='name of the specify user to run the query as')
+        parser.add_argument('collectionid', type=int, help='id of the collection whose tree is queried')
+        parser.add_argument(
+            '--tree',
+            default='Taxon',
+            help='name of the tree table to query',
+        )
+        parser.add_argument(
+            '--ranks',
+            nargs='+',
+            default=['Order', 'Family', 'Genus'],
+            help='names of the ranks to add columns for',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='number of rows to fetch; 0 fetches them all',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='number of times to run each query; the best is reported',
+        )
+
+    def handle(self, **options):
+        try:
+            user = Specifyuser.objects.get(name=options['username'])
+            collection = Collection.objects.get(id=options['collectionid'])
+        except (Specifyuser.DoesNotExist, Collection.DoesNotExist) as e:
+            raise CommandError(e)
+
+        table = datamodel.get_table(options['tree'], strict=True)
+        model = getattr(models, table.name)
+        field_specs = [QueryFieldSpec(root_table=table, join_path=[], table=table, date_part=None,
+                                      tree_rank=rank, tree_field=None)
+                       for rank in options['ranks']]
+
+        valid = tree_numbering_valid(table, get_treedef(collection, table.name))
+        self.stdout.write('node numbers %s valid' % ('are' if valid else 'are not known to be'))
+
+        with models.session_context() as session:
+            set_group_concat_max_len(session)
+            for label, by_nodenumber in (('ancestor joins', False), ('node numbers', True)):
+                query = QueryConstruct(
+                    collection=collection,
+                    objectformatter=ObjectFormatter(collection, user, False),
+                    query=session.query(getattr(model, model._id)),
+                    tree_ranks_by_nodenumber=by_nodenumber,
+                )
+                query = filter_by_collection(model, query, collection)
+                for fs in field_specs:
+                    query, field = fs.add_to_query(query)
+                    query = query.add_columns(field)
+
+                query = query.query
+                if options['limit']:
+                    query = query.limit(options['limit'])
+
+                times = []
+                for _ in range(options['repeat']):
+                    start = default_timer()
+                    rows = sum(1 for _ in query)
+                    times.append(default_timer() - start)
+                self.stdout.write('%s: %d rows in %.3fs' % (label, rows, min(times)))
@@ -1,12 +1,16 @@
 from contextlib import contextmanager
+from threading import RLock
 
 from MySQLdb.cursors import SSCursor
 import sqlalchemy
+from sqlalchemy import inspection
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.base import _inspect_mapped_class
 
 from django.conf import settings
 
 from specifyweb.specify.models import datamodel
+from specifyweb.specify.startup import timed
 from . import build_models
 
 engine = sqlalchemy.create_engine(settings.SA_DATABASE_URL, pool_recycle=settings.SA_POOL_RECYCLE,
@@ -15,6 +19,7 @@ Session = sessionmaker(bind=engine)
 
 @contextmanager
 def session_context():
+    map_models()
     session = Session()
     try:
         yield session
@@ -25,10 +30,52 @@ def session_context():
     finally:
         session.close()
 
+class LazilyMapped(type):
+    """Metaclass of the model classes that maps them to their tables
+    the first time an attribute they don't have yet is looked up.
+    """
+    def __getattr__(cls, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        map_models()
+        return type.__getattribute__(cls, name)
+
+# Session.query, orm.aliased and the like find the mappers of classes
+# through sqlalchemy.inspect, so the classes are mapped when that is
+# first called on one of them.
+@inspection._inspects(LazilyMapped)
+def _inspect_lazily_mapped(cls, configure=False):
+    map_models()
+    return _inspect_mapped_class(cls, configure=configure)
+
+_mapping_state = None
+_mapping_lock = RLock()
+
+def map_models():
+    """Map the model classes to their tables if that hasn't been done
+    yet. Mapping all of them takes a noticeable part of a process's
+    startup time, so it is put off until they are first used.
+    """
+    global _mapping_state
+    if _mapping_state == 'mapped': return
+    with _mapping_lock:
+        # Looking up attributes of the classes while they are being
+        # mapped must not start mapping them again.
+        if _mapping_state is not None: return
+        _mapping_state = 'mapping'
+        try:
+            with timed('map sqlalchemy classes'):
+                build_models.map_classes(datamodel, tables, classes)
+        except:
+            _mapping_state = None
+            raise
+        _mapping_state = 'mapped'
+
 def generate_models():
-    tables = build_models.make_tables(datamodel)
-    classes = build_models.make_classes(datamodel)
-    build_models.map_classes(datamodel, tables, classes)
+    with timed('build sqlalchemy tables'):
+        tables = build_models.make_tables(datamodel)
+    with timed('build sqlalchemy classes'):
+        classes = build_models.make_classes(datamodel, LazilyMapped)
     return tables, classes
 
 tables, classes = generate_models()
@@ -37,4 +84,4 @@ models_by_tableid = dict((cls.tableid, cls) for cls in list(classes.values()))
 
 globals().update(classes)
 
-__all__ = ['session_context', 'tables', 'classes', 'models_by_tableid'] + list(classes.keys())
+__all__ = ['session_context', 'map_models', 'tables', 'classes', 'models_by_tableid'] + list(classes.keys())
@@ -2,23 +2,89 @@ import logging
 from collections import namedtuple, deque
 
 from sqlalchemy import orm, sql
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from specifyweb.specify.models import datamodel
+from specifyweb.specify import models as spmodels
+from specifyweb.specify.models import datamodel, Sptasksemaphore
+from specifyweb.specify.cache import ProcessCache
 
 from . import models
 
 logger = logging.getLogger(__name__)
 
+# Whether the node numbers of a tree are valid is remembered for this
+# many seconds for each tree definition. Saving or deleting a tree node
+# or task semaphore in this process, which includes renumbering the
+# tree, drops the remembered results for the tree; changes by other
+# processes are seen once they expire.
+NUMBERING_TTL = 60
+
+_numbering_valid = ProcessCache('tree numbering validity', maxsize=100, ttl=NUMBERING_TTL)
+
+def tree_numbering_valid(table, treedef):
+    """Return True if the nodes of 'treedef' are known to have valid node
+    numbers. Specify 6 flags trees whose numbers need updating with a
+    locked task semaphore, and leaves the numbers of new nodes empty.
+    """
+    return _numbering_valid.get((table.name, treedef.id), lambda: check_tree_numbering(table, treedef))
+
+def check_tree_numbering(table, treedef):
+    tasknames = [name.format(table.name) for name in ("UpdateNodes{}", "BadNodes{}")]
+    if Sptasksemaphore.objects.filter(taskname__in=tasknames, islocked=True).exists():
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute((
+            "select 1 from {table} where {table}treedefid = %s\n"
+            "and (nodenumber is null or highestchildnodenumber is null) limit 1"
+        ).format(table=table.table), [treedef.id])
+        return cursor.fetchone() is None
+
+@receiver(post_save, sender=spmodels.Taxon)
+@receiver(post_delete, sender=spmodels.Taxon)
+@receiver(post_save, sender=spmodels.Geography)
+@receiver(post_delete, sender=spmodels.Geography)
+@receiver(post_save, sender=spmodels.Storage)
+@receiver(post_delete, sender=spmodels.Storage)
+@receiver(post_save, sender=spmodels.Geologictimeperiod)
+@receiver(post_delete, sender=spmodels.Geologictimeperiod)
+@receiver(post_save, sender=spmodels.Lithostrat)
+@receiver(post_delete, sender=spmodels.Lithostrat)
+def tree_changed(sender, **kwargs):
+    tree_name = sender.specify_model.name
+    _numbering_valid.invalidate_where(lambda key: key[0] == tree_name)
+
+@receiver(post_save, sender=Sptasksemaphore)
+@receiver(post_delete, sender=Sptasksemaphore)
+def task_semaphore_changed(sender, **kwargs):
+    _numbering_valid.invalidate()
+
 
 def get_treedef(collection, tree_name):
     return (collection.discipline.division.institution.storagetreedef
             if tree_name == 'Storage' else
             getattr(collection.discipline, tree_name.lower() + "treedef"))
 
-class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter query join_cache param_count')):
+def tree_numbering(collection, fieldspecs):
+    """Return whether the node numbers are valid for each tree whose
+    ranks are queried by the QueryFieldSpecs 'fieldspecs', by tree name.
+    """
+    tables = {fs.table.name: fs.table for fs in fieldspecs if fs.tree_rank is not None}
+    return {name: tree_numbering_valid(table, get_treedef(collection, name))
+            for name, table in tables.items()}
+
+class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter query join_cache param_count tree_ranks_by_nodenumber derived_joins')):
     def __new__(cls, *args, **kwargs):
         kwargs['join_cache'] = dict()
         kwargs['param_count'] = 0
+        kwargs['derived_joins'] = ()
+        # Either a bool choosing how tree rank columns are found for all
+        # trees or a dict of them by tree name, as from tree_numbering.
+        # None, or a tree missing from the dict, is decided by whether
+        # the tree's node numbers are valid.
+        kwargs.setdefault('tree_ranks_by_nodenumber', None)
         return super(QueryConstruct, cls).__new__(cls, *args, **kwargs)
 
     def handle_tree_field(self, node, table, tree_rank, tree_field):
@@ -26,6 +92,14 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
         assert query.collection is not None # Not sure it makes sense to query across collections
         logger.info('handling treefield %s rank: %s field: %s', table, tree_rank, tree_field)
 
+        by_nodenumber = query.tree_ranks_by_nodenumber
+        if isinstance(by_nodenumber, dict):
+            by_nodenumber = by_nodenumber.get(table.name)
+        if by_nodenumber is None:
+            by_nodenumber = tree_numbering_valid(table, get_treedef(query.collection, table.name))
+        if by_nodenumber:
+            return query.handle_tree_field_by_nodenumber(node, table, tree_rank, tree_field)
+
         treedefitem_column = table.name + 'TreeDefItemID'
 
         if (table, 'TreeRanks') in query.join_cache:
@@ -59,6 +133,62 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
 
         return query, column
 
+    def handle_tree_field_by_nodenumber(self, node, table, tree_rank, tree_field):
+        """Like handle_tree_field, but joins the single ancestor at the
+        rank, found as the node whose node number range includes the
+        node's number, instead of every ancestor.
+        """
+        query = self
+
+        if (node, 'TreeRank', tree_rank) in query.join_cache:
+            logger.debug("using join cache for %r rank %s.", table, tree_rank)
+            ancestor = query.join_cache[(node, 'TreeRank', tree_rank)]
+        else:
+            treedef = get_treedef(query.collection, table.name)
+            treedef_column = table.name + 'TreeDefID'
+
+            query = query._replace(param_count=self.param_count+1)
+            treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=treedef.treedefitems.get(name=tree_rank).id)
+
+            ancestor = orm.aliased(getattr(models, table.name))
+            query = query.outerjoin(ancestor, sql.and_(
+                getattr(ancestor, table.name + 'TreeDefItemID') == treedefitem_param,
+                getattr(ancestor, treedef_column) == getattr(node, treedef_column),
+                node.nodeNumber.between(ancestor.nodeNumber, ancestor.highestChildNodeNumber)))
+
+            logger.debug("adding to join cache for %r rank %s.", table, tree_rank)
+            query = query._replace(join_cache=query.join_cache.copy())
+            query.join_cache[(node, 'TreeRank', tree_rank)] = ancestor
+
+        column_name = 'name' if tree_field is None else \
+                      node._id if tree_field == 'ID' else \
+                      table.get_field(tree_field.lower()).name
+
+        return query, getattr(ancestor, column_name)
+
+    def add_derived_join(self, statement, join_column, parent_id):
+        """Return the query with the select 'statement', which has
+        'parent_id' and 'aggregated' columns, to be outer joined on
+        'parent_id' by join_derived, and the alias it will be joined as.
+        """
+        derived = statement.alias()
+        query = self._replace(derived_joins=self.derived_joins + ((statement, join_column, derived, parent_id),))
+        return query, derived
+
+    def join_derived(self):
+        """Outer join the derived tables added by add_derived_join,
+        restricting each to the rows whose 'join_column' is one of the
+        parent ids the query selects. Done once the query's joins and
+        filters are all added, so that the restriction includes them
+        but none of the derived tables.
+        """
+        query = self
+        for statement, join_column, derived, parent_id in self.derived_joins:
+            parent_ids = self.query.with_entities(parent_id).correlate(None).statement
+            statement.append_whereclause(join_column.in_(parent_ids))
+            query = query.outerjoin(derived, derived.c.parent_id == parent_id)
+        return query._replace(derived_joins=())
+
     def build_join(self, table, model, join_path):
         query = self
         path = deque(join_path)
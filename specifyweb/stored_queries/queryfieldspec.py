@@ -201,7 +201,7 @@ class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table da
                 query, orm_field = query.objectformatter.objformat(query, orm_model, formatter)
             else:
                 query, orm_model, table, field = self.build_join(query, self.join_path[:-1])
-                orm_field = query.objectformatter.aggregate(query, self.get_field(), orm_model, formatter)
+                query, orm_field = query.objectformatter.aggregate(query, self.get_field(), orm_model, formatter)
         else:
             query, orm_model, table, field = self.build_join(query, self.join_path)
 
@@ -1,9 +1,22 @@
+import csv
+import io
+import os
+import re
+import sqlalchemy
+from concurrent.futures import Future
+from tempfile import TemporaryDirectory
 from sqlalchemy import orm
-from unittest import skip
+from sqlalchemy.pool import StaticPool
+from unittest import skip, mock
 
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+
+from specifyweb.specify import models as spmodels
 from specifyweb.specify.api_tests import ApiTests
 from .queryfieldspec import QueryFieldSpec
-from . import models
+from . import models, execution, query_construct
 
 @skip("These tests are out of date.")
 class StoredQueriesTests(ApiTests):
@@ -278,3 +291,367 @@ class StoredQueriesTests(ApiTests):
     #     self.assertEqual(params, (7, 1, 2, 8, 1, 2))
 
 
+
+
+class QueryPlanTests(ApiTests):
+    tableid = 1
+
+    def setUp(self):
+        super(QueryPlanTests, self).setUp()
+        execution.invalidate_query_plans()
+
+    def field(self, **values):
+        data = dict(stringId='1.collectionobject.catalogNumber', isRelFld=False,
+                    operStart=1, startValue='', isNot=False, isDisplay=True,
+                    sortType=0, formatName=None)
+        data.update(values)
+        return execution.EphemeralField(**data)
+
+    def key(self, fields, **kwargs):
+        return execution.plan_key(self.collection, self.specifyuser, self.tableid, fields, False, **kwargs)
+
+    def plan(self, fields):
+        return execution.get_query_plan(None, self.collection, self.specifyuser, self.tableid, fields)
+
+    def test_plan_key(self):
+        key = self.key([self.field()])
+        self.assertEqual(key, self.key([self.field()]))
+        self.assertNotEqual(key, self.key([self.field(stringId='1.collectionobject.remarks')]))
+        self.assertNotEqual(key, self.key([self.field(startValue='num-1')]))
+        self.assertNotEqual(key, self.key([self.field(formatName='other')]))
+        self.assertNotEqual(key, self.key([self.field(), self.field(stringId='1.collectionobject.remarks')]))
+        self.assertNotEqual(key, self.key([self.field()], derived_aggregates=True))
+
+    def test_plan_key_formatters(self):
+        with mock.patch.object(execution, 'get_app_resource', return_value=('<formatters/>', None)):
+            key = self.key([self.field()])
+        with mock.patch.object(execution, 'get_app_resource', return_value=('<formatters></formatters>', None)):
+            self.assertNotEqual(key, self.key([self.field()]))
+
+    def test_plan_reused(self):
+        query, __ = self.plan([self.field()])
+        hits = execution.query_plan_cache_stats()['hits']
+        cached, __ = self.plan([self.field()])
+        self.assertEqual(execution.query_plan_cache_stats()['hits'], hits + 1)
+        self.assertEqual(str(cached), str(query))
+        self.assertIsNone(cached.session)
+
+    def test_changed_definition_rebuilt(self):
+        self.plan([self.field()])
+        misses = execution.query_plan_cache_stats()['misses']
+        query, __ = self.plan([self.field(startValue='num-1')])
+        self.assertEqual(execution.query_plan_cache_stats()['misses'], misses + 1)
+        self.assertIn('num-1', str(query.statement.compile(compile_kwargs={'literal_binds': True})))
+
+    def test_tree_definition_change_invalidates(self):
+        self.plan([self.field()])
+        self.assertEqual(execution.query_plan_cache_stats()['size'], 1)
+        self.geographytreedef.treedefitems.create(name="Continent", rankid="100")
+        self.assertEqual(execution.query_plan_cache_stats()['size'], 0)
+
+def django_session():
+    """Return an sqlalchemy session on the Django test database
+    connection, so that it sees the records created by the test.
+    """
+    connection.ensure_connection()
+    engine = sqlalchemy.create_engine('mysql://', creator=lambda: connection.connection,
+                                      poolclass=StaticPool, pool_reset_on_return=None)
+    return orm.Session(bind=engine)
+
+class InlineExecutor:
+    "Runs the submitted counts on the test's connection."
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+class CountTests(ApiTests):
+    tableid = 1
+
+    def setUp(self):
+        super(CountTests, self).setUp()
+        execution._counts.invalidate()
+        for i in range(2):
+            self.collectionobjects[0].determinations.create(iscurrent=False, remarks='same')
+        self.session = django_session()
+
+    def tearDown(self):
+        self.session.close()
+        super(CountTests, self).tearDown()
+
+    def fields(self):
+        return [execution.EphemeralField(
+            stringId=stringid, isRelFld=False, operStart=8, startValue='',
+            isNot=False, isDisplay=True, sortType=0, formatName=None)
+                for stringid in ('1.collectionobject.catalogNumber',
+                                 '1,9-determinations.determination.remarks')]
+
+    def execute(self, distinct, count_only, include_count=False):
+        return execution.execute(self.session, self.collection, self.specifyuser, self.tableid,
+                                 distinct, count_only, self.fields(), limit=0, offset=0,
+                                 include_count=include_count)
+
+    def test_count(self):
+        results = self.execute(distinct=False, count_only=False)['results']
+        self.assertEqual(len(results), 6)
+        self.assertEqual(self.execute(distinct=False, count_only=True), {'count': 6})
+
+    def test_distinct_count(self):
+        results = self.execute(distinct=True, count_only=False)['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.execute(distinct=True, count_only=True), {'count': 5})
+
+    def test_count_query(self):
+        for distinct in (False, True):
+            query, __ = execution.get_query_plan(self.session, self.collection, self.specifyuser,
+                                                 self.tableid, self.fields())
+            if distinct:
+                query = query.distinct()
+            counter = execution.count_query(query, models.CollectionObject.collectionObjectId, distinct)
+            self.assertEqual(counter.count(), len(list(query)))
+
+    def test_include_count(self):
+        with mock.patch.object(execution, '_count_executor', InlineExecutor()), \
+             mock.patch.object(execution, 'count_in_new_session', execution.get_count):
+            for distinct in (False, True):
+                data = self.execute(distinct, count_only=False, include_count=True)
+                self.assertEqual(data['count'], len(data['results']))
+
+    def test_save_invalidates_count(self):
+        self.assertEqual(self.execute(distinct=False, count_only=True), {'count': 6})
+        self.assertEqual(execution.query_count_cache_stats()['size'], 1)
+        spmodels.Collectionobject.objects.create(collection=self.collection, catalognumber='num-5')
+        self.assertEqual(execution.query_count_cache_stats()['size'], 0)
+        self.assertEqual(self.execute(distinct=False, count_only=True), {'count': 7})
+
+    def test_joined_table_invalidates_count(self):
+        self.execute(distinct=False, count_only=True)
+        self.collectionobjects[0].determinations.create(iscurrent=False)
+        self.assertEqual(execution.query_count_cache_stats()['size'], 0)
+        self.assertEqual(self.execute(distinct=False, count_only=True), {'count': 7})
+
+    def test_other_table_keeps_count(self):
+        self.execute(distinct=False, count_only=True)
+        self.collectingevent.save()
+        self.assertEqual(execution.query_count_cache_stats()['size'], 1)
+
+class TreeRankTests(ApiTests):
+    tableid = 3
+
+    def setUp(self):
+        super(TreeRankTests, self).setUp()
+        execution.invalidate_query_plans()
+        query_construct._numbering_valid.invalidate()
+        planet = self.geographytreedef.treedefitems.get(name="Planet")
+        continent = planet.children.create(name="Continent", treedef=self.geographytreedef, rankid=100)
+        country = continent.children.create(name="Country", treedef=self.geographytreedef, rankid=200)
+
+        earth = spmodels.Geography.objects.create(
+            name="Earth", definition=self.geographytreedef, definitionitem=planet)
+        for continent_name, countries in (("Asia", ["China", "Japan"]), ("Africa", ["Kenya"]), ("Europe", [])):
+            node = earth.children.create(name=continent_name, definition=self.geographytreedef,
+                                         definitionitem=continent)
+            for country_name in countries:
+                node.children.create(name=country_name, definition=self.geographytreedef,
+                                     definitionitem=country)
+        self.session = django_session()
+
+    def tearDown(self):
+        self.session.close()
+        super(TreeRankTests, self).tearDown()
+
+    def fields(self):
+        return [execution.EphemeralField(
+            stringId=stringid, isRelFld=False, operStart=8, startValue='',
+            isNot=False, isDisplay=True, sortType=0, formatName=None)
+                for stringid in ('3.geography.name', '3.geography.Continent',
+                                 '3.geography.Country', '3.geography.Continent ID')]
+
+    def rows(self, by_nodenumber):
+        query, __ = execution.build_query(
+            self.session, self.collection, self.specifyuser, self.tableid,
+            [execution.QueryField.from_spqueryfield(field) for field in self.fields()],
+            tree_ranks_by_nodenumber=by_nodenumber)
+        return sorted(query)
+
+    def test_strategies_agree(self):
+        rows = self.rows(False)
+        self.assertEqual(rows, self.rows(True))
+        self.assertEqual(rows, self.rows({'Geography': True}))
+        asia = spmodels.Geography.objects.get(name="Asia")
+        names = {row[1]: row[2:] for row in rows}
+        self.assertEqual(names['Earth'], (None, None, None))
+        self.assertEqual(names['Asia'], ('Asia', None, asia.id))
+        self.assertEqual(names['Japan'], ('Asia', 'Japan', asia.id))
+        self.assertEqual(names['Kenya'][:2], ('Africa', 'Kenya'))
+
+    def test_numbering_checked(self):
+        self.assertEqual(execution.fields_tree_numbering(self.collection, self.fields()), {'Geography': True})
+        spmodels.Sptasksemaphore.objects.create(taskname='UpdateNodesGeography', islocked=True)
+        self.assertEqual(execution.fields_tree_numbering(self.collection, self.fields()), {'Geography': False})
+
+    def test_numbering_in_plan_key(self):
+        key = execution.plan_key(self.collection, self.specifyuser, self.tableid, self.fields(), False)
+        spmodels.Geography.objects.filter(name="Kenya").update(nodenumber=None)
+        self.assertEqual(key, execution.plan_key(
+            self.collection, self.specifyuser, self.tableid, self.fields(), False))
+        # As when the remembered validity expires.
+        query_construct._numbering_valid.invalidate()
+        self.assertNotEqual(key, execution.plan_key(
+            self.collection, self.specifyuser, self.tableid, self.fields(), False))
+
+    def test_numbering_remembered(self):
+        def checks():
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(execution.fields_tree_numbering(self.collection, self.fields()),
+                                 {'Geography': True})
+            return [q for q in context.captured_queries if 'sptasksemaphore' in q['sql']]
+
+        self.assertEqual(len(checks()), 1)
+        self.assertEqual(checks(), [])
+        spmodels.Geography.objects.get(name="Japan").save()
+        self.assertEqual(len(checks()), 1)
+
+    def test_no_tree_ranks(self):
+        fields = self.fields()[:1]
+        self.assertEqual(execution.fields_tree_numbering(self.collection, fields), {})
+
+AGGREGATING_FORMATTERS = """
+<formatters>
+  <format name="Determination" title="Determination" class="edu.ku.brc.specify.datamodel.Determination" default="true">
+    <switch single="true">
+      <fields>
+        <field>remarks</field>
+      </fields>
+    </switch>
+  </format>
+  <aggregators>
+    <aggregator name="Determination" title="Determination" class="edu.ku.brc.specify.datamodel.Determination"
+                default="true" separator=" | " format="Determination" orderfieldname="number1"/>
+  </aggregators>
+</formatters>
+"""
+
+class AggregateTests(ApiTests):
+    tableid = 1
+
+    def setUp(self):
+        super(AggregateTests, self).setUp()
+        execution.invalidate_query_plans()
+        execution._counts.invalidate()
+        for number, remarks in ((2, 'b'), (1, 'a, "quoted"'), (3, 'c\nd')):
+            self.collectionobjects[0].determinations.create(iscurrent=False, number1=number, remarks=remarks)
+        self.collectionobjects[1].determinations.create(iscurrent=True, number1=1, remarks='e')
+
+        other_collection = spmodels.Collection.objects.create(
+            catalognumformatname='test',
+            collectionname='OtherCollection',
+            isembeddedcollectingevent=False,
+            discipline=self.discipline)
+        spmodels.Collectionobject.objects.create(
+            collection=other_collection, catalognumber='num-0').determinations.create(
+                iscurrent=True, number1=1, remarks='other')
+
+        patcher = mock.patch('specifyweb.stored_queries.format.get_app_resource',
+                             return_value=(AGGREGATING_FORMATTERS, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = django_session()
+
+    def tearDown(self):
+        self.session.close()
+        super(AggregateTests, self).tearDown()
+
+    def fields(self):
+        return [execution.EphemeralField(
+            stringId=stringid, isRelFld=is_rel, operStart=8, startValue='',
+            isNot=False, isDisplay=True, sortType=0, formatName=None)
+                for stringid, is_rel in (('1.collectionobject.catalogNumber', False),
+                                         ('1,9-determinations.collectionobject.determinations', True))]
+
+    def build(self, derived_aggregates):
+        query, __ = execution.build_query(
+            self.session, self.collection, self.specifyuser, self.tableid,
+            [execution.QueryField.from_spqueryfield(field) for field in self.fields()],
+            replace_nulls=True, derived_aggregates=derived_aggregates)
+        return query
+
+    def test_derived_matches_correlated(self):
+        correlated = sorted(self.build(False))
+        self.assertEqual(sorted(self.build(True)), correlated)
+        aggregated = {row[1]: row[2] for row in correlated}
+        self.assertEqual(aggregated['num-0'], 'a, "quoted" | b | c\nd')
+        self.assertEqual(aggregated['num-1'], 'e')
+        self.assertEqual(aggregated['num-2'], '')
+        self.assertEqual(len(correlated), len(self.collectionobjects))
+
+    def test_derived_restricted_to_results(self):
+        sql = str(self.build(True).statement.compile(compile_kwargs={'literal_binds': True}))
+        self.assertEqual(sql.count('GROUP BY'), 1)
+        self.assertIn(' IN (SELECT ', sql)
+
+    def execute(self, limit):
+        with mock.patch.object(execution, 'get_app_resource', return_value=(AGGREGATING_FORMATTERS, None)):
+            return execution.execute(self.session, self.collection, self.specifyuser, self.tableid,
+                                     False, False, self.fields(), limit=limit, offset=0)['results']
+
+    def derived_plans(self):
+        return [key for key in execution._plans._entries if key[4]]
+
+    def test_small_limit_correlated(self):
+        self.assertEqual(len(self.execute(limit=2)), 2)
+        self.assertEqual(self.derived_plans(), [])
+
+    def test_unlimited_results_derived(self):
+        with mock.patch.object(execution, 'get_count', wraps=execution.get_count) as get_count:
+            results = self.execute(limit=0)
+        get_count.assert_not_called()
+        self.assertEqual(len(self.derived_plans()), 1)
+        self.assertEqual({row[1]: row[2] for row in results},
+                         {row[1]: row[2] for row in self.build(False)})
+
+    def test_export_derived_without_count(self):
+        fields = [execution.QueryField.from_spqueryfield(field) for field in self.fields()]
+        with mock.patch.object(execution, 'build_query', wraps=execution.build_query) as build_query:
+            execution.build_export_query(self.session, self.collection, self.specifyuser, self.tableid, fields)
+        self.assertEqual(build_query.call_count, 1)
+        self.assertTrue(build_query.call_args[1]['derived_aggregates'])
+
+def csv_by_row(rows, strip_id=False):
+    "Render the rows as query_to_csv did before exports were chunked."
+    out = io.StringIO(newline='')
+    csv_writer = csv.writer(out)
+    for row in rows:
+        csv_writer.writerow([
+            re.sub('\r|\n', ' ', str(f))
+            for f in (row[1:] if strip_id else row)
+        ])
+    return out.getvalue().encode('utf-8')
+
+CSV_ROWS = [
+    (1, 'plain', 2.5, None, True),
+    (2, 'line\r\nbreaks\nand\rreturns', '', 0, False),
+    (3, 'nul\0inside', 'comma, "quotes"', -1, None),
+    (4, '\0', '\0\0', 'unicode \u00e9\u4e2d', '\r'),
+]
+
+class ExportCsvTests(SimpleTestCase):
+    def test_encode_csv_chunk(self):
+        for rows in (CSV_ROWS, CSV_ROWS[:2], CSV_ROWS[3:], []):
+            self.assertEqual(execution.encode_csv_chunk(rows), csv_by_row(rows))
+
+    def test_encode_csv_chunk_ragged(self):
+        rows = [row[:i] for i, row in enumerate(CSV_ROWS, 2)]
+        self.assertEqual(execution.encode_csv_chunk(rows), csv_by_row(rows))
+
+    def test_write_csv(self):
+        chunks = [CSV_ROWS[:3], [], CSV_ROWS[3:]]
+        with TemporaryDirectory() as tmpdir:
+            for strip_id in (False, True):
+                path = os.path.join(tmpdir, 'export.csv')
+                stats = execution.write_csv(path, iter(chunks), header=['a', 'b\nc'], strip_id=strip_id)
+                with open(path, 'rb') as f:
+                    written = f.read()
+                expected = csv_by_row([['a', 'b\nc']]) + csv_by_row(CSV_ROWS, strip_id)
+                self.assertEqual(written, expected)
+                self.assertEqual((stats.rows, stats.bytes), (len(CSV_ROWS), len(expected)))
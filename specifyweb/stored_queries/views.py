@@ -12,8 +12,7 @@ from ..specify.api import toJson, uri_for_model
 from ..specify.views import login_maybe_required, apply_access_control
 
 from . import models
-from .queryfield import QueryField
-from .execution import execute, run_ephemeral_query, do_export, recordset
+from .execution import execute, ephemeral_field, run_ephemeral_query, do_export, recordset
 
 logger = logging.getLogger(__name__)
 
@@ -36,11 +35,11 @@ def query(request, id):
         tableid = sp_query.contextTableId
         count_only = sp_query.countOnly
 
-        field_specs = [QueryField.from_spqueryfield(field, value_from_request(field, request.GET))
-                       for field in sorted(sp_query.fields, key=lambda field: field.position)]
+        fields = [ephemeral_field(field, value_from_request(field, request.GET))
+                  for field in sorted(sp_query.fields, key=lambda field: field.position)]
 
         data = execute(session, request.specify_collection, request.specify_user,
-                       tableid, distinct, count_only, field_specs, limit, offset)
+                       tableid, distinct, count_only, fields, limit, offset)
 
     return HttpResponse(toJson(data), content_type='application/json')
 